@@ -20,9 +20,8 @@ export default function NFDetailsPageClient({ params }: { params: Promise<{ nfId
   useEffect(() => {
     const loadNF = async () => {
       try {
-        const res = await fetch(API_URL);
-        const data = await res.json();
-        const foundNF = data.find((n: any) => n._id.toString() === nfId);
+        const res = await fetch(`${API_URL}/${encodeURIComponent(nfId)}`);
+        const foundNF = res.ok ? await res.json() : null;
         
         if (!foundNF) {
           setError(`NF with ID ${nfId} not found`);
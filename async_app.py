@@ -0,0 +1,377 @@
+"""
+Asyncio variant of the dashboard read endpoints, on Quart (the asyncio
+re-implementation of the Flask API) with Motor and aiohttp:
+
+    slice.py          /api/slices, /api/markets, /api/markets/<id>/<nf>/<name>
+    table_back.py     /api/servers, /api/data
+    dash_backend.py   /api/nfs, /api/nfs/<nf_id>
+    flask_back.py     /api/form (GET), /api/forms, /api/form/metrics
+    gitdff.py         /api/diff, /api/diff/tree
+
+URLs, query parameters and response bodies are the same as in the sync apps,
+so a proxy can send these GET routes here and everything else (uploads, form
+and NF saves) to the sync apps. A slow aggregation or GitLab call only parks
+its coroutine instead of holding a worker thread, and independent calls run
+concurrently: both branches of a diff, the page and the next-page cursor of a
+listing, a market and its nodes. A form and its version list are fetched
+concurrently (form_repository.form_lookup and list_versions). Diffing is
+CPU-bound and runs on a thread pool so it does not stall the event loop.
+
+There is no response cache here (response_cache.py is Flask-specific); the
+rendered-diff cache and the GitLab blob cache work as in gitdff.py.
+
+    hypercorn async_app:app --bind 0.0.0.0:8000 --workers 4
+    uvicorn async_app:app --port 8000 --workers 4
+
+Settings: MONGO_URI, DB_NAME (markets), SPLIT_MARKET_NODES, the GITLAB_*
+variables of gitlab_client.py, GITLAB_DEFAULT_FILE, DIFF_CACHE_BYTES and
+DIFF_TREE_WORKERS.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, Response, jsonify, request
+
+from form_repository import (METRICS_PROJECTION, VERSIONS_PROJECTION, assemble_async, completion_stats,
+                             form_lookup, metrics_query, summarize_metrics)
+from gitlab_client import TRANSPORT_ERRORS, AsyncGitLabClient, BlobCache, GitLabError
+from json_stream import aiter_json_array, dumps
+from listing import (MARKET_FILTERS, MARKET_SORT, MAX_PAGE_SIZE, filters, market_cursor, market_fields, market_row,
+                     next_after, page_edge, page_limit, parse_after)
+from market_nodes import NODES_COLLECTION, NodeQuery, collection_pipeline, embedded_pipeline, parse_node_page
+from nf_sync import NF_FILTERS, NF_SORT, nf_projection
+from response_cache import VERSIONS_COLLECTION
+from slice_rollup import LIVE_SLICES, ROLLUP_COLLECTION, SLICE_PIPELINE, is_current, to_slice
+from step_counts import build_result, data_pipeline
+from text_diff import (MAX_TREE_FILES, changed_paths, diff_args, render_diff, tree_args, tree_error_line,
+                       tree_file_head, tree_file_line, tree_file_result, tree_tail_lines)
+
+load_dotenv()
+app = Quart(__name__)
+
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+DEFAULT_FILE_PATH = os.environ.get('GITLAB_DEFAULT_FILE', 'path/to/file.txt')
+DIFF_TREE_WORKERS = int(os.environ.get('DIFF_TREE_WORKERS', '8'))
+rendered = BlobCache(max_bytes=int(os.environ.get('DIFF_CACHE_BYTES', str(32 * 1024 * 1024))))
+diff_pool = ThreadPoolExecutor(max_workers=DIFF_TREE_WORKERS, thread_name_prefix='diff')
+
+# Created per worker once its event loop runs (Motor and aiohttp clients are bound to a loop)
+mongo = None
+gitlab = None
+
+
+@app.before_serving
+async def connect():
+    global mongo, gitlab
+    mongo = AsyncIOMotorClient(MONGO_URI)
+    gitlab = AsyncGitLabClient()
+
+
+@app.after_serving
+async def disconnect():
+    mongo.close()
+    await gitlab.close()
+
+
+@app.after_request
+async def allow_cors(response):
+    # slice.py and table_back.py are served with flask_cors defaults
+    response.headers.setdefault('Access-Control-Allow-Origin', '*')
+    response.headers.setdefault('Access-Control-Expose-Headers', 'X-Next-After')
+    return response
+
+
+def json_response(doc, status=200, headers=None):
+    return Response(dumps(doc), status=status, mimetype='application/json', headers=headers)
+
+
+def markets_db():
+    return mongo[os.environ.get('DB_NAME', 'slices')]
+
+
+async def page_cursor(collection, query, sort, limit, cursor_of):
+    # The page boundary, looked up from the index alone (as in the sync apps)
+    return next_after(await page_edge(collection, query, sort, limit).to_list(2), cursor_of)
+
+
+# slice.py
+
+@app.route('/api/slices')
+async def get_slices():
+    db = markets_db()
+    states = {d['_id']: d async for d in db[VERSIONS_COLLECTION].find({'_id': {'$in': ['markets', ROLLUP_COLLECTION]}})}
+    if is_current(states.get('markets'), states.get(ROLLUP_COLLECTION)):
+        totals = await db[ROLLUP_COLLECTION].find(LIVE_SLICES).sort('_id', 1).to_list(None)
+    else:
+        # No rollup yet or markets changed behind it (the sync app rebuilds it): compute the totals directly
+        totals = sorted(await db.markets.aggregate(SLICE_PIPELINE).to_list(None), key=lambda t: t['_id'])
+    return jsonify([to_slice(t) for t in totals])
+
+
+@app.route('/api/markets')
+async def get_markets():
+    """Markets as a JSON array, ordered by marketId (see slice.get_markets)."""
+    col = markets_db().markets
+    query = filters(request.args, MARKET_FILTERS)
+    fields, projection = market_fields(request.args.get('fields'))
+    try:
+        if request.args.get('after'):
+            query.update(parse_after(request.args['after']))
+        limit = page_limit(request.args)
+    except (ValueError, InvalidId):
+        return jsonify({'error': 'invalid after or limit'}), 400
+
+    def row(m):
+        return market_row(m, fields)
+
+    if limit is None:
+        cursor = col.find(query, projection).sort(MARKET_SORT)
+        return Response(aiter_json_array(_rows(cursor, row)), mimetype='application/json')
+
+    # A bounded page: fetch it and its cursor concurrently
+    page, after = await asyncio.gather(
+        col.find(query, projection).sort(MARKET_SORT).limit(limit).to_list(limit),
+        page_cursor(col, query, MARKET_SORT, limit, market_cursor),
+    )
+    headers = {'X-Next-After': after} if after else {}
+    return Response('[' + ','.join(dumps(row(m)) for m in page) + ']', mimetype='application/json', headers=headers)
+
+
+async def _rows(cursor, row):
+    async for doc in cursor:
+        yield row(doc)
+
+
+@app.route('/api/markets/<int:id>/<nf>/<name>')
+async def get_market_detail(id, nf, name):
+    """A market with one page of its nodes (see slice.get_market_detail)."""
+    try:
+        query = NodeQuery.from_args(request.args, MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': f'invalid node query: {e}'}), 400
+    db = markets_db()
+    key = {'marketId': id, 'nf': nf, 'marketName': name}
+    if os.getenv('SPLIT_MARKET_NODES'):
+        nodes = db[NODES_COLLECTION].aggregate(collection_pipeline(key, query)).to_list(1)
+    else:
+        nodes = db.markets.aggregate(embedded_pipeline(key, query)).to_list(1)
+    m, result = await asyncio.gather(
+        db.markets.find_one(key, {'_id': 0, 'marketId': 1, 'marketName': 1, 'vendor': 1, 'nf': 1, 'nfType': 1}),
+        nodes,
+    )
+    if not m:
+        return jsonify({'error': 'not found'}), 404
+    page = parse_node_page(result[0] if result else None, bool(os.getenv('SPLIT_MARKET_NODES')))
+    return jsonify({
+        'id': m['marketId'],
+        'name': m['marketName'],
+        'vendor': m.get('vendor'),
+        'nf': m.get('nf'),
+        'type': m.get('nfType'),
+        'offset': query.offset,
+        'limit': query.limit,
+        **page,
+    })
+
+
+# table_back.py
+
+@app.route('/api/servers')
+async def get_server_names():
+    return jsonify(await mongo['mydatabase']['mycollection'].distinct('name'))
+
+
+@app.route('/api/data')
+async def get_data():
+    query = {}
+    if request.args.get('serverName'):
+        query['name'] = request.args['serverName']
+    groups = await mongo['mydatabase']['mycollection'].aggregate(data_pipeline(query)).to_list(None)
+    return jsonify(build_result(groups))
+
+
+# dash_backend.py
+
+@app.route('/api/nfs')
+async def get_nfs():
+    """NFs as a JSON array, ordered by _id (see dash_backend.get_nfs)."""
+    nfs = mongo['metricsdb']['nfs']
+    query = filters(request.args, NF_FILTERS)
+    try:
+        if request.args.get('after'):
+            query['_id'] = {'$gt': ObjectId(request.args['after'])}
+        limit = page_limit(request.args)
+    except (ValueError, InvalidId):
+        return jsonify({'error': 'invalid after or limit'}), 400
+
+    cursor = nfs.find(query, nf_projection(request.args.get('fields'))).sort(NF_SORT)
+    if limit is None:
+        return Response(aiter_json_array(cursor), mimetype='application/json')
+    page, after = await asyncio.gather(
+        cursor.limit(limit).to_list(limit),
+        page_cursor(nfs, query, NF_SORT, limit, lambda nf: str(nf['_id'])),
+    )
+    headers = {'X-Next-After': after} if after else {}
+    return Response('[' + ','.join(dumps(nf) for nf in page) + ']', mimetype='application/json', headers=headers)
+
+
+@app.route('/api/nfs/<nf_id>')
+async def get_nf(nf_id):
+    try:
+        query = {'_id': ObjectId(nf_id)}
+    except InvalidId:
+        query = {'id': nf_id}
+    nf = await mongo['metricsdb']['nfs'].find_one(query, nf_projection(request.args.get('fields')))
+    if nf is None:
+        return jsonify({'error': 'NF not found'}), 404
+    return json_response(nf)
+
+
+# flask_back.py (GET routes; saves and uploads stay on the sync app)
+
+def forms():
+    return mongo['form_database']['forms']
+
+
+@app.route('/api/form')
+async def get_form():
+    form_name = request.args.get('name')
+    if not form_name:
+        return jsonify({'error': 'Form name is required'}), 400
+    query, sort = form_lookup(form_name, request.args.get('version'))
+    doc, versions = await asyncio.gather(
+        forms().find_one(query, sort=sort),
+        forms().find({'form_name': form_name}, VERSIONS_PROJECTION).sort('_id', 1).to_list(None),
+    )
+    if doc is None:
+        return jsonify({'error': 'Form not found'}), 404
+    form = await assemble_async(forms(), doc)
+    form['versions'] = [v['version_name'] for v in versions]
+    form['_id'] = str(form['_id'])
+    return jsonify(form)
+
+
+@app.route('/api/forms')
+async def list_forms():
+    names = await forms().distinct('form_name')
+    return jsonify({'forms': sorted(n for n in names if n != 'BlankTemplate')})
+
+
+async def form_metrics(form_names):
+    """form_repository.form_metrics with the backfill of missing counters run concurrently."""
+    collection = forms()
+    docs = await collection.find(metrics_query(form_names), METRICS_PROJECTION).sort('_id', 1).to_list(None)
+
+    async def backfill(doc):
+        full = await collection.find_one({'_id': doc['_id']})
+        doc['metrics'] = completion_stats(await assemble_async(collection, full)) if full else completion_stats({})
+        await collection.update_one({'_id': doc['_id']}, {'$set': {'metrics': doc['metrics']}})
+
+    await asyncio.gather(*(backfill(doc) for doc in docs if doc.get('metrics') is None))
+    return summarize_metrics(form_names, docs)
+
+
+@app.route('/api/form/metrics')
+async def get_form_metrics():
+    names = [n for n in request.args.getlist('names') if n]
+    if names:
+        return jsonify(await form_metrics(names))
+    form_name = request.args.get('name')
+    if not form_name:
+        return jsonify({'error': 'Form name is required'}), 400
+    metrics = (await form_metrics([form_name]))[form_name]
+    if not metrics['versions']:
+        return jsonify({'error': 'Form not found'}), 404
+    return jsonify(metrics)
+
+
+# gitdff.py
+
+def in_thread(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(diff_pool, fn, *args)
+
+
+@app.route('/api/diff')
+async def get_diff():
+    """One file between two branches (see gitdff.get_diff); both sides are fetched concurrently."""
+    try:
+        branch1, branch2, file_path, fmt, context = diff_args(request.args, DEFAULT_FILE_PATH)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        (sha1, lines1), (sha2, lines2) = await gitlab.file_pair(branch1, branch2, file_path)
+    except (GitLabError, *TRANSPORT_ERRORS) as e:
+        return jsonify({'error': str(e)}), 502
+
+    fromdesc, todesc = f'{branch1}:{file_path}', f'{branch2}:{file_path}'
+    key = (sha1, sha2, fmt, context, fromdesc, todesc)
+    cached = rendered.get(key)
+    if cached is not None:
+        mimetype, body = cached.split(b'\n', 1)
+        return Response(body, mimetype=mimetype.decode())
+    body, mimetype, cacheable = await in_thread(render_diff, fmt, lines1, lines2, fromdesc, todesc, context)
+    if cacheable:
+        rendered.put(key, mimetype.encode() + b'\n' + body.encode())
+    return Response(body, mimetype=mimetype)
+
+
+async def blob_lines(sha):
+    return (await gitlab.blob(sha)).decode('utf-8', errors='replace').splitlines() if sha else []
+
+
+async def diff_tree_file(path, old, new, fmt, context, limit):
+    head = tree_file_head(path, old, new)
+    key = (old, new, 'tree-' + fmt, context)
+    body = rendered.get(key)
+    if body is None:
+        async with limit:
+            try:
+                lines1, lines2 = await asyncio.gather(blob_lines(old), blob_lines(new))
+            except (GitLabError, *TRANSPORT_ERRORS) as e:
+                return tree_error_line(head, e)
+            result, cacheable = await in_thread(tree_file_result, lines1, lines2, fmt, context)
+        body = json.dumps(result).encode()
+        if cacheable:
+            rendered.put(key, body)
+    return tree_file_line(head, body)
+
+
+@app.route('/api/diff/tree')
+async def get_tree_diff():
+    """Every changed file under a directory as NDJSON (see gitdff.get_tree_diff)."""
+    try:
+        branch1, branch2, path, fmt, context = tree_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        files1, files2 = await gitlab.tree_pair(branch1, branch2, path)
+    except (GitLabError, *TRANSPORT_ERRORS) as e:
+        return jsonify({'error': str(e)}), 502
+    changed = changed_paths(files1, files2)
+
+    async def generate():
+        limit = asyncio.Semaphore(DIFF_TREE_WORKERS)
+        tasks = [asyncio.ensure_future(diff_tree_file(p, files1.get(p), files2.get(p), fmt, context, limit))
+                 for p in changed[:MAX_TREE_FILES]]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()  # Client went away: drop the files not finished yet
+        for line in tree_tail_lines(changed, files1, files2):
+            yield line
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+if __name__ == '__main__':
+    app.run(port=8000)
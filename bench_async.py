@@ -0,0 +1,85 @@
+"""
+Load-test the sync apps against async_app.py: requests/s and latency
+percentiles at a fixed number of concurrent clients.
+
+Start the servers first, e.g. for the slice routes:
+
+    python slice.py                                        # sync, :5000
+    hypercorn async_app:app --bind 127.0.0.1:8000 --workers 4
+
+then run the same paths against both:
+
+    python bench_async.py --sync http://127.0.0.1:5000 --async http://127.0.0.1:8000 \\
+        --path /api/slices --path '/api/markets?limit=100' --concurrency 200 --requests 5000
+
+Paths are requested round-robin. With --bust every request gets a unique
+`_bust` query argument so the sync apps' response cache cannot answer it and
+both sides do the same Mongo/GitLab work.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+
+async def run(base_url, paths, concurrency, requests, bust, timeout):
+    latencies = []
+    errors = 0
+    counter = itertools.count()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(base_url, connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as client:
+        async def worker():
+            nonlocal errors
+            while True:
+                i = next(counter)
+                if i >= requests:
+                    return
+                path = paths[i % len(paths)]
+                if bust:
+                    path += ('&' if '?' in path else '?') + f'_bust={i}'
+                start = time.perf_counter()
+                try:
+                    async with client.get(path) as response:
+                        await response.read()
+                        ok = response.status < 500
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    return {'rps': len(latencies) / elapsed, 'p50': pick(0.50), 'p99': pick(0.99), 'errors': errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sync', dest='sync_url', help='base URL of the sync app')
+    parser.add_argument('--async', dest='async_url', help='base URL of async_app.py')
+    parser.add_argument('--path', action='append', required=True, help='path to request (repeatable)')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--warmup', type=int, default=200, help='requests sent before measuring')
+    parser.add_argument('--bust', action='store_true', help='defeat the sync response cache')
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    for label, url in (('sync', args.sync_url), ('async', args.async_url)):
+        if not url:
+            continue
+        asyncio.run(run(url, args.path, min(args.concurrency, args.warmup or 1), args.warmup, args.bust, args.timeout))
+        r = asyncio.run(run(url, args.path, args.concurrency, args.requests, args.bust, args.timeout))
+        print(f"{label:>5} {url}: {r['rps']:8.1f} req/s  p50 {r['p50']:8.1f} ms  p99 {r['p99']:8.1f} ms  "
+              f"errors {r['errors']} ({args.requests} requests, {args.concurrency} clients)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark bytes written per form save: the old full-document $set against the
+targeted $set of changed answers produced by form_schema.AnswerUpdate.
+
+Sizes are the BSON-encoded update command a save sends to MongoDB.
+
+    python bench_form_save.py --sections 20 --questions 25 --changed 0 1 5 50
+"""
+import argparse
+import copy
+import random
+import time
+from datetime import datetime, timezone
+
+import bson
+
+from form_schema import AnswerUpdate, FormSchema
+
+TYPES = ['text', 'textarea', 'select', 'checkbox', 'file']
+
+
+def make_form(sections, questions, seed=0):
+    rnd = random.Random(seed)
+    form = {'_id': bson.ObjectId(), 'form_name': 'Audit', 'version_name': 'Audit_v_1', 'submitted': False, 'sections': []}
+    for s in range(sections):
+        qs = []
+        for q in range(questions):
+            qtype = rnd.choice(TYPES)
+            answer = [] if qtype in ('checkbox', 'file') else f'answer {s}.{q}'
+            qs.append({
+                'id': f's{s}q{q}',
+                'type': qtype,
+                'label': f'Question {q} of section {s}: please describe the current configuration',
+                'placeholder': 'Enter your answer',
+                'required': rnd.random() < 0.5,
+                'answer': answer,
+            })
+        form['sections'].append({'name': f'Section {s}', 'description': 'Section description ' * 5, 'questions': qs})
+    return form
+
+
+def submitted_fields(form, changed, seed=0):
+    """Every text answer as the client posts it, with `changed` of them edited."""
+    rnd = random.Random(seed)
+    fields = {q['id']: q['answer'] for s in form['sections'] for q in s['questions']
+              if q['type'] not in ('checkbox', 'file')}
+    for qid in rnd.sample(sorted(fields), min(changed, len(fields))):
+        fields[qid] = f'edited {qid}'
+    return fields
+
+
+def full_update(form, fields):
+    updated = copy.deepcopy(form)
+    for s in updated['sections']:
+        for q in s['questions']:
+            if q['id'] in fields:
+                q['answer'] = fields[q['id']]
+    updated['updated_at'] = datetime.now(timezone.utc)
+    return {'q': {'_id': updated['_id']}, 'u': {'$set': updated}}
+
+
+def targeted_update(form, fields):
+    updated = copy.deepcopy(form)
+    schema = FormSchema(updated)
+    update = AnswerUpdate(schema)
+    for qid, value in fields.items():
+        update.set(schema.question(updated, qid), value)
+    if not update.changed:
+        return None
+    return {'q': {'_id': updated['_id'], **update.guard},
+            'u': {'$set': {**update.fields, 'updated_at': datetime.now(timezone.utc)}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=25)
+    parser.add_argument('--changed', type=int, nargs='+', default=[0, 1, 5, 50])
+    args = parser.parse_args()
+
+    form = make_form(args.sections, args.questions)
+    print(f'form: {args.sections * args.questions} questions, {len(bson.encode(form))} bytes')
+    for changed in args.changed:
+        fields = submitted_fields(form, changed)
+        start = time.perf_counter()
+        full = len(bson.encode(full_update(form, fields)))
+        full_t = time.perf_counter() - start
+        start = time.perf_counter()
+        targeted = targeted_update(form, fields)
+        targeted_t = time.perf_counter() - start
+        targeted_bytes = len(bson.encode(targeted)) if targeted else 0
+        print(f'{changed:>4} changed  full $set {full:>8} bytes ({full_t * 1000:6.2f} ms)  '
+              f'targeted $set {targeted_bytes:>7} bytes ({targeted_t * 1000:6.2f} ms)'
+              f'{"  (write skipped)" if targeted is None else ""}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark POST /api/nfs: the original delete-all + insert-all save vs. the
+diff-based sync, for a save that changes a single NF.
+
+    python bench_nfs_sync.py                    # mongomock, 50k NFs
+    python bench_nfs_sync.py --uri mongodb://localhost:27017 --sizes 50000 200000
+"""
+import argparse
+import random
+import time
+
+from nf_sync import sync_nfs
+
+TYPES = ['AMF', 'SMF', 'UPF', 'NRF', 'AUSF', 'UDM', 'PCF']
+PRODUCTS = ['ericsson', 'nokia', 'samsung', 'mavenir']
+
+
+def make_nfs(n, seed=0):
+    rnd = random.Random(seed)
+    return [
+        {
+            'id': str(1700000000000 + i),
+            'type': rnd.choice(TYPES),
+            'product': rnd.choice(PRODUCTS),
+            'vastId': f'VAST-{rnd.randint(0, 99999):05d}',
+            'automations': [{'name': f'auto-{j}', 'enabled': rnd.random() < 0.5} for j in range(rnd.randint(0, 4))],
+        }
+        for i in range(n)
+    ]
+
+
+def replace_all(col, nfs):
+    # The original save_nfs implementation.
+    col.delete_many({})
+    col.insert_many([{k: v for k, v in nf.items() if k != '_id'} for nf in nfs])
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', help='MongoDB URI; uses mongomock when omitted')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50000])
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    db = client['bench_nfs_sync']
+
+    for n in args.sizes:
+        db.drop_collection('nfs')
+        nfs = make_nfs(n)
+        sync_nfs(db.nfs, nfs)
+        # What the dashboard posts back: the GET response with one NF edited
+        posted = [{**nf, '_id': str(nf['_id'])} for nf in db.nfs.find({}, {'_hash': 0})]
+        posted[n // 2]['product'] = 'edited'
+
+        sync_t, counts = timed(lambda: sync_nfs(db.nfs, posted))
+        assert counts == {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': n - 1}, counts
+        replace_t, _ = timed(lambda: replace_all(db.nfs, posted))
+
+        print(f'{n:>7} NFs, 1 changed  delete+insert {replace_t * 1000:9.1f} ms ({n} deletes, {n} inserts)  '
+              f'diff sync {sync_t * 1000:9.1f} ms (1 write)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark /api/slices: the original Python loop over every market vs. the
+server-side aggregation vs. reading the maintained rollup.
+
+    python bench_slices.py                      # mongomock, 10k and 100k markets
+    python bench_slices.py --uri mongodb://localhost:27017 --sizes 10000 100000
+"""
+import argparse
+import random
+import time
+
+from slice_rollup import SliceRollup
+
+SLICES = ['eMBB', 'URLLC', 'mMTC', 'V2X', 'IoT', 'FWA', 'Voice', 'Video', 'Gaming', 'Enterprise']
+
+
+def make_markets(n, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        results = {}
+        for name in rnd.sample(SLICES, rnd.randint(3, len(SLICES))):
+            total = rnd.randint(1, 50)
+            results[name] = {'total': total, 'deployed': rnd.randint(0, total)}
+        yield {
+            'marketId': i,
+            'marketName': f'market-{i}',
+            'vendor': rnd.choice(['ericsson', 'nokia', 'samsung']),
+            'nf': rnd.choice(['amf', 'smf', 'upf']),
+            'nfType': rnd.choice(['cnf', 'vnf']),
+            'results': results,
+        }
+
+
+def python_loop(col):
+    # The original get_slices implementation.
+    agg = {}
+    for doc in col.find({}, {'_id': 0, 'results': 1}):
+        for name, vals in doc.get('results', {}).items():
+            if name not in agg:
+                agg[name] = {'total': 0, 'deployed': 0}
+            agg[name]['total'] += vals.get('total', 0)
+            agg[name]['deployed'] += vals.get('deployed', 0)
+    return [{'name': n, **stats} for n, stats in agg.items()]
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', help='MongoDB URI; uses mongomock when omitted')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    db = client['bench_slices']
+
+    for n in args.sizes:
+        db.drop_collection('markets')
+        db.drop_collection('slice_totals')
+        db.markets.insert_many(make_markets(n))
+        rollup = SliceRollup(db.markets, db.slice_totals)
+        rollup.rebuild()
+
+        loop_t, expected = timed(lambda: python_loop(db.markets), args.repeat)
+        agg_t, _ = timed(rollup.aggregate, args.repeat)
+        read_t, served = timed(rollup.slices, args.repeat)
+        assert sorted(expected, key=lambda s: s['name']) == served
+
+        doc = next(make_markets(1, seed=n))
+        doc['marketId'] = 0
+        doc['marketName'] = 'market-0'
+        update_t, _ = timed(lambda: rollup.save_market(doc), 1)
+
+        print(f'{n:>7} markets  python loop {loop_t * 1000:9.1f} ms  '
+              f'aggregation {agg_t * 1000:9.1f} ms  rollup read {read_t * 1000:7.2f} ms  '
+              f'market update {update_t * 1000:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
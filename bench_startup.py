@@ -0,0 +1,164 @@
+"""
+Startup time and Mongo connections per worker of server.create_app().
+
+    python bench_startup.py
+    python bench_startup.py --workers 4 --threads 8 --requests 2000 --path /api/forms --path /api/servers
+
+The startup part runs `import server; server.create_app()` in --runs fresh
+interpreters and reports how long it takes and how many Mongo clients and
+threads exist afterwards. No MongoDB is needed for it: importing the
+backends does no I/O.
+
+With --workers, the app is created once and --workers processes are forked
+from it (as gunicorn does with preload_app). Each worker sends --requests
+requests, round-robin over --path, from --threads threads through the Flask
+test client and reports its first-request time and its peak number of open
+pooled Mongo connections (counted with a pymongo ConnectionPoolListener).
+This part needs the MongoDB servers the backends point at; run
+`flask --app server init` first.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from pymongo import monitoring
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP = '''
+import json, threading, time
+start = time.perf_counter()
+import server
+server.create_app()
+elapsed = time.perf_counter() - start
+import mongo_clients
+print(json.dumps({'seconds': elapsed, 'clients': len(mongo_clients.open_clients()),
+                  'threads': threading.active_count()}))
+'''
+
+
+def bench_env():
+    env = dict(os.environ)
+    # slice.py refuses to import without these
+    env.setdefault('MONGO_URI', 'mongodb://localhost:27017/')
+    env.setdefault('DB_NAME', 'slices')
+    return env
+
+
+def startup(runs):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', STARTUP], cwd=HERE, env=bench_env(),
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    seconds = sorted(r['seconds'] * 1000 for r in results)
+    print(f'import + create_app: median {statistics.median(seconds):.1f} ms, max {seconds[-1]:.1f} ms '
+          f'({runs} runs); Mongo clients {max(r["clients"] for r in results)}, '
+          f'threads {max(r["threads"] for r in results)}')
+
+
+class PoolCounter(monitoring.ConnectionPoolListener):
+    """Open and peak pooled connections of every client in this process."""
+
+    def __init__(self):
+        self.open = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def _ignore(self, event):
+        pass
+
+    pool_created = pool_ready = pool_cleared = pool_closed = _ignore
+    connection_ready = connection_check_out_started = connection_check_out_failed = _ignore
+    connection_checked_out = connection_checked_in = _ignore
+
+
+def worker(app, paths, threads, requests, results):
+    counter = PoolCounter()
+    monitoring.register(counter)  # before this worker creates its clients
+
+    start = time.perf_counter()
+    status = app.test_client().get(paths[0]).status_code
+    first = time.perf_counter() - start
+
+    counter_lock = threading.Lock()
+    sent = itertools.count(1)
+    errors = 0
+
+    def run():
+        nonlocal errors
+        client = app.test_client()
+        while True:
+            with counter_lock:
+                i = next(sent)
+            if i >= requests:
+                return
+            if client.get(paths[i % len(paths)]).status_code >= 500:
+                with counter_lock:
+                    errors += 1
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put({'pid': os.getpid(), 'first_ms': first * 1000, 'first_status': status,
+                 'rps': requests / (time.perf_counter() - start), 'peak': counter.peak,
+                 'open': counter.open, 'errors': errors + (status >= 500)})
+
+
+def connections(paths, workers, threads, requests):
+    os.environ.update(bench_env())
+    sys.path.insert(0, HERE)
+    import server
+
+    app = server.create_app()
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(app, paths, threads, requests, results)) for _ in range(workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    for r in rows:
+        print(f"worker {r['pid']}: first request {r['first_ms']:.1f} ms ({r['first_status']}), "
+              f"{r['rps']:.0f} req/s, peak connections {r['peak']}, open at end {r['open']}, errors {r['errors']}")
+    print(f'{workers} workers x {threads} threads: {sum(r["peak"] for r in rows)} connections at peak '
+          f'(MONGO_MAX_POOL_SIZE={os.environ.get("MONGO_MAX_POOL_SIZE", "100")})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters for the startup time')
+    parser.add_argument('--workers', type=int, default=0, help='forked workers for the connection count')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000, help='requests per worker')
+    parser.add_argument('--path', action='append', help='path to request (repeatable, default /api/forms)')
+    args = parser.parse_args()
+
+    startup(args.runs)
+    if args.workers:
+        connections(args.path or ['/api/forms'], args.workers, args.threads, args.requests)
+
+
+if __name__ == '__main__':
+    main()
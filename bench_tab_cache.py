@@ -0,0 +1,114 @@
+"""
+Benchmark tab.py page data: the original per-request listdir + json.load vs.
+TabCache, on a generated json_data/ tree.
+
+    python bench_tab_cache.py                         # 100 tabs of 2 MB
+    python bench_tab_cache.py --tabs 100 --mb 5 --requests 500 --render
+
+Requests pick a tab at random, 80% of them from a hot set of 10 tabs. With
+--render the smn.html page is rendered too (the pre-rendered page is what the
+cache saves most on). Generated files are removed afterwards.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from tab_cache import TabCache
+
+
+def make_tab_data(mb, seed):
+    rnd = random.Random(seed)
+    data = {}
+    i = 0
+    while True:
+        data[f'nf{i}'] = {
+            'config': {f'param{j}': rnd.choice([rnd.randint(0, 1 << 20), f'value-{rnd.random():.6f}', True])
+                       for j in range(20)},
+            'ports': [{'name': f'p{k}', 'port': rnd.randint(1, 65535)} for k in range(3)],
+        }
+        i += 1
+        if i % 200 == 0 and len(json.dumps(data)) > mb * 1024 * 1024:
+            return data
+
+
+def make_tree(root, tabs, mb):
+    template = make_tab_data(mb, 0)
+    for t in range(tabs):
+        os.makedirs(os.path.join(root, f'tab{t:03d}'))
+        with open(os.path.join(root, f'tab{t:03d}', 'data.json'), 'w') as f:
+            json.dump({'tab': t, **template}, f)
+
+
+def uncached(root, tab):
+    # The original get_tabs + load_json_for_tab
+    tabs = [d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))]
+    folder_path = os.path.join(root, tab)
+    json_files = [f for f in os.listdir(folder_path) if f.endswith('.json')]
+    with open(os.path.join(folder_path, json_files[0]), 'r') as file:
+        return tabs, json.load(file)
+
+
+def run(pick, handle, n):
+    times = []
+    for _ in range(n):
+        tab = pick()
+        start = time.perf_counter()
+        handle(tab)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return statistics.median(times) * 1000, times[int(len(times) * 0.95)] * 1000, sum(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tabs', type=int, default=100)
+    parser.add_argument('--mb', type=float, default=2)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--cache-mb', type=int, default=128, help='TabCache budget (MB of parsed objects)')
+    parser.add_argument('--render', action='store_true', help='also render smn.html for every request')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_tabs-')
+    try:
+        make_tree(root, args.tabs, args.mb)
+        names = sorted(os.listdir(root))
+        rnd = random.Random(1)
+        pick = lambda: rnd.choice(names[:10]) if rnd.random() < 0.8 else rnd.choice(names)
+
+        render = None
+        if args.render:
+            from jinja2 import Environment, FileSystemLoader
+            env = Environment(loader=FileSystemLoader(os.path.dirname(os.path.abspath(__file__))))
+            template = env.get_template('smn.html')
+            render = lambda tabs, tab, data: template.render(
+                data=data, tabs=tabs, current_tab=tab, namespaces=['namespace1'])
+
+        def old(tab):
+            tabs, data = uncached(root, tab)
+            if render:
+                render(tabs, tab, data)
+
+        cache = TabCache(root, max_bytes=args.cache_mb * 1024 * 1024)
+
+        def new(tab):
+            tabs = cache.tabs()
+            if render:
+                cache.rendered(tab, 'page', lambda data: render(tabs, tab, data))
+            else:
+                cache.load(tab)
+
+        for label, handle in (('per-request disk reads', old), ('TabCache', new)):
+            p50, p95, total = run(pick, handle, args.requests)
+            print(f'{label:>24}: p50 {p50:8.2f} ms  p95 {p95:8.2f} ms  total {total:6.2f} s '
+                  f'({args.requests} requests, {args.tabs} tabs of {args.mb:g} MB)')
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
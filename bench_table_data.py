@@ -0,0 +1,108 @@
+"""
+Benchmark /api/data: the original Python loop over every full document vs.
+the server-side aggregation in step_counts.data_pipeline.
+
+Reports the best latency and the peak Python memory (tracemalloc) of each
+path. The aggregation uses $convert, which mongomock does not implement, so
+point it at a local mongod:
+
+    python bench_table_data.py --uri mongodb://localhost:27017 --sizes 10000 100000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+from step_counts import build_result, data_pipeline, init_section, section_mapping
+
+SECTIONS = ['HealthCheck', 'PreDeploy', 'Deploy', 'PostDeploy', 'PreCheck', 'Upgrade', 'PostCheck',
+            'ConfigAudit', 'RollbackAutomation', 'Assurance', 'Geo', 'DisasterRecovery']
+
+
+def make_docs(n, questions=20, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        qs = [{'questionId': f'q{j}', 'answer': 'text answer ' * 5} for j in range(questions)]
+        qs.append({'questionId': 'stepsCount', 'answer': str(rnd.randint(1, 40))})
+        qs.append({'questionId': 'automatedStepsCount', 'answer': rnd.choice([str(rnd.randint(0, 40)), '', 'n/a', None])})
+        yield {
+            'name': f'server-{i % 50}',
+            'version': f'v{i % 20}',
+            'section_name': rnd.choice(SECTIONS),
+            'questions': qs,
+        }
+
+
+def python_loop(collection, query):
+    # The original get_data implementation.
+    docs = list(collection.find(query))
+    aggregated = defaultdict(lambda: {section: init_section() for section in section_mapping.values()})
+    for doc in docs:
+        version = doc.get("version", "Unknown")
+        agg_section = section_mapping.get(doc.get("section_name", "").lower())
+        if agg_section is None:
+            continue
+        for q in doc.get("questions", []):
+            count_type = {"stepsCount": "steps", "automatedStepsCount": "auto"}.get(q.get("questionId"))
+            if count_type is None or q.get("answer") is None:
+                continue
+            try:
+                value = int(q["answer"])
+            except (ValueError, TypeError):
+                continue
+            aggregated[version][agg_section][count_type] += value
+    return aggregated
+
+
+def aggregation(collection, query):
+    return build_result(collection.aggregate(data_pipeline(query)))
+
+
+def measure(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', help='MongoDB URI; uses mongomock (loop only) when omitted')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--server', help='serverName filter to benchmark (default: none)')
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    collection = client['bench_table_data']['mycollection']
+    query = {'name': args.server} if args.server else {}
+
+    for n in args.sizes:
+        collection.drop()
+        collection.insert_many(make_docs(n))
+        collection.create_index([('name', 1), ('section_name', 1), ('version', 1)])
+
+        loop_t, loop_mem = measure(lambda: python_loop(collection, query), args.repeat)
+        line = f'{n:>7} docs  python loop {loop_t * 1000:9.1f} ms {loop_mem / 1e6:8.1f} MB'
+        if args.uri:
+            agg_t, agg_mem = measure(lambda: aggregation(collection, query), args.repeat)
+            line += f'  aggregation {agg_t * 1000:9.1f} ms {agg_mem / 1e6:8.1f} MB'
+        else:
+            line += '  aggregation n/a (mongomock has no $convert; pass --uri)'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""
+Convert CSV exports with multi-row headers into hierarchical JSON records.
+
+The first `header_rows` rows (3 by default) name each column; blank header
+cells repeat the cell to their left, so a column's path is e.g.
+('Site', 'Power', 'kW'). Column 0 is the record name. Every data row becomes
+
+    {"Name": "...", "Site": {"Power": {"kW": 12.5, ...}, ...}, ...}
+
+with values that look like integers or floats converted to numbers.
+
+The headers are compiled once into a PathTemplate, which builds the whole
+nested record of a row with a single generated expression instead of walking
+the path of every cell. Rows are streamed from the file and written one by
+one, as NDJSON or as a JSON array, so memory does not grow with the file.
+
+    python csv_json.py export.csv -o export.ndjson
+    python csv_json.py export.csv -o export.json --format array --indent 2
+    python csv_json.py export.csv -o export.ndjson --batch        # pandas column coercion
+    python csv_json.py export.csv -o export.ndjson --workers 8    # split by byte range
+
+    from csv_json import iter_records
+    for record in iter_records('export.csv'):
+        ...
+
+--workers splits the data rows into byte ranges converted by separate
+processes and concatenates their output in order; it assumes no quoted field
+contains a line break. --batch needs pandas.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HEADER_ROWS = 3
+NAME_KEY = 'Name'
+BATCH_ROWS = 10000
+ENCODING = 'utf-8-sig'
+
+INT_PATTERN = r'[+-]?\d+'
+
+
+def coerce(value):
+    """Strip a cell and return it as int, float or str (in that order of preference)."""
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def fill_forward(row):
+    """Repeat each non-blank header cell over the blank cells to its right."""
+    filled = []
+    current = None
+    for cell in row:
+        cell = cell.strip()
+        current = cell if cell else current
+        filled.append(current)
+    return filled
+
+
+def _layout(paths):
+    # Nested dict of keys -> column index, in the order a record gets its keys.
+    # A later path replaces a value that is in its way, as assigning
+    # the cells one by one would.
+    layout = {NAME_KEY: 0}
+    for column, path in paths:
+        node = layout
+        for key in path[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            node = node[key]
+        node[path[-1]] = column
+    return layout
+
+
+def _expression(node):
+    items = []
+    for key, value in node.items():
+        if isinstance(value, dict):
+            items.append(f'{key!r}: {_expression(value)}')
+        elif value == 0:
+            items.append(f'{key!r}: s(r[0])')
+        else:
+            items.append(f'{key!r}: c(r[{value}])')
+    return '{' + ', '.join(items) + '}'
+
+
+class PathTemplate:
+    """The column paths of a header, compiled into a function that builds one record."""
+
+    def __init__(self, header_rows):
+        filled = [fill_forward(row) for row in header_rows]
+        width = max((len(row) for row in filled), default=0)
+        self.paths = []
+        for column in range(1, width):
+            path = tuple(row[column] for row in filled if column < len(row) and row[column])
+            if path:
+                self.paths.append((column, path))
+        self.width = max((column for column, _ in self.paths), default=0) + 1
+        self.source = f'lambda r, s, c: {_expression(_layout(self.paths))}'
+        self._build = eval(self.source, {})
+
+    def record(self, row, coerce=coerce):
+        """Return the record of one data row (a list of cells)."""
+        if len(row) >= self.width:
+            return self._build(row, str.strip, coerce)
+        # Short row: only the cells that are present, like the original converter
+        record = {NAME_KEY: row[0].strip()}
+        for column, path in self.paths:
+            if column >= len(row):
+                break
+            node = record
+            for key in path[:-1]:
+                if not isinstance(node.get(key), dict):
+                    node[key] = {}
+                node = node[key]
+            node[path[-1]] = coerce(row[column])
+        return record
+
+    def records(self, rows):
+        for row in rows:
+            if row:
+                yield self.record(row)
+
+    def batch_records(self, rows, batch_size=BATCH_ROWS):
+        """Like records(), but coerce values a column at a time with pandas."""
+        batch = []
+        for row in rows:
+            if row:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield from self._convert_batch(batch)
+                    batch = []
+        if batch:
+            yield from self._convert_batch(batch)
+
+    def _convert_batch(self, rows):
+        import numpy as np
+        import pandas as pd
+
+        full = [i for i, row in enumerate(rows) if len(row) >= self.width]
+        out = [None] * len(rows)
+        if full:
+            frame = pd.DataFrame([rows[i][:self.width] for i in full], dtype=object)
+            columns = [frame[0].str.strip().tolist()]
+            for column in range(1, self.width):
+                text = frame[column].str.strip()
+                values = text.to_numpy(dtype=object, copy=True)
+                is_int = text.str.fullmatch(INT_PATTERN).to_numpy(dtype=bool)
+                if is_int.any():
+                    values[is_int] = [int(v) for v in values[is_int]]
+                number = pd.to_numeric(text.where(~is_int), errors='coerce').to_numpy()
+                is_float = ~is_int & ~np.isnan(number)
+                if is_float.any():
+                    values[is_float] = number[is_float].tolist()
+                columns.append(values.tolist())
+            same = lambda value: value
+            for i, row in zip(full, zip(*columns)):
+                out[i] = self._build(row, same, same)
+        for i, row in enumerate(rows):
+            if out[i] is None:
+                out[i] = self.record(row)
+        return out
+
+
+def read_header(rows, header_rows=HEADER_ROWS):
+    """Consume the header rows from a csv reader and return their PathTemplate."""
+    return PathTemplate([next(rows, []) for _ in range(header_rows)])
+
+
+def iter_records(path, header_rows=HEADER_ROWS, batch=False, encoding=ENCODING):
+    """Yield the records of a CSV file one at a time."""
+    with open(path, newline='', encoding=encoding) as f:
+        rows = csv.reader(f)
+        template = read_header(rows, header_rows)
+        if batch:
+            yield from template.batch_records(rows)
+        else:
+            yield from template.records(rows)
+
+
+if orjson is not None:
+    def dumps(record):
+        return orjson.dumps(record).decode()
+else:
+    def dumps(record):
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+
+def write_ndjson(records, out):
+    count = 0
+    for record in records:
+        out.write(dumps(record))
+        out.write('\n')
+        count += 1
+    return count
+
+
+def write_array(records, out, indent=None):
+    """Write records as one JSON array; with `indent`, laid out like json.dump(..., indent=indent)."""
+    count = 0
+    if indent is None:
+        for record in records:
+            out.write(',' if count else '[')
+            out.write(dumps(record))
+            count += 1
+        out.write(']' if count else '[]')
+        return count
+    pad = ' ' * indent
+    for record in records:
+        out.write(',\n' if count else '[\n')
+        out.write(pad + json.dumps(record, indent=indent).replace('\n', '\n' + pad))
+        count += 1
+    out.write('\n]' if count else '[]')
+    return count
+
+
+# Parallel conversion by byte range
+
+def _data_start(path, header_rows, encoding):
+    with open(path, 'rb') as f:
+        header = [f.readline() for _ in range(header_rows)]
+        start = f.tell()
+    text = b''.join(header).decode(encoding)
+    return list(csv.reader(text.splitlines())), start
+
+
+def _byte_ranges(start, size, parts):
+    step = max(1, (size - start + parts - 1) // parts)
+    return [(offset, min(offset + step, size)) for offset in range(start, size, step)]
+
+
+def _lines(path, start, end, data_start, encoding):
+    # Every line that starts inside [start, end)
+    with open(path, 'rb') as f:
+        if start > data_start:
+            f.seek(start - 1)
+            f.readline()  # Finish the line that the previous range owns
+        else:
+            f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode(encoding)
+
+
+def _convert_range(job):
+    path, start, end, data_start, header, batch, part, encoding = job
+    template = PathTemplate(header)
+    rows = csv.reader(_lines(path, start, end, data_start, 'utf-8' if encoding == ENCODING else encoding))
+    records = template.batch_records(rows) if batch else template.records(rows)
+    with open(part, 'w', encoding='utf-8') as out:
+        return write_ndjson(records, out)
+
+
+def convert_parallel(path, out, workers, fmt='ndjson', header_rows=HEADER_ROWS, batch=False, encoding=ENCODING):
+    """Convert `path` with `workers` processes and write the result to `out` in row order."""
+    header, data_start = _data_start(path, header_rows, encoding)
+    ranges = _byte_ranges(data_start, os.path.getsize(path), workers)
+    with tempfile.TemporaryDirectory(prefix='csv_json-') as tmp:
+        parts = [os.path.join(tmp, f'{i:04d}.ndjson') for i in range(len(ranges))]
+        jobs = [(path, start, end, data_start, header, batch, part, encoding)
+                for (start, end), part in zip(ranges, parts)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            count = sum(pool.map(_convert_range, jobs))
+        if fmt == 'array':
+            out.write('[')
+        first = True
+        for part in parts:
+            with open(part, encoding='utf-8') as f:
+                for line in f:
+                    if fmt == 'array':
+                        out.write(line.rstrip('\n') if first else ',' + line.rstrip('\n'))
+                    else:
+                        out.write(line)
+                    first = False
+        if fmt == 'array':
+            out.write(']')
+    return count
+
+
+def convert(path, output, fmt='ndjson', indent=None, header_rows=HEADER_ROWS, batch=False, workers=1,
+            encoding=ENCODING):
+    """Convert the CSV at `path` into `output` ('-' for stdout). Returns the number of records."""
+    out = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+    try:
+        if workers > 1:
+            if indent is not None:
+                raise ValueError('--indent is not supported with --workers')
+            return convert_parallel(path, out, workers, fmt, header_rows, batch, encoding)
+        records = iter_records(path, header_rows, batch, encoding)
+        if fmt == 'array':
+            return write_array(records, out, indent)
+        return write_ndjson(records, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a CSV with hierarchical headers to JSON.')
+    parser.add_argument('input', help='CSV file')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    parser.add_argument('--format', choices=('ndjson', 'array'), default='ndjson')
+    parser.add_argument('--indent', type=int, help='pretty-print a --format array output')
+    parser.add_argument('--header-rows', type=int, default=HEADER_ROWS)
+    parser.add_argument('--batch', action='store_true', help='coerce numbers per column with pandas')
+    parser.add_argument('--workers', type=int, default=1, help='convert byte ranges in parallel processes')
+    args = parser.parse_args(argv)
+
+    count = convert(args.input, args.output, args.format, args.indent, args.header_rows, args.batch, args.workers)
+    print(f'Converted {count} rows.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,23 +24,24 @@ export default function DashboardPage() {
     fetchForms();
   }, []);
 
-  // Fetch metrics data for a form
-  const fetchMetricsData = async (formName) => {
+  // Fetch metrics for several forms in one request
+  const fetchMetricsData = async (formNames) => {
     try {
-      const res = await fetch(`http://127.0.0.1:5000/api/form/metrics?name=${encodeURIComponent(formName)}`);
+      // One names= parameter per form: a name may itself contain a comma
+      const params = new URLSearchParams(formNames.map((name) => ['names', name]));
+      const res = await fetch(`http://127.0.0.1:5000/api/form/metrics?${params}`);
       if (!res.ok) throw new Error('Error fetching metrics');
       const data = await res.json();
-      setMetricsData((prev) => ({ ...prev, [formName]: data }));
+      setMetricsData((prev) => ({ ...prev, ...data }));
     } catch (err) {
-      console.error(`Error fetching metrics for ${formName}`, err);
+      console.error('Error fetching metrics', err);
     }
   };
 
   // Fetch metrics for all forms on initial load
   useEffect(() => {
-    availableForms.forEach((form) => {
-      if (!metricsData[form]) fetchMetricsData(form);
-    });
+    const missing = availableForms.filter((form) => !metricsData[form]);
+    if (missing.length) fetchMetricsData(missing);
   }, [availableForms]);
 
   // Render graphs for a form
@@ -1,49 +1,95 @@
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
+from flask import Blueprint, Flask, request, jsonify
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 import os
 
-app = Flask(__name__)
+from json_stream import json_response, stream_json_array
+from listing import filters, next_after, page_edge, page_limit
+
+from mongo_clients import lazy_collection
+from mongo_indexes import ensure_indexes
+from response_cache import ResponseCache, bump_version
+from nf_sync import NF_FILTERS, NF_SORT, nf_projection, sync_nfs
+
+bp = Blueprint('nfs', __name__)
 
 # Replace the URI with your MongoDB connection string.
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
-client = MongoClient(MONGO_URI)
-db = client['metricsdb']
-nfs_collection = db['nfs']
+# Connects per process on first use (see mongo_clients.py)
+nfs_collection = lazy_collection(MONGO_URI, 'metricsdb', 'nfs')
+cache = ResponseCache()
+# Run each save in a transaction (needs a replica set); ?transaction=1 per request
+SYNC_IN_TRANSACTION = os.environ.get("NFS_SYNC_TRANSACTION", "").lower() in ("1", "true", "yes")
 
-def serialize_nf(nf):
-    nf['_id'] = str(nf['_id'])
-    return nf
+def init_db():
+    """One-time setup (`flask --app server init`): the collection's indexes."""
+    ensure_indexes(nfs_collection)
 
-@app.route('/api/nfs', methods=['GET'])
+@bp.route('/api/nfs', methods=['GET'])
+@cache.cached(nfs_collection)
 def get_nfs():
+    """
+    Stream NFs as a JSON array, ordered by _id.
+
+    Query parameters (all optional):
+      - type, product, vastId: exact-match filters
+      - fields: comma-separated fields to return (`_id` is always included)
+      - limit: page size, at most MAX_PAGE_SIZE; without it every NF is streamed
+      - after: cursor from the previous page's X-Next-After header (an NF _id)
+
+    When more results remain after a page, X-Next-After holds the cursor for the next one.
+    """
+    query = filters(request.args, NF_FILTERS)
     try:
-        nfs_cursor = nfs_collection.find()
-        nfs = [serialize_nf(nf) for nf in nfs_cursor]
-        return jsonify(nfs), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        if request.args.get("after"):
+            query["_id"] = {"$gt": ObjectId(request.args["after"])}
+        limit = page_limit(request.args)
+    except (ValueError, InvalidId):
+        return jsonify({"error": "invalid after or limit"}), 400
+
+    headers = {}
+    cursor = nfs_collection.find(query, nf_projection(request.args.get("fields"))).sort(NF_SORT)
+    if limit is not None:
+        after = next_after(list(page_edge(nfs_collection, query, NF_SORT, limit)), lambda nf: str(nf["_id"]))
+        if after:
+            headers["X-Next-After"] = after
+        cursor = cursor.limit(limit)
+    return stream_json_array(cursor, headers=headers)
+
+@bp.route('/api/nfs/<nf_id>', methods=['GET'])
+@cache.cached(nfs_collection)
+def get_nf(nf_id):
+    """One NF by its _id, or by the client-side `id` it was created with."""
+    try:
+        query = {"_id": ObjectId(nf_id)}
+    except InvalidId:
+        query = {"id": nf_id}
+    nf = nfs_collection.find_one(query, nf_projection(request.args.get("fields")))
+    if nf is None:
+        return jsonify({"error": "NF not found"}), 404
+    return json_response(nf)
 
-@app.route('/api/nfs', methods=['POST'])
+@bp.route('/api/nfs', methods=['POST'])
 def save_nfs():
     try:
         new_nfs = request.get_json()
         if not new_nfs:
             return jsonify({"error": "No data provided"}), 400
 
-        # For this example, clear the collection and insert new data.
-        nfs_collection.delete_many({})
-        if isinstance(new_nfs, list):
-            # Convert any provided _id strings back to ObjectId if needed.
-            for nf in new_nfs:
-                nf.pop('_id', None)  # Remove _id if present, letting Mongo generate a new one.
-            result = nfs_collection.insert_many(new_nfs)
-        else:
-            new_nfs.pop('_id', None)
-            result = nfs_collection.insert_one(new_nfs)
-        return jsonify({"message": "Data saved"}), 200
+        # Only write the NFs that were added, changed or removed; unchanged
+        # documents keep their _id and the collection is never empty mid-save.
+        if not isinstance(new_nfs, list):
+            new_nfs = [new_nfs]
+        transaction = SYNC_IN_TRANSACTION or request.args.get("transaction") in ("1", "true")
+        counts = sync_nfs(nfs_collection, new_nfs, transaction=transaction)
+        if counts["inserted"] or counts["updated"] or counts["deleted"]:
+            bump_version(nfs_collection)
+        return jsonify({"message": "Data saved", **counts}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
+    init_db()
+    app = Flask(__name__)
+    app.register_blueprint(bp)
     app.run(debug=True, port=5000)
@@ -1,28 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, request, jsonify, send_file
 from flask_cors import CORS
-import pymongo
-from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 import os
-from werkzeug.utils import secure_filename
-import uuid
-import json
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+from form_repository import (fetch_form, find_version, form_metrics, insert_version, list_versions,
+                             record_save, touch)
+from form_schema import AnswerUpdate, schema_cache, schema_for
+from mongo_clients import lazy_database
+from mongo_indexes import ensure_indexes
+from upload_storage import make_storage, OffsetMismatch, SessionBusy, UnknownUpload
+
+# Forms and uploads; registered on the app by server.py (or below when run directly)
+bp = Blueprint('forms', __name__)
+CORS(bp)  # Enable CORS for all routes
 
 # Configure upload folder for files
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit file size to 16MB
 
-# MongoDB connection
-client = MongoClient('mongodb://localhost:27017/')
-db = client['form_database']
+@bp.record_once
+def configure(state):
+    state.app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    state.app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit request size to 16MB; larger files use /api/uploads
+
+# MongoDB connection, opened per process on first use (see mongo_clients.py)
+db = lazy_database('mongodb://localhost:27017/', 'form_database')
 forms_collection = db['forms']
 
+# Content-addressed upload storage (local files, or GridFS with UPLOAD_BACKEND=gridfs)
+storage = make_storage(UPLOAD_FOLDER, db)
+
 # Ensure BlankTemplate exists
 blank_template = {
     "form_name": "BlankTemplate",
@@ -46,9 +55,17 @@ blank_template = {
     ]
 }
 
-# Check if BlankTemplate exists, if not create it
-if forms_collection.count_documents({"form_name": "BlankTemplate", "version_name": "BlankTemplate_v_1"}) == 0:
-    forms_collection.insert_one(blank_template)
+def init_db():
+    """One-time setup (`flask --app server init`): indexes and the BlankTemplate form."""
+    ensure_indexes(forms_collection)
+    if hasattr(storage.blobs, 'create_indexes'):
+        storage.blobs.create_indexes()
+    # Check if BlankTemplate exists, if not create it
+    if forms_collection.count_documents({"form_name": "BlankTemplate", "version_name": "BlankTemplate_v_1"}) == 0:
+        try:
+            insert_version(forms_collection, touch(dict(blank_template)))
+        except DuplicateKeyError:
+            pass  # Seeded concurrently
 
 # Helper function to handle file uploads
 def handle_file_uploads(request_files, question_id, form_id):
@@ -57,17 +74,62 @@ def handle_file_uploads(request_files, question_id, form_id):
         files = request_files.getlist(question_id)
         for file in files:
             if file.filename:
-                # Generate unique filename to prevent conflicts
-                original_filename = secure_filename(file.filename)
-                filename = f"{uuid.uuid4()}_{original_filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                # Store relative path in database
-                relative_path = f"uploads/{filename}"
-                file_paths.append(relative_path)
+                # Stored once per content hash; the reference keeps the original name
+                file_paths.append(storage.save(file))
     return file_paths
 
-@app.route('/api/form', methods=['GET', 'POST'])
+# Resumable chunked uploads for files larger than MAX_CONTENT_LENGTH.
+# POST /api/uploads starts a session, PUT /api/uploads/<id>?offset=N appends
+# the request body (each chunk must fit in MAX_CONTENT_LENGTH), GET returns
+# the offset to resume from and POST /api/uploads/<id>/complete returns the
+# reference to submit as the file question's answer.
+@bp.route('/api/uploads', methods=['POST'])
+def start_upload():
+    body = request.get_json(silent=True) or {}
+    filename = body.get('filename') or request.args.get('filename')
+    if not filename:
+        return jsonify({"error": "filename is required"}), 400
+    upload_id = storage.start_session(filename)
+    return jsonify(storage.status(upload_id)), 201
+
+@bp.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def upload_session(upload_id):
+    try:
+        if request.method == 'GET':
+            return jsonify(storage.status(upload_id))
+        if request.method == 'DELETE':
+            storage.abort(upload_id)
+            return '', 204
+        try:
+            offset = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({"error": "offset is required"}), 400
+        new_offset = storage.append(upload_id, offset, request.stream)
+        return jsonify({"upload_id": upload_id, "offset": new_offset})
+    except UnknownUpload:
+        return jsonify({"error": "Upload not found"}), 404
+    except OffsetMismatch as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    except SessionBusy:
+        return jsonify({"error": "Upload is busy with another request"}), 409
+
+@bp.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        return jsonify({"path": storage.complete(upload_id)})
+    except UnknownUpload:
+        return jsonify({"error": "Upload not found"}), 404
+    except SessionBusy:
+        return jsonify({"error": "Upload is busy with another request"}), 409
+
+@bp.route('/uploads/<sha>/<filename>')
+def download_upload(sha, filename):
+    try:
+        return send_file(storage.open(sha), download_name=filename)
+    except UnknownUpload:
+        return jsonify({"error": "File not found"}), 404
+
+@bp.route('/api/form', methods=['GET', 'POST'])
 def form_handler():
     form_name = request.args.get('name')
 
@@ -78,37 +140,12 @@ def form_handler():
     if request.method == 'GET':
         version_name = request.args.get('version')
 
-        # Query to get the form
-        query = {"form_name": form_name}
-        if version_name:
-            query["version_name"] = version_name
-
-        # Find the most recent form if no version specified
-        if not version_name:
-            forms = list(forms_collection.find({"form_name": form_name}))
-            if not forms:
-                return jsonify({"error": "Form not found"}), 404
-
-            # Get all available versions for this form
-            versions = [form["version_name"] for form in forms]
-
-            # Return the first form with all versions
-            form_data = forms[0]
-            form_data["versions"] = versions
-
-            # Convert ObjectId to string for JSON serialization
-            form_data["_id"] = str(form_data["_id"])
-            return jsonify(form_data)
-
-        # If version is specified, return that specific version
-        form_data = forms_collection.find_one(query)
+        # Fetch the requested version (or the latest one if none is specified),
+        # then the version list: two indexed queries (see form_repository.fetch_form)
+        form_data, versions = fetch_form(forms_collection, form_name, version_name)
         if not form_data:
             return jsonify({"error": "Form not found"}), 404
 
-        # Get all versions for this form
-        all_versions = forms_collection.find({"form_name": form_name})
-        versions = [form["version_name"] for form in all_versions]
-
         # Add versions to the response
         form_data["versions"] = versions
 
@@ -142,18 +179,14 @@ def form_handler():
 
         # Retrieve existing form if not cloning blank template
         existing_form = None
+        versions = []
         if cloning_blank:
             # Get BlankTemplate
-            existing_form = forms_collection.find_one({
-                "form_name": "BlankTemplate",
-                "version_name": "BlankTemplate_v_1"
-            })
+            existing_form = find_version(forms_collection, "BlankTemplate", "BlankTemplate_v_1")
+            versions = list_versions(forms_collection, form_name)
         elif version_name:
-            # Get existing form to update or clone
-            existing_form = forms_collection.find_one({
-                "form_name": form_name,
-                "version_name": version_name
-            })
+            # Get existing form to update or clone, with its version list
+            existing_form, versions = fetch_form(forms_collection, form_name, version_name)
 
         if not existing_form:
             return jsonify({"error": "Form not found"}), 404
@@ -166,6 +199,7 @@ def form_handler():
         if is_cloning:
             # Create a new version
             updated_form = dict(existing_form)
+            updated_form.pop("submitted_at", None)
             updated_form["form_name"] = form_name  # Set form name for the new version
             updated_form["version_name"] = new_version_name
 
@@ -180,9 +214,14 @@ def form_handler():
             # Update existing version
             updated_form = dict(existing_form)
 
-            # If renaming the version
-            if new_version_name:
-                updated_form["version_name"] = new_version_name
+        # Question id -> position index for this version; changed answers are
+        # collected as targeted $set paths
+        schema = schema_for(updated_form)
+        update = AnswerUpdate(schema)
+
+        # If renaming the version
+        if new_version_name and not is_cloning:
+            update.set_field(updated_form, "version_name", new_version_name)
 
         # Process form fields and files
         for key, value in request.form.items():
@@ -191,58 +230,96 @@ def form_handler():
                 continue
 
             # Update the answer in the form structure
-            found = False
-            for section in updated_form["sections"]:
-                for question in section["questions"]:
-                    if question["id"] == key:
-                        # Handle special cases (checkboxes, etc.)
-                        if question["type"] == "checkbox":
-                            # Convert comma-separated string to array
-                            question["answer"] = value.split(',') if value else []
-                        else:
-                            question["answer"] = value
-                        found = True
-                        break
-                if found:
-                    break
+            question = schema.question(updated_form, key)
+            if question is None:
+                continue
+            # Handle special cases (checkboxes, etc.)
+            if question["type"] in ("checkbox", "file"):
+                # Convert comma-separated string to array (for files: the
+                # references the client keeps, including completed uploads)
+                update.set(question, value.split(',') if value else [])
+            else:
+                update.set(question, value)
 
         # Process file uploads
-        for section in updated_form["sections"]:
-            for question in section["questions"]:
-                if question["type"] == "file":
-                    file_paths = handle_file_uploads(request.files, question["id"], str(existing_form.get("_id")))
-                    if file_paths:
-                        # Keep existing files and add new ones
-                        existing_files = question.get("answer", [])
-                        if existing_files is None:
-                            existing_files = []
-                        question["answer"] = existing_files + file_paths
-
-        # Set submission status if action is 'submit'
-        if action == 'submit':
-            updated_form["submitted"] = True
+        for question in schema.questions(updated_form, schema.file_questions):
+            file_paths = handle_file_uploads(request.files, question["id"], str(existing_form.get("_id")))
+            if file_paths:
+                # Keep existing files and add new ones
+                existing_files = question.get("answer", [])
+                if existing_files is None:
+                    existing_files = []
+                update.set(question, existing_files + file_paths)
+
+        # Set submission status if action is 'submit', and keep the
+        # completion counters in step with the answers
+        record_save(update, updated_form, submit=action == 'submit')
 
         # Save to database
         if is_cloning:
-            # Insert as a new document
-            forms_collection.insert_one(updated_form)
+            # Insert as a new document sharing the source's schema; the unique
+            # (form_name, version_name) index rejects a concurrent clone to the
+            # same version name
+            touch(updated_form)
+            try:
+                insert_version(forms_collection, updated_form)
+            except DuplicateKeyError:
+                return jsonify({"error": f"Version '{new_version_name}' already exists"}), 409
             updated_form["_id"] = str(updated_form.get("_id"))
-        else:
-            # Update existing document
-            forms_collection.update_one(
-                {"_id": existing_form["_id"]},
-                {"$set": updated_form}
+            versions.append(new_version_name)
+        elif update.changed:
+            # Write only the changed answers; the guard makes the update miss
+            # if the questions moved since the form was read
+            touch(updated_form)
+            result = forms_collection.update_one(
+                {"_id": existing_form["_id"], **update.guard},
+                {"$set": {**update.fields, "updated_at": updated_form["updated_at"]}}
             )
+            if result.matched_count == 0:
+                return jsonify({"error": "Form was modified, reload and try again"}), 409
+            updated_form["_id"] = str(existing_form["_id"])
+            if new_version_name:
+                schema_cache.invalidate(form_name, version_name)
+                versions = [new_version_name if v == version_name else v for v in versions]
+        else:
+            # Nothing changed, skip the write
             updated_form["_id"] = str(existing_form["_id"])
-
-        # Get all versions for this form
-        all_versions = forms_collection.find({"form_name": form_name})
-        versions = [form["version_name"] for form in all_versions]
 
         # Add versions to the response
         updated_form["versions"] = versions
+        updated_form["changed_fields"] = update.changed
 
         return jsonify(updated_form)
 
+@bp.route('/api/forms', methods=['GET'])
+def list_forms():
+    """Names of all forms (except the blank template) for the dashboard."""
+    names = forms_collection.distinct("form_name")
+    return jsonify({"forms": sorted(n for n in names if n != "BlankTemplate")})
+
+@bp.route('/api/form/metrics', methods=['GET'])
+def get_form_metrics():
+    """
+    Completion metrics per version and submissions per day, read from the
+    counters maintained on save.
+      - name: one form; returns its metrics
+      - names: one form per parameter (names=a&names=b, so names may hold commas);
+        returns {form_name: metrics}
+    """
+    names = [n for n in request.args.getlist('names') if n]
+    if names:
+        return jsonify(form_metrics(forms_collection, names))
+
+    form_name = request.args.get('name')
+    if not form_name:
+        return jsonify({"error": "Form name is required"}), 400
+    metrics = form_metrics(forms_collection, [form_name])[form_name]
+    if not metrics["versions"]:
+        return jsonify({"error": "Form not found"}), 404
+    return jsonify(metrics)
+
 if __name__ == '__main__':
+    init_db()
+    app = Flask(__name__)
+    app.register_blueprint(bp)
     app.run(debug=True)
@@ -0,0 +1,294 @@
+"""
+Storage of form versions in the forms collection.
+
+Versions are stored copy-on-write: the question layout (sections, labels,
+placeholders, types) lives once in the `form_schemas` collection under the
+SHA-256 of its canonical JSON, and each version document holds only
+
+    {form_name, version_name, submitted, updated_at, schema_id, answers}
+
+where `answers` maps question id to answer and omits unanswered questions.
+Cloning a version therefore copies its answers, not its schema. assemble()
+rebuilds the embedded `sections` response shape on read; schema documents are
+immutable, so they are cached in-process by id. Documents in the older
+embedded layout are still read and written as they are until
+migrate_forms.py converts them.
+
+fetch_form returns the requested version (or the latest one) together with the
+list of version names: the version is one indexed point lookup, and the names
+come from a query covered by the form_versions index, so callers never load
+every full version document just to read its version_name.
+
+"Latest" is the version with the most recent `updated_at`, which every write
+path sets through touch(). Versions written before `updated_at` existed sort
+after those that have it, newest `_id` first.
+
+Every version also stores `metrics` (answered/required/total question counts,
+see completion_stats), written together with the answers on each save, so the
+dashboard endpoints read a few small fields per version instead of every form.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from form_schema import SchemaCache
+
+LATEST_FIRST = {'updated_at': -1, '_id': -1}
+SCHEMA_COLLECTION = 'form_schemas'
+
+# Response-only fields that are never stored
+RESPONSE_FIELDS = ('versions', 'changed_fields')
+
+
+def touch(form):
+    """Stamp a form version as modified now. Call before every insert/update."""
+    form['updated_at'] = datetime.now(timezone.utc)
+    return form
+
+
+VERSIONS_PROJECTION = {'_id': 1, 'version_name': 1}
+
+
+def form_lookup(form_name, version_name=None):
+    """(filter, sort) of the single version fetch_form returns."""
+    if version_name:
+        return {'form_name': form_name, 'version_name': version_name}, None
+    return {'form_name': form_name}, list(LATEST_FIRST.items())
+
+
+def fetch_form(collection, form_name, version_name=None):
+    """
+    Return (form, versions) for `form_name`.
+
+    `form` is the document for `version_name`, or the latest version when
+    `version_name` is None; it is None if no such version exists. `versions`
+    lists every version name of the form in creation order.
+    """
+    query, sort = form_lookup(form_name, version_name)
+    doc = collection.find_one(query, sort=sort)
+    form = assemble(collection, doc) if doc else None
+    return form, list_versions(collection, form_name)
+
+
+def find_version(collection, form_name, version_name):
+    """Return one version in the response shape, or None."""
+    doc = collection.find_one({'form_name': form_name, 'version_name': version_name})
+    return assemble(collection, doc) if doc else None
+
+
+def is_answered(answer):
+    return answer not in (None, '', [])
+
+
+def completion_stats(form):
+    """Question counts of a form in the response shape."""
+    stats = {'total': 0, 'answered': 0, 'required': 0, 'required_answered': 0}
+    for section in form.get('sections', []):
+        for question in section.get('questions', []):
+            answered = is_answered(question.get('answer'))
+            stats['total'] += 1
+            stats['answered'] += answered
+            if question.get('required'):
+                stats['required'] += 1
+                stats['required_answered'] += answered
+    return stats
+
+
+def record_save(update, form, submit=False):
+    """Add the submission flag and refreshed completion counters to a pending form_schema.AnswerUpdate."""
+    if submit and update.set_field(form, 'submitted', True):
+        update.set_field(form, 'submitted_at', datetime.now(timezone.utc))
+    update.set_field(form, 'metrics', completion_stats(form))
+
+
+METRICS_PROJECTION = {'form_name': 1, 'version_name': 1, 'submitted': 1, 'submitted_at': 1, 'updated_at': 1, 'metrics': 1}
+
+
+def form_metrics(collection, form_names):
+    """
+    Return {form_name: metrics} for the given forms, with per-version counters
+    and submissions per day. Versions stored before counters existed are
+    computed once and backfilled.
+    """
+    docs = []
+    for doc in collection.find(metrics_query(form_names), METRICS_PROJECTION).sort('_id', 1):
+        if doc.get('metrics') is None:
+            full = collection.find_one({'_id': doc['_id']})
+            doc['metrics'] = completion_stats(assemble(collection, full)) if full else completion_stats({})
+            collection.update_one({'_id': doc['_id']}, {'$set': {'metrics': doc['metrics']}})
+        docs.append(doc)
+    return summarize_metrics(form_names, docs)
+
+
+def metrics_query(form_names):
+    return {'form_name': {'$in': list(form_names)}}
+
+
+def summarize_metrics(form_names, docs):
+    """Build the form_metrics result from METRICS_PROJECTION documents that all carry `metrics`."""
+    result = {name: {'form_name': name, 'versions': [], 'submissions_over_time': []} for name in form_names}
+    submissions = {name: {} for name in form_names}
+    for doc in docs:
+        result[doc['form_name']]['versions'].append({
+            'version_name': doc['version_name'],
+            'submitted': bool(doc.get('submitted')),
+            'updated_at': doc.get('updated_at'),
+            **doc['metrics'],
+        })
+        if doc.get('submitted'):
+            when = doc.get('submitted_at') or doc.get('updated_at')
+            day = when.strftime('%Y-%m-%d') if when else 'unknown'
+            submissions[doc['form_name']][day] = submissions[doc['form_name']].get(day, 0) + 1
+    for name, days in submissions.items():
+        result[name]['submissions_over_time'] = [{'date': d, 'count': c} for d, c in sorted(days.items())]
+    return result
+
+
+def list_versions(collection, form_name):
+    """Return the version names of `form_name` in creation order."""
+    cursor = collection.find({'form_name': form_name}, VERSIONS_PROJECTION).sort('_id', 1)
+    return [v['version_name'] for v in cursor]
+
+
+# Copy-on-write layout
+
+def default_answer(question):
+    return [] if question.get('type') in ('checkbox', 'file') else None
+
+
+def _valid_answer_key(qid):
+    return isinstance(qid, str) and qid and '.' not in qid and not qid.startswith('$')
+
+
+def can_share_schema(form):
+    """Whether every question id can be used as a key of the answers map."""
+    return all(_valid_answer_key(q.get('id')) for s in form.get('sections', []) for q in s.get('questions', []))
+
+
+def schema_of(form):
+    """Return the schema document ({_id: sha256, sections}) of an embedded-layout form."""
+    sections = [
+        {**{k: v for k, v in section.items() if k != 'questions'},
+         'questions': [{k: v for k, v in q.items() if k != 'answer'} for q in section.get('questions', [])]}
+        for section in form.get('sections', [])
+    ]
+    canonical = json.dumps(sections, sort_keys=True, separators=(',', ':'), default=str)
+    return {'_id': hashlib.sha256(canonical.encode()).hexdigest(), 'sections': sections}
+
+
+def answers_of(form):
+    """Return the compact answers map of a form in the response shape."""
+    return {
+        q['id']: q.get('answer')
+        for s in form.get('sections', []) for q in s.get('questions', [])
+        if q.get('answer') != default_answer(q)
+    }
+
+
+# Stored schema documents by id; they never change once written
+_schemas = SchemaCache()
+
+
+def load_schema(schemas, schema_id):
+    """Return the schema document `schema_id` from the `schemas` collection, cached."""
+    schema = _schemas.peek(schema_id)
+    if schema is not None:
+        return schema
+    schema = schemas.find_one({'_id': schema_id})
+    if schema is None:
+        raise LookupError(f'form schema {schema_id} not found')
+    return _schemas.put(schema_id, schema)
+
+
+def save_schema(collection, schema):
+    """Store a schema document if it is not stored yet. Returns its id."""
+    collection.database[SCHEMA_COLLECTION].update_one(
+        {'_id': schema['_id']}, {'$setOnInsert': {'sections': schema['sections']}}, upsert=True
+    )
+    return schema['_id']
+
+
+def assemble(collection, doc):
+    """Rebuild the embedded `sections` shape of a version document (no-op for the embedded layout)."""
+    if 'schema_id' not in doc:
+        return doc
+    schema = load_schema(collection.database[SCHEMA_COLLECTION], doc['schema_id'])
+    answers = doc.get('answers') or {}
+    form = {k: v for k, v in doc.items() if k != 'answers'}
+    form['sections'] = [
+        {**{k: v for k, v in section.items() if k != 'questions'},
+         'questions': [{**q, 'answer': answers.get(q['id'], default_answer(q))} for q in section['questions']]}
+        for section in schema['sections']
+    ]
+    return form
+
+
+async def assemble_async(collection, doc):
+    """assemble() for a Motor collection: an uncached schema is loaded with an awaited query."""
+    schema_id = doc.get('schema_id')
+    if schema_id is not None and _schemas.peek(schema_id) is None:
+        schema = await collection.database[SCHEMA_COLLECTION].find_one({'_id': schema_id})
+        if schema is None:
+            raise LookupError(f'form schema {schema_id} not found')
+        _schemas.put(schema_id, schema)
+    return assemble(collection, doc)
+
+
+def version_document(collection, form):
+    """
+    Return the stored (copy-on-write) document for a form in the response shape.
+
+    A form that already carries a schema_id keeps it; otherwise its schema is
+    hashed and stored. Forms whose question ids cannot be map keys stay embedded.
+    """
+    if 'schema_id' not in form:
+        if not can_share_schema(form):
+            return {k: v for k, v in form.items() if k not in RESPONSE_FIELDS}
+        form['schema_id'] = save_schema(collection, schema_of(form))
+    doc = {k: v for k, v in form.items() if k not in RESPONSE_FIELDS and k != 'sections'}
+    doc['answers'] = answers_of(form)
+    return doc
+
+
+def insert_version(collection, form):
+    """Insert a new version given in the response shape; sets form['_id'] (and schema_id)."""
+    form['metrics'] = completion_stats(form)
+    doc = version_document(collection, form)
+    collection.insert_one(doc)
+    form['_id'] = doc['_id']
+    return form
+
+
+def clone_version(collection, source, form_name, version_name, keep_answers=True):
+    """
+    Insert a copy of stored version document `source` under a new version name.
+
+    Only the answers map is copied (or dropped when keep_answers is False);
+    the schema is shared. Returns the new version in the response shape.
+    """
+    if 'schema_id' not in source:
+        if not can_share_schema(source):
+            form = {**source, 'form_name': form_name, 'version_name': version_name, 'submitted': False}
+            form.pop('_id', None)
+            form.pop('submitted_at', None)
+            if not keep_answers:
+                for section in form['sections']:
+                    for question in section['questions']:
+                        question['answer'] = None
+            form['metrics'] = completion_stats(form)
+            collection.insert_one(touch(form))
+            return form
+        source = version_document(collection, source)
+    doc = {
+        'form_name': form_name,
+        'version_name': version_name,
+        'submitted': False,
+        'schema_id': source['schema_id'],
+        'answers': dict(source.get('answers') or {}) if keep_answers else {},
+    }
+    form = assemble(collection, doc)
+    doc['metrics'] = form['metrics'] = completion_stats(form)
+    collection.insert_one(touch(doc))
+    form['_id'] = doc['_id']
+    form['updated_at'] = doc['updated_at']
+    return form
@@ -0,0 +1,225 @@
+"""
+Compiled question index for form versions.
+
+A FormSchema maps each question id to its (section index, question index,
+type) and lists the file and checkbox questions up front, so applying N
+submitted fields costs O(N) lookups instead of a walk over every question for
+each field.
+
+Schemas are cached per (form_name, version_name). A cached schema is checked
+against the form's shape (question count per section) when it is fetched and
+against the question id at each position it resolves; any mismatch recompiles
+it, so edits to a version's questions never apply answers to the wrong one.
+
+AnswerUpdate records answer changes as $set paths so a save writes only the
+answers that differ from the stored document: `answers.<id>` for versions
+that share a schema document (see form_repository), and positional
+`sections.<i>.questions.<j>.answer` paths for the embedded layout. Shared
+schemas are immutable, so their compiled form is cached by schema_id.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+MAX_CACHED_SCHEMAS = 256
+
+
+def _shape(form):
+    return tuple(len(section.get('questions', [])) for section in form.get('sections', []))
+
+
+class _Layout:
+    """The compiled positions of one form layout; never modified once built."""
+
+    __slots__ = ('schema_id', 'shape', 'positions', 'file_questions', 'checkbox_questions')
+
+    def __init__(self, form):
+        self.schema_id = form.get('schema_id')
+        self.shape = _shape(form)
+        positions = {}
+        file_questions = []
+        checkbox_questions = []
+        for si, section in enumerate(form.get('sections', [])):
+            for qi, question in enumerate(section.get('questions', [])):
+                qid = question.get('id')
+                qtype = question.get('type')
+                # The first question with a given id wins, as with the old linear search
+                if qid is None or qid in positions:
+                    continue
+                positions[qid] = (si, qi, qtype)
+                if qtype == 'file':
+                    file_questions.append(qid)
+                elif qtype == 'checkbox':
+                    checkbox_questions.append(qid)
+        self.positions = positions
+        self.file_questions = tuple(file_questions)
+        self.checkbox_questions = tuple(checkbox_questions)
+
+
+class FormSchema:
+    """
+    A cached schema is shared by concurrent requests. compile() builds a new
+    _Layout and swaps it in with one assignment, so a reader always sees
+    either the old layout or the new one, never a half-built index.
+    """
+
+    def __init__(self, form):
+        self._layout = _Layout(form)
+
+    def compile(self, form):
+        layout = _Layout(form)
+        self._layout = layout
+        return layout
+
+    @property
+    def schema_id(self):
+        return self._layout.schema_id
+
+    @property
+    def shape(self):
+        return self._layout.shape
+
+    @property
+    def positions(self):
+        return self._layout.positions
+
+    @property
+    def file_questions(self):
+        return self._layout.file_questions
+
+    @property
+    def checkbox_questions(self):
+        return self._layout.checkbox_questions
+
+    @staticmethod
+    def _at(layout, form, qid):
+        si, qi, _ = layout.positions[qid]
+        try:
+            question = form['sections'][si]['questions'][qi]
+        except (KeyError, IndexError):
+            return None
+        return question if question.get('id') == qid else None
+
+    def question(self, form, qid):
+        """Return the question dict for `qid` in `form`, or None if the form has no such question."""
+        layout = self._layout
+        if qid not in layout.positions:
+            return None
+        question = self._at(layout, form, qid)
+        if question is None:
+            # The stored layout no longer matches this form; rebuild and retry once
+            layout = self.compile(form)
+            if qid not in layout.positions:
+                return None
+            question = self._at(layout, form, qid)
+        return question
+
+    def answer_path(self, qid):
+        layout = self._layout
+        if layout.schema_id:
+            return f'answers.{qid}'
+        si, qi, _ = layout.positions[qid]
+        return f'sections.{si}.questions.{qi}.answer'
+
+    def guard(self, qid):
+        """Filter that only matches while the stored layout still places `qid` where this schema does."""
+        layout = self._layout
+        if layout.schema_id:
+            return {'schema_id': layout.schema_id}
+        si, qi, _ = layout.positions[qid]
+        return {f'sections.{si}.questions.{qi}.id': qid}
+
+    def questions(self, form, qids):
+        """Yield the question dicts for `qids` (e.g. self.file_questions) in `form`."""
+        for qid in list(qids):
+            question = self.question(form, qid)
+            if question is not None:
+                yield question
+
+
+class AnswerUpdate:
+    """
+    Applies answers to a form and collects only the ones that changed.
+
+    `fields` is the $set document (answer paths plus any top-level fields);
+    `guard` pins the schema, or the question id at each written position, so
+    the update matches nothing if the layout changed since the read.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields = {}
+        self.guard = {}
+
+    def set(self, question, value):
+        """Set a question's answer; returns True if it changed."""
+        if question.get('answer') == value and 'answer' in question:
+            return False
+        question['answer'] = value
+        qid = question['id']
+        self.fields[self.schema.answer_path(qid)] = value
+        self.guard.update(self.schema.guard(qid))
+        return True
+
+    def set_field(self, form, name, value):
+        """Set a top-level field of the form; returns True if it changed."""
+        if form.get(name) == value and name in form:
+            return False
+        form[name] = value
+        self.fields[name] = value
+        return True
+
+    @property
+    def changed(self):
+        return len(self.fields)
+
+
+class SchemaCache:
+    """
+    Bounded LRU keyed by schema_id, or (form_name, version_name) for embedded
+    forms. It holds the compiled FormSchema objects here and the stored schema
+    documents in form_repository.
+    """
+
+    def __init__(self, maxsize=MAX_CACHED_SCHEMAS):
+        self.maxsize = maxsize
+        self._schemas = OrderedDict()
+        self._lock = Lock()
+
+    def peek(self, key):
+        """The cached value for `key`, or None."""
+        with self._lock:
+            value = self._schemas.get(key)
+            if value is not None:
+                self._schemas.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._schemas[key] = value
+            self._schemas.move_to_end(key)
+            while len(self._schemas) > self.maxsize:
+                self._schemas.popitem(last=False)
+        return value
+
+    def get(self, form):
+        """Return the compiled schema for a form version document."""
+        key = form.get('schema_id') or (form.get('form_name'), form.get('version_name'))
+        schema = self.peek(key)
+        if schema is None or schema.shape != _shape(form):
+            schema = self.put(key, FormSchema(form))
+        return schema
+
+    def invalidate(self, form_name, version_name=None):
+        """Drop one version's schema, or every version of `form_name` when version_name is None."""
+        with self._lock:
+            for key in [k for k in self._schemas
+                        if isinstance(k, tuple) and k[0] == form_name and version_name in (None, k[1])]:
+                del self._schemas[key]
+
+
+schema_cache = SchemaCache()
+
+
+def schema_for(form):
+    """Return the compiled schema for a form version document."""
+    return schema_cache.get(form)
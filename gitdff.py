@@ -1,64 +1,129 @@
-import base64
+import contextvars
+import os
+import json
 import requests
-import difflib
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Flask, Response, request, jsonify, stream_with_context
 
-app = Flask(__name__)
+from gitlab_client import BlobCache, GitLabClient, GitLabError
+from text_diff import (MAX_TREE_FILES, changed_paths, diff_args, render_diff, tree_args, tree_error_line,
+                       tree_file_head, tree_file_line, tree_file_result, tree_tail_lines)
 
-# Configure these variables with your GitLab details
-GITLAB_API_URL = 'https://gitlab.com/api/v4'
-PRIVATE_TOKEN = 'your_gitlab_private_token'
-PROJECT_ID = 'your_project_id'  # e.g. 123456 or URL encoded if necessary
-DEFAULT_FILE_PATH = 'path/to/file.txt'   # Default file path (can be overridden via query parameter)
+bp = Blueprint("diff", __name__)
+
+# GitLab details come from GITLAB_API_URL, GITLAB_TOKEN and GITLAB_PROJECT_ID (see gitlab_client.py)
+DEFAULT_FILE_PATH = os.environ.get('GITLAB_DEFAULT_FILE', 'path/to/file.txt')   # Default file path (can be overridden via query parameter)
+gitlab = GitLabClient()
 
 def get_file_from_gitlab(branch, file_path):
     """
     Retrieve the file content from the given branch via the GitLab API.
-    The file content is returned as a list of lines.
+    The file content is returned as a list of lines (empty if the file does not exist).
     """
-    # URL encode the file path for the API request
-    encoded_path = requests.utils.quote(file_path, safe='')
-    url = f"{GITLAB_API_URL}/projects/{PROJECT_ID}/repository/files/{encoded_path}"
-    params = { "ref": branch }
-    headers = { "PRIVATE-TOKEN": PRIVATE_TOKEN }
-    
-    response = requests.get(url, params=params, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        # The file content is base64 encoded; decode it into text and split into lines
-        content = base64.b64decode(data['content']).decode('utf-8')
-        return content.splitlines()
-    else:
-        print(f"Error fetching file from branch '{branch}': {response.status_code} {response.text}")
-        return []
-
-@app.route('/api/diff')
+    return gitlab.file_lines(branch, file_path)[1]
+
+rendered = BlobCache(max_bytes=int(os.environ.get('DIFF_CACHE_BYTES', str(32 * 1024 * 1024))))
+
+@bp.route('/api/diff')
 def get_diff():
     """
     API endpoint that accepts query parameters:
       - branch1: first branch name
       - branch2: second branch name
       - file_path: (optional) file path to compare; defaults to DEFAULT_FILE_PATH if omitted.
-      
-    It returns an HTML diff between the file versions from the two branches.
+      - format: (optional) html (default), unified or json. json returns
+        {from, to, old_lines, new_lines, summary, stats, hunks} for the frontend to render.
+      - context: (optional) unchanged lines around each change; html shows the whole file without it.
+
+    Rendered diffs are cached by the blob SHAs of both sides, so diffs of files
+    that did not change between requests are served without recomputing them.
     """
-    branch1 = request.args.get('branch1')
-    branch2 = request.args.get('branch2')
-    file_path = request.args.get('file_path', DEFAULT_FILE_PATH)
-    
-    if not branch1 or not branch2:
-        return jsonify({'error': 'Please provide both branch1 and branch2 as query parameters.'}), 400
-
-    file1_lines = get_file_from_gitlab(branch1, file_path)
-    file2_lines = get_file_from_gitlab(branch2, file_path)
-    
-    # Generate an HTML diff using Python's difflib.HtmlDiff
-    html_diff = difflib.HtmlDiff(wrapcolumn=80).make_file(
-        file1_lines, file2_lines,
-        fromdesc=f"{branch1}:{file_path}",
-        todesc=f"{branch2}:{file_path}"
-    )
-    return html_diff
+    try:
+        branch1, branch2, file_path, fmt, context = diff_args(request.args, DEFAULT_FILE_PATH)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        (sha1, file1_lines), (sha2, file2_lines) = gitlab.file_pair(branch1, branch2, file_path)
+    except (GitLabError, requests.RequestException) as e:
+        return jsonify({'error': str(e)}), 502
+
+    fromdesc, todesc = f"{branch1}:{file_path}", f"{branch2}:{file_path}"
+    key = (sha1, sha2, fmt, context, fromdesc, todesc)
+    cached = rendered.get(key)
+    if cached is not None:
+        mimetype, body = cached.split(b'\n', 1)
+        return Response(body, mimetype=mimetype.decode())
+    body, mimetype, cacheable = render_diff(fmt, file1_lines, file2_lines, fromdesc, todesc, context)
+    if cacheable:
+        rendered.put(key, mimetype.encode() + b'\n' + body.encode())
+    return Response(body, mimetype=mimetype)
+
+# /api/diff/tree: the threads that fetch and diff its files
+tree_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('DIFF_TREE_WORKERS', '8')), thread_name_prefix='diff-tree')
+
+def blob_lines(sha):
+    return gitlab.blob(sha).decode('utf-8', errors='replace').splitlines() if sha else []
+
+def diff_tree_file(path, old, new, fmt, context):
+    """One NDJSON line for a changed file: its status and blobs plus stats (and hunks)."""
+    head = tree_file_head(path, old, new)
+    key = (old, new, 'tree-' + fmt, context)
+    body = rendered.get(key)
+    if body is None:
+        try:
+            result, cacheable = tree_file_result(blob_lines(old), blob_lines(new), fmt, context)
+        except (GitLabError, requests.RequestException) as e:
+            return tree_error_line(head, e)
+        body = json.dumps(result).encode()
+        if cacheable:
+            rendered.put(key, body)
+    return tree_file_line(head, body)
+
+@bp.route('/api/diff/tree')
+def get_tree_diff():
+    """
+    Diff every file under a directory between two branches, as NDJSON.
+
+    Query parameters:
+      - branch1, branch2: the branches to compare
+      - path: (optional) directory to compare; the whole repository if omitted
+      - format: (optional) hunks (default) or stats
+      - context: (optional) unchanged lines around each change
+
+    The tree listings of both branches carry every file's blob SHA, so only
+    files whose SHA differs are downloaded (through the blob cache) and diffed,
+    on a bounded thread pool. Each changed file is written as one line as soon
+    as it is ready: {path, status, old_blob, new_blob, summary, stats[, hunks]}
+    (or `error`). The last line is {"done": true, "files": <changed files>}.
+    """
+    try:
+        branch1, branch2, path, fmt, context = tree_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        files1, files2 = gitlab.tree_pair(branch1, branch2, path)
+    except (GitLabError, requests.RequestException) as e:
+        return jsonify({'error': str(e)}), 502
+    changed = changed_paths(files1, files2)
+
+    def generate():
+        # Each file runs in a copy of the request's context, so its GitLab calls are attributed to it
+        futures = [tree_pool.submit(contextvars.copy_context().run, diff_tree_file,
+                                    p, files1.get(p), files2.get(p), fmt, context)
+                   for p in changed[:MAX_TREE_FILES]]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()  # Client went away: drop the files not started yet
+        yield from tree_tail_lines(changed, files1, files2)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 if __name__ == "__main__":
+    app = Flask(__name__)
+    app.register_blueprint(bp)
     app.run(debug=True)
@@ -4,21 +4,75 @@ import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 
+type DiffFormat = 'json' | 'unified' | 'html';
+
+interface Hunk {
+  old_start: number;
+  old_lines: number;
+  new_start: number;
+  new_lines: number;
+  lines: [' ' | '-' | '+', string][];
+}
+
+interface JsonDiff {
+  from: string;
+  to: string;
+  old_lines: number;
+  new_lines: number;
+  summary: string | null;
+  stats: { added: number; removed: number } | null;
+  hunks: Hunk[];
+}
+
+// Hunks are rendered in pages so a large diff does not block the first paint.
+const HUNKS_PER_PAGE = 20;
+
+const lineClass = { ' ': '', '-': 'bg-red-50 text-red-800', '+': 'bg-green-50 text-green-800' };
+
+function HunkView({ hunk }: { hunk: Hunk }) {
+  return (
+    <div className="border rounded mb-3 overflow-x-auto">
+      <div className="bg-gray-100 px-2 py-1 font-mono text-xs text-gray-600">
+        @@ -{hunk.old_start},{hunk.old_lines} +{hunk.new_start},{hunk.new_lines} @@
+      </div>
+      {hunk.lines.map(([op, text], i) => (
+        <pre key={i} className={`px-2 font-mono text-xs whitespace-pre ${lineClass[op]}`}>
+          {op}{text}
+        </pre>
+      ))}
+    </div>
+  );
+}
+
 export default function DiffViewer() {
   const [branch1, setBranch1] = useState('');
   const [branch2, setBranch2] = useState('');
   const [filePath, setFilePath] = useState('');
+  const [format, setFormat] = useState<DiffFormat>('json');
+  const [context, setContext] = useState('3');
   const [diffHtml, setDiffHtml] = useState('');
+  const [diffText, setDiffText] = useState('');
+  const [diffJson, setDiffJson] = useState<JsonDiff | null>(null);
+  const [shownHunks, setShownHunks] = useState(HUNKS_PER_PAGE);
   const [loading, setLoading] = useState(false);
 
   const handleFetchDiff = async () => {
     setLoading(true);
+    setDiffHtml('');
+    setDiffText('');
+    setDiffJson(null);
+    setShownHunks(HUNKS_PER_PAGE);
     try {
-      const res = await fetch(
-        `/api/diff?branch1=${encodeURIComponent(branch1)}&branch2=${encodeURIComponent(branch2)}&file_path=${encodeURIComponent(filePath)}`
-      );
-      const text = await res.text();
-      setDiffHtml(text);
+      const params = new URLSearchParams({ branch1, branch2, file_path: filePath, format });
+      if (context !== '') params.set('context', context);
+      const res = await fetch(`/api/diff?${params}`);
+      if (format === 'json') {
+        setDiffJson(await res.json());
+      } else if (format === 'unified') {
+        setDiffText(await res.text());
+      } else {
+        setDiffHtml(await res.text());
+      }
     } catch (err) {
       console.error('Error fetching diff:', err);
     } finally {
@@ -61,12 +115,86 @@ export default function DiffViewer() {
                 className="mt-1"
               />
             </div>
+            <div className="flex gap-4">
+              <div>
+                <label className="block text-sm font-medium text-gray-700">Format:</label>
+                <select
+                  value={format}
+                  onChange={(e) => setFormat(e.target.value as DiffFormat)}
+                  className="mt-1 border rounded px-2 py-2 text-sm"
+                >
+                  <option value="json">Hunks</option>
+                  <option value="unified">Unified</option>
+                  <option value="html">Side by side (HTML)</option>
+                </select>
+              </div>
+              <div>
+                <label className="block text-sm font-medium text-gray-700">Context lines:</label>
+                <Input
+                  type="number"
+                  min={0}
+                  value={context}
+                  onChange={(e) => setContext(e.target.value)}
+                  className="mt-1 w-24"
+                />
+              </div>
+            </div>
             <Button onClick={handleFetchDiff} disabled={loading}>
               {loading ? 'Loading...' : 'Fetch Diff'}
             </Button>
           </div>
         </CardContent>
       </Card>
+      {diffJson && (
+        <div className="mt-6">
+          <Card>
+            <CardHeader>
+              <CardTitle>
+                {diffJson.from} &rarr; {diffJson.to}
+                {diffJson.stats && (
+                  <span className="ml-3 text-sm font-normal">
+                    <span className="text-green-700">+{diffJson.stats.added}</span>{' '}
+                    <span className="text-red-700">-{diffJson.stats.removed}</span>
+                  </span>
+                )}
+              </CardTitle>
+            </CardHeader>
+            <CardContent>
+              {diffJson.summary ? (
+                <p className="text-sm text-gray-700">
+                  The files differ, but the diff is too large to show ({diffJson.summary}:{' '}
+                  {diffJson.old_lines} &rarr; {diffJson.new_lines} lines).
+                </p>
+              ) : diffJson.hunks.length === 0 ? (
+                <p className="text-sm text-gray-700">No differences.</p>
+              ) : (
+                <>
+                  {diffJson.hunks.slice(0, shownHunks).map((hunk, i) => (
+                    <HunkView key={i} hunk={hunk} />
+                  ))}
+                  {shownHunks < diffJson.hunks.length && (
+                    <Button variant="outline" onClick={() => setShownHunks(shownHunks + HUNKS_PER_PAGE)}>
+                      Show more ({diffJson.hunks.length - shownHunks} hunks left)
+                    </Button>
+                  )}
+                </>
+              )}
+            </CardContent>
+          </Card>
+        </div>
+      )}
+      {diffText && (
+        <div className="mt-6">
+          <Card>
+            <CardHeader>
+              <CardTitle>Diff Output</CardTitle>
+            </CardHeader>
+            <CardContent>
+              <pre className="font-mono text-xs overflow-x-auto">{diffText}</pre>
+            </CardContent>
+          </Card>
+        </div>
+      )}
       {diffHtml && (
         <div className="mt-6">
           <Card>
@@ -0,0 +1,360 @@
+"""
+GitLab repository file access for the diff endpoints.
+
+    client = GitLabClient()                    # settings from the environment
+    (blob1, lines1), (blob2, lines2) = client.file_pair('main', 'release', 'config/app.yaml')
+
+A file is fetched in two steps: a HEAD request on the files API resolves the
+branch to the file's blob SHA (X-Gitlab-Blob-Id), then the raw blob is
+downloaded unless it is already cached. Blobs are immutable, so the cache is
+keyed by SHA alone and never needs invalidating; repeated diffs of the same
+files only cost the two HEAD requests. The cache is an in-memory LRU bounded
+in bytes, optionally backed by a size-limited directory shared by workers
+(GITLAB_CACHE_DIR).
+
+All requests go through one pooled requests.Session with timeouts and retries
+on transient errors, and both sides of a pair are fetched concurrently.
+tree() lists a directory with the blob SHA of every file, which is how
+directory diffs find changed files without downloading the unchanged ones.
+
+AsyncGitLabClient offers the same methods as coroutines on an aiohttp session
+(for async_app.py); it uses the same BlobCache and fetches both sides of a
+pair with asyncio.gather.
+
+Every API request is reported to the functions in `request_hooks` (used by
+instrumentation.py for timings).
+
+Settings: GITLAB_API_URL, GITLAB_TOKEN, GITLAB_PROJECT_ID, GITLAB_TIMEOUT,
+GITLAB_CACHE_BYTES, GITLAB_CACHE_DIR, GITLAB_DISK_CACHE_BYTES, GITLAB_ASYNC_POOL_SIZE.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+GITLAB_API_URL = os.environ.get('GITLAB_API_URL', 'https://gitlab.com/api/v4')
+PRIVATE_TOKEN = os.environ.get('GITLAB_TOKEN', 'your_gitlab_private_token')
+PROJECT_ID = os.environ.get('GITLAB_PROJECT_ID', 'your_project_id')
+TIMEOUT = float(os.environ.get('GITLAB_TIMEOUT', '10'))
+CACHE_BYTES = int(os.environ.get('GITLAB_CACHE_BYTES', str(128 * 1024 * 1024)))
+DISK_CACHE_BYTES = int(os.environ.get('GITLAB_DISK_CACHE_BYTES', str(1024 * 1024 * 1024)))
+# The disk cache is pruned to this fraction of its limit, so the next scan is some writes away
+PRUNE_TO = 0.9
+POOL_SIZE = 16
+ASYNC_POOL_SIZE = int(os.environ.get('GITLAB_ASYNC_POOL_SIZE', '100'))
+
+
+class GitLabError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f'GitLab returned {status}: {message}')
+        self.status = status
+
+
+# Network errors AsyncGitLabClient lets through (besides GitLabError)
+TRANSPORT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else (asyncio.TimeoutError,)
+
+
+# Called as hook(method, endpoint, status, seconds) after every API request;
+# status is None when no response came back
+request_hooks = []
+
+
+def endpoint_name(path):
+    """The API endpoint of a request path, without file paths or SHAs."""
+    parts = path.strip('/').split('/')
+    if parts[:2] == ['repository', 'blobs']:
+        return 'repository/blobs/raw'
+    return '/'.join(parts[:2])
+
+
+def _report(method, path, status, started):
+    seconds = time.perf_counter() - started
+    for hook in request_hooks:
+        hook(method, endpoint_name(path), status, seconds)
+
+
+class BlobCache:
+    """Blob contents by SHA: an LRU bounded by `max_bytes`, plus an optional directory bounded by `disk_bytes`."""
+
+    def __init__(self, max_bytes=CACHE_BYTES, directory=None, disk_bytes=DISK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._blobs = OrderedDict()
+        self._size = 0
+        self._disk_size = None  # Bytes in `directory` as of the last scan plus what put() wrote since
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sha):
+        return os.path.join(self.directory, sha)
+
+    def get(self, sha):
+        with self._lock:
+            data = self._blobs.get(sha)
+            if data is not None:
+                self._blobs.move_to_end(sha)
+                return data
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(sha), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(self._path(sha))  # Recently used files are pruned last
+        self._remember(sha, data)
+        return data
+
+    def put(self, sha, data):
+        self._remember(sha, data)
+        if self.directory:
+            # A unique temp name per writer: thread idents repeat across forked workers
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=f'{sha}.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, self._path(sha))
+            except BaseException:
+                os.remove(tmp)
+                raise
+            with self._lock:
+                if self._disk_size is not None:
+                    self._disk_size += len(data)
+                over = self._disk_size is None or self._disk_size > self.disk_bytes
+            if over:
+                self._prune_disk()
+
+    def _remember(self, sha, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if sha in self._blobs:
+                return
+            self._blobs[sha] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, old = self._blobs.popitem(last=False)
+                self._size -= len(old)
+
+    def _prune_disk(self):
+        """
+        Scan the directory and remove the least recently used files down to
+        PRUNE_TO of `disk_bytes`. put() keeps a running total of what it wrote
+        since the last scan and only scans again once that exceeds the limit;
+        files written by other workers are counted at the next scan.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.disk_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.disk_bytes * PRUNE_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._disk_size = total
+
+    def clear(self):
+        with self._lock:
+            self._blobs.clear()
+            self._size = 0
+
+
+class GitLabClient:
+    def __init__(self, base_url=GITLAB_API_URL, token=PRIVATE_TOKEN, project_id=PROJECT_ID,
+                 timeout=TIMEOUT, cache=None, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.project = f"{self.base_url}/projects/{quote(str(project_id), safe='')}"
+        self.timeout = timeout
+        self.cache = cache if cache is not None else BlobCache(directory=os.environ.get('GITLAB_CACHE_DIR'))
+        self.session = requests.Session()
+        self.session.headers['PRIVATE-TOKEN'] = token
+        retry = Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                      allowed_methods=('GET', 'HEAD'))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='gitlab')
+
+    def request(self, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.project + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException:
+            _report(method, path, None, started)
+            raise
+        _report(method, path, response.status_code, started)
+        if response.status_code >= 400 and response.status_code != 404:
+            raise GitLabError(response.status_code, response.text[:200])
+        return response
+
+    def blob_id(self, ref, file_path):
+        """Return the blob SHA of `file_path` on `ref`, or None if the file does not exist there."""
+        response = self.request('HEAD', f"/repository/files/{quote(file_path, safe='')}", params={'ref': ref})
+        if response.status_code == 404:
+            return None
+        return response.headers.get('X-Gitlab-Blob-Id')
+
+    def blob(self, sha):
+        """Return the raw bytes of a blob, from the cache when possible."""
+        data = self.cache.get(sha)
+        if data is None:
+            response = self.request('GET', f'/repository/blobs/{sha}/raw')
+            if response.status_code == 404:
+                raise GitLabError(404, f'blob {sha} not found')
+            data = response.content
+            self.cache.put(sha, data)
+        return data
+
+    def file(self, ref, file_path):
+        """Return (blob_sha, text) of a file on `ref`; (None, '') if it does not exist there."""
+        sha = self.blob_id(ref, file_path)
+        if sha is None:
+            return None, ''
+        return sha, self.blob(sha).decode('utf-8', errors='replace')
+
+    def file_lines(self, ref, file_path):
+        sha, text = self.file(ref, file_path)
+        return sha, text.splitlines()
+
+    def tree(self, ref, path=''):
+        """Return {file path: blob SHA} for every file under `path` on `ref` ({} if the path does not exist)."""
+        files = {}
+        page = '1'
+        while page:
+            response = self.request('GET', '/repository/tree', params={
+                'ref': ref, 'path': path, 'recursive': 'true', 'per_page': 100, 'page': page,
+            })
+            if response.status_code == 404:
+                return {}
+            for entry in response.json():
+                if entry.get('type') == 'blob':
+                    files[entry['path']] = entry['id']
+            page = response.headers.get('X-Next-Page')
+        return files
+
+    def _submit(self, fn, *args):
+        # Run in the caller's context so request-scoped state (instrumentation) follows the call
+        return self.pool.submit(contextvars.copy_context().run, fn, *args)
+
+    def tree_pair(self, ref1, ref2, path=''):
+        """List `path` on two refs concurrently; returns (files1, files2) as from tree()."""
+        first = self._submit(self.tree, ref1, path)
+        second = self._submit(self.tree, ref2, path)
+        return first.result(), second.result()
+
+    def file_pair(self, ref1, ref2, file_path):
+        """Fetch `file_path` from two refs concurrently; returns ((sha1, lines1), (sha2, lines2))."""
+        first = self._submit(self.file_lines, ref1, file_path)
+        second = self._submit(self.file_lines, ref2, file_path)
+        return first.result(), second.result()
+
+
+class AsyncGitLabClient:
+    """GitLabClient for asyncio code: the same methods, as coroutines. Needs aiohttp."""
+
+    def __init__(self, base_url=GITLAB_API_URL, token=PRIVATE_TOKEN, project_id=PROJECT_ID,
+                 timeout=TIMEOUT, cache=None, pool_size=ASYNC_POOL_SIZE, retries=2):
+        if aiohttp is None:
+            raise RuntimeError('AsyncGitLabClient needs aiohttp (pip install aiohttp)')
+        self.project = f"{base_url.rstrip('/')}/projects/{quote(str(project_id), safe='')}"
+        self.cache = cache if cache is not None else BlobCache(directory=os.environ.get('GITLAB_CACHE_DIR'))
+        self.retries = retries
+        # Must be created inside the event loop that uses it
+        self.session = aiohttp.ClientSession(
+            headers={'PRIVATE-TOKEN': token}, timeout=aiohttp.ClientTimeout(total=timeout),
+            connector=aiohttp.TCPConnector(limit=pool_size),
+        )
+
+    async def close(self):
+        await self.session.close()
+
+    async def request(self, method, path, **kwargs):
+        """Return (status, headers, body); retries transient errors like GitLabClient."""
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            status = None
+            try:
+                async with self.session.request(method, self.project + path, **kwargs) as response:
+                    body = await response.read()
+                    status = response.status
+                    _report(method, path, status, started)
+                    if response.status in (502, 503, 504) and attempt < self.retries:
+                        raise GitLabError(response.status, 'retrying')
+                    if response.status >= 400 and response.status != 404:
+                        raise GitLabError(response.status, body[:200].decode(errors='replace'))
+                    return response.status, response.headers, body
+            except (GitLabError, *TRANSPORT_ERRORS) as e:
+                if status is None:
+                    _report(method, path, None, started)
+                if attempt == self.retries or (isinstance(e, GitLabError) and e.status not in (502, 503, 504)):
+                    raise
+                await asyncio.sleep(0.2 * 2 ** attempt)
+
+    async def blob_id(self, ref, file_path):
+        status, headers, _ = await self.request(
+            'HEAD', f"/repository/files/{quote(file_path, safe='')}", params={'ref': ref})
+        return None if status == 404 else headers.get('X-Gitlab-Blob-Id')
+
+    async def blob(self, sha):
+        data = self.cache.get(sha)
+        if data is None:
+            status, _, data = await self.request('GET', f'/repository/blobs/{sha}/raw')
+            if status == 404:
+                raise GitLabError(404, f'blob {sha} not found')
+            self.cache.put(sha, data)
+        return data
+
+    async def file_lines(self, ref, file_path):
+        sha = await self.blob_id(ref, file_path)
+        if sha is None:
+            return None, []
+        return sha, (await self.blob(sha)).decode('utf-8', errors='replace').splitlines()
+
+    async def tree(self, ref, path=''):
+        files = {}
+        page = '1'
+        while page:
+            status, headers, body = await self.request('GET', '/repository/tree', params={
+                'ref': ref, 'path': path, 'recursive': 'true', 'per_page': 100, 'page': page,
+            })
+            if status == 404:
+                return {}
+            for entry in json.loads(body):
+                if entry.get('type') == 'blob':
+                    files[entry['path']] = entry['id']
+            page = headers.get('X-Next-Page')
+        return files
+
+    async def tree_pair(self, ref1, ref2, path=''):
+        return tuple(await asyncio.gather(self.tree(ref1, path), self.tree(ref2, path)))
+
+    async def file_pair(self, ref1, ref2, file_path):
+        return tuple(await asyncio.gather(self.file_lines(ref1, file_path), self.file_lines(ref2, file_path)))
@@ -0,0 +1,47 @@
+"""
+gunicorn settings for server.py:
+
+    flask --app server init
+    gunicorn -c gunicorn.conf.py
+
+Sizing. The routes mostly wait on MongoDB and GitLab, so run a few processes
+with threads (gthread) rather than many single-threaded processes:
+
+  - workers: one or two per CPU core (GUNICORN_WORKERS, default the core count)
+  - threads: concurrent requests per worker (GUNICORN_THREADS, default 8);
+    raise it for I/O-heavy loads such as /api/diff against a slow GitLab
+
+Every worker opens its own Mongo pools on its first request, one per distinct
+MONGO_URI used by the registered backends. A worker holds at most `threads`
+connections in use per pool (plus monitor sockets), so across the server
+
+    connections ~ workers x pools x min(threads, MONGO_MAX_POOL_SIZE)
+
+which has to stay below the mongod connection limit. Keep
+MONGO_MAX_POOL_SIZE >= threads so requests never wait for a connection.
+bench_startup.py measures startup time and the connections per worker.
+
+Each worker keeps its own /metrics totals; set METRICS_DIR to a directory
+the workers share so a scrape returns the sum over all of them (see
+instrumentation.py).
+
+preload_app imports the app once in the master before forking; that is safe
+because importing the backends does no I/O and mongo_clients.py drops any
+client in a forked child.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'server:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = True
+
+timeout = 60                # /api/diff/tree on a large tree is the slowest route
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so one leaking worker cannot grow forever
+max_requests = 10000
+max_requests_jitter = 1000
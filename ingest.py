@@ -0,0 +1,287 @@
+"""
+Bulk-load a hierarchical CSV export into the nfs or markets collection.
+
+Rows are read with csv_json (same header hierarchy as csv-json.py), grouped
+into batches and written with one unordered bulk_write of
+ReplaceOne(upsert=True) per batch, keyed on the target's natural key. A pool of
+writer threads keeps several batches in flight while the next ones are parsed.
+
+For markets, each batch also reads the `results` it is about to replace and
+applies the summed difference to the slice_totals rollup, so /api/slices is
+current without a rebuild (--rollup rebuild recomputes it once at the end
+instead, which is cheaper for a first load). Rows with the same key in the
+same batch are reduced to the last one, but one key in two batches written
+at the same time would have its old results counted twice, so an
+incremental markets load uses a single writer by default; with more
+--writers it rebuilds the rollup at the end.
+
+Progress is checkpointed as the number of data rows whose batches have all
+been written; rerunning the same command after an interruption skips them.
+Replaying a batch is harmless: the upserts are idempotent, and its rollup
+delta is journaled before the write (SliceRollup.begin_batch) under an id
+made of the input file and the batch's first row, so a replay applies the
+original delta once even if the crash came after the markets were written.
+Journaled batches that a rerun does not replay (e.g. with another
+--batch-size) make it rebuild the rollup at the end.
+
+    python ingest.py markets export.csv --uri mongodb://localhost:27017 --db slices
+    python ingest.py nfs nfs.csv --batch-size 5000 --writers 8
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReplaceOne
+
+from csv_json import ENCODING, HEADER_ROWS, NAME_KEY, read_header
+from mongo_indexes import ensure_indexes
+from nf_sync import HASH_FIELD, content_hash
+from response_cache import bump_version
+from slice_rollup import SliceRollup, add_delta, results_delta
+
+# Target collection -> natural key, field that receives the CSV's Name column, default database
+TARGETS = {
+    'markets': {'key': ('marketId', 'nf', 'marketName'), 'name_field': 'marketName', 'db': os.getenv('DB_NAME', 'slices')},
+    'nfs': {'key': ('vastId',), 'name_field': 'vastId', 'db': 'metricsdb'},
+}
+BATCH_SIZE = 1000
+WRITERS = 4   # 1 for markets with the incremental rollup (see above)
+REPORT_EVERY = 5.0
+
+
+class Checkpoint:
+    """Rows of one input file already written, stored next to it as JSON."""
+
+    def __init__(self, path, source, target):
+        self.path = path
+        stat = os.stat(source)
+        self.identity = {'source': os.path.abspath(source), 'size': stat.st_size,
+                         'mtime': stat.st_mtime, 'target': target}
+
+    def load(self):
+        """Return the rows already written, or 0 if there is no checkpoint for this exact file."""
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        return saved.get('rows', 0) if saved.get('identity') == self.identity else 0
+
+    def save(self, rows):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'identity': self.identity, 'rows': rows}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _Progress:
+    """Tracks finished batches and advances the checkpoint over contiguous ones."""
+
+    def __init__(self, start_rows, checkpoint):
+        self.rows = start_rows
+        self.checkpoint = checkpoint
+        self.stats = {'rows': 0, 'upserted': 0, 'modified': 0, 'matched': 0}
+        self._done = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def finished(self, index, rows, result):
+        with self._lock:
+            self.stats['rows'] += rows
+            self.stats['upserted'] += result.upserted_count
+            self.stats['modified'] += result.modified_count
+            self.stats['matched'] += result.matched_count
+            self._done[index] = rows
+            advanced = False
+            while self._next in self._done:
+                self.rows += self._done.pop(self._next)
+                self._next += 1
+                advanced = True
+            if advanced and self.checkpoint is not None:
+                self.checkpoint.save(self.rows)
+
+
+def to_document(record, name_field):
+    doc = dict(record)
+    name = doc.pop(NAME_KEY, None)
+    if name_field and name_field not in doc:
+        doc[name_field] = name
+    return doc
+
+
+def _dedupe(docs, key):
+    # Last row wins, as if the rows had been written one by one
+    latest = {}
+    for doc in docs:
+        latest[tuple(doc.get(k) for k in key)] = doc
+    return list(latest.values())
+
+
+def write_batch(collection, docs, key, rollup=None, batch_id=None):
+    """
+    Upsert one batch of documents by `key`; with `rollup`, fold their results
+    changes into it, exactly once per `batch_id`.
+    """
+    docs = _dedupe(docs, key)
+    if rollup is not None:
+        filters = [{k: doc.get(k) for k in key} for doc in docs]
+        old = {
+            tuple(d.get(k) for k in key): d.get('results')
+            for d in collection.find({'$or': filters}, {'_id': 0, 'results': 1, **{k: 1 for k in key}})
+        }
+        delta = {}
+        for doc in docs:
+            add_delta(delta, results_delta(old.get(tuple(doc.get(k) for k in key)), doc.get('results')))
+        delta = {name: d for name, d in delta.items() if any(d)}
+        batch_id = batch_id or uuid.uuid4().hex
+        delta = rollup.begin_batch(batch_id, delta)
+    result = collection.bulk_write(
+        [ReplaceOne({k: doc.get(k) for k in key}, doc, upsert=True) for doc in docs], ordered=False
+    )
+    if rollup is None:
+        bump_version(collection)
+    else:
+        rollup.markets_changed(delta, batch_id)
+    return result
+
+
+def run_id(path, target):
+    """Prefix of the batch ids of one input file: stable across reruns while the file is unchanged."""
+    stat = os.stat(path)
+    identity = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime, target])
+    return hashlib.sha1(identity.encode()).hexdigest()[:16]
+
+
+def _batches(rows, template, name_field, batch_size, skip):
+    batch = []
+    for row in rows:
+        if not row:
+            continue
+        if skip:
+            skip -= 1
+            continue
+        batch.append(to_document(template.record(row), name_field))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(collection, path, target='markets', key=None, name_field=None, batch_size=BATCH_SIZE,
+           writers=None, checkpoint=None, rollup='incremental', header_rows=HEADER_ROWS, report=None):
+    """
+    Load the CSV at `path` into `collection`. Returns the stats dict
+    (rows, upserted, modified, matched, skipped, seconds, rows_per_second).
+    """
+    config = TARGETS[target]
+    key = tuple(key or config['key'])
+    name_field = config['name_field'] if name_field is None else name_field
+    slice_rollup = SliceRollup(collection) if target == 'markets' and rollup != 'off' else None
+    incremental = slice_rollup if rollup == 'incremental' else None
+    if writers is None:
+        writers = 1 if incremental is not None else WRITERS
+
+    ensure_indexes(collection)
+    skip = checkpoint.load() if checkpoint is not None else 0
+    progress = _Progress(skip, checkpoint)
+    started = last_report = time.perf_counter()
+    in_flight = threading.BoundedSemaphore(writers * 2)
+
+    run = run_id(path, target)
+
+    def write(index, docs):
+        try:
+            if target == 'nfs':
+                for doc in docs:
+                    doc[HASH_FIELD] = content_hash(doc)
+            batch_id = f'{run}:{skip + index * batch_size}'
+            progress.finished(index, len(docs), write_batch(collection, docs, key, incremental, batch_id))
+        finally:
+            in_flight.release()
+
+    with open(path, newline='', encoding=ENCODING) as f:
+        rows = csv.reader(f)
+        template = read_header(rows, header_rows)
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            futures = []
+            for index, docs in enumerate(_batches(rows, template, name_field, batch_size, skip)):
+                in_flight.acquire()
+                futures.append(pool.submit(write, index, docs))
+                now = time.perf_counter()
+                if report and now - last_report >= REPORT_EVERY:
+                    report(progress.stats['rows'], now - started)
+                    last_report = now
+                for fut in [fut for fut in futures if fut.done()]:
+                    fut.result()  # Stop at the first failed batch
+                futures = [fut for fut in futures if not fut.done()]
+            for fut in futures:
+                fut.result()
+
+    leftovers = {'_id': {'$regex': f'^{run}:'}}
+    if slice_rollup is not None and (rollup == 'rebuild' or (incremental is not None and writers > 1)
+                                     or slice_rollup.pending.count_documents(leftovers, limit=1)):
+        # Concurrent batches may have counted a repeated key twice, and leftover
+        # journal entries belong to batches of an earlier run that were not replayed
+        slice_rollup.rebuild(settled=leftovers)
+    if checkpoint is not None:
+        checkpoint.clear()
+    seconds = time.perf_counter() - started
+    stats = dict(progress.stats, skipped=skip, seconds=seconds)
+    stats['rows_per_second'] = stats['rows'] / seconds if seconds else 0.0
+    return stats
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Bulk-load a hierarchical CSV into nfs or markets.')
+    parser.add_argument('target', choices=sorted(TARGETS))
+    parser.add_argument('input', help='CSV file with hierarchical header rows')
+    parser.add_argument('--uri', help='MongoDB URI (default: $MONGO_URI or localhost)')
+    parser.add_argument('--db', help='database (default: $DB_NAME for markets, metricsdb for nfs)')
+    parser.add_argument('--key', help='comma-separated natural key fields')
+    parser.add_argument('--name-field', help='field that receives the Name column')
+    parser.add_argument('--header-rows', type=int, default=HEADER_ROWS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--writers', type=int,
+                        help=f'parallel bulk_write threads (default {WRITERS}; 1 for an incremental markets load)')
+    parser.add_argument('--rollup', choices=('incremental', 'rebuild', 'off'), default='incremental',
+                        help='how to maintain slice totals when loading markets')
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <input>.ingest-checkpoint)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    client = MongoClient(args.uri or os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+    collection = client[args.db or TARGETS[args.target]['db']][args.target]
+    checkpoint = Checkpoint(args.checkpoint or args.input + '.ingest-checkpoint', args.input, args.target)
+    if args.restart:
+        checkpoint.clear()
+
+    def report(rows, seconds):
+        print(f'{rows} rows in {seconds:.1f} s ({rows / seconds:,.0f} rows/s)', file=sys.stderr)
+
+    stats = ingest(collection, args.input, args.target, args.key and args.key.split(','), args.name_field,
+                   args.batch_size, args.writers, checkpoint, args.rollup, args.header_rows, report)
+    print(f"Ingested {stats['rows']} rows into {collection.full_name} in {stats['seconds']:.1f} s "
+          f"({stats['rows_per_second']:,.0f} rows/s): {stats['upserted']} inserted, "
+          f"{stats['modified']} modified, {stats['skipped']} skipped from checkpoint")
+
+
+if __name__ == '__main__':
+    main()
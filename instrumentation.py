@@ -0,0 +1,579 @@
+"""
+Per-route latency, MongoDB and GitLab instrumentation, served in the
+Prometheus text format at /metrics.
+
+server.create_app() registers this module as the `metrics` blueprint; its
+hooks apply to every route of the app. Each process records
+
+    app_request_duration_seconds{route,method,status}        histogram, until the
+                                                              last byte of streamed responses
+    app_response_size_bytes{route,method}                     histogram
+    app_request_mongo_commands{route}                         histogram, commands per request
+    app_request_mongo_seconds{route}                          histogram, Mongo time per request
+    app_request_gitlab_seconds{route}                         histogram, GitLab time per request
+    app_mongo_command_duration_seconds{command,collection}    histogram (pymongo CommandListener)
+    app_mongo_command_failures_total{command,collection}
+    app_gitlab_request_duration_seconds{method,endpoint,status}
+    app_mongo_repeated_queries_total{route,command,collection}
+
+`route` is the URL rule (/api/nfs/<nf_id>), not the requested path.
+
+N+1 queries: a request that sends the same query shape (command, collection
+and filter/pipeline with the values left out) N_PLUS_ONE_THRESHOLD (2) or
+more times is counted in app_mongo_repeated_queries_total, and the first one
+per route and shape is logged as a warning. Cloning a form from BlankTemplate
+on POST /api/form, for example, looks a version up by (form_name,
+version_name) twice.
+
+With several worker processes (gunicorn) set METRICS_DIR to a directory the
+workers share: each writes its totals there every METRICS_FLUSH_SECONDS (5)
+and /metrics serves the sum over all of them. Without it /metrics reports
+only the worker that answers the scrape. A scrape folds the files of workers
+that have exited (recycled by max_requests) into metrics-base.json, so the
+directory holds one file per live worker plus that one. Workers are told
+apart by pid, so the directory must not be shared across hosts.
+
+Profiling needs PROFILE_DIR. A request sent with the header `X-Profile: 1` is
+sampled (sampling_profiler.py) and its stacks are saved in PROFILE_DIR under
+the name returned in the X-Profile-File response header. With PROFILE_SLOW_MS
+set every request is sampled and those slower than that are saved. The
+files are folded stacks for flamegraph.pl or speedscope.
+"""
+import contextvars
+import glob
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows: files of exited workers are kept, not merged
+    fcntl = None
+
+from flask import Blueprint, Response, request
+from pymongo import monitoring
+
+import gitlab_client
+from sampling_profiler import SamplingProfiler, write_folded
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '2'))
+METRICS_DIR = os.environ.get('METRICS_DIR')
+FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_SLOW_MS = float(os.environ['PROFILE_SLOW_MS']) if os.environ.get('PROFILE_SLOW_MS') else None
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def lines(self, values):
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+
+class Histogram(Counter):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels, buckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with self.lock:
+            # One count per bucket (not cumulative) plus +Inf, then the sum
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            data[bisect_left(self.buckets, value)] += 1
+            data[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {labels: list(data) for labels, data in self.values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def lines(self, values):
+        names = self.labels + ('le',)
+        for labels, data in sorted(values.items()):
+            cumulative = 0
+            for le, count in zip([*self.buckets, '+Inf'], data[:-1]):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(names, labels + (le,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {data[-1]}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {cumulative}'
+
+
+REQUEST_SECONDS = Histogram('app_request_duration_seconds', 'Request latency by route.',
+                            ('route', 'method', 'status'), LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram('app_response_size_bytes', 'Response body size by route.',
+                           ('route', 'method'), SIZE_BUCKETS)
+REQUEST_MONGO_COMMANDS = Histogram('app_request_mongo_commands', 'MongoDB commands sent per request.',
+                                   ('route',), COUNT_BUCKETS)
+REQUEST_MONGO_SECONDS = Histogram('app_request_mongo_seconds', 'Time spent in MongoDB commands per request.',
+                                  ('route',), LATENCY_BUCKETS)
+REQUEST_GITLAB_SECONDS = Histogram('app_request_gitlab_seconds', 'Time spent in GitLab API calls per request.',
+                                   ('route',), LATENCY_BUCKETS)
+MONGO_SECONDS = Histogram('app_mongo_command_duration_seconds', 'MongoDB command latency.',
+                          ('command', 'collection'), LATENCY_BUCKETS)
+MONGO_FAILURES = Counter('app_mongo_command_failures_total', 'MongoDB commands that failed.',
+                         ('command', 'collection'))
+GITLAB_SECONDS = Histogram('app_gitlab_request_duration_seconds', 'GitLab API request latency.',
+                           ('method', 'endpoint', 'status'), LATENCY_BUCKETS)
+REPEATED_QUERIES = Counter('app_mongo_repeated_queries_total',
+                           'Requests that sent the same query shape N_PLUS_ONE_THRESHOLD or more times.',
+                           ('route', 'command', 'collection'))
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def merge_snapshots(snapshots):
+    """The sum of `snapshots`, per metric and label set."""
+    total = {}
+    for metric in REGISTRY:
+        values = total[metric.name] = {}
+        for snap in snapshots:
+            for labels, value in snap.get(metric.name, {}).items():
+                values[labels] = metric.merge(values.get(labels), value)
+    return total
+
+
+def render(snapshots):
+    """The Prometheus text exposition of the sum of `snapshots`."""
+    total = merge_snapshots(snapshots)
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.lines(total[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+# Per-request totals
+
+_current = contextvars.ContextVar('instrumentation_request', default=None)
+
+
+class RequestStats:
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.gitlab_seconds = 0.0
+        self.shapes = {}
+        self.profile = None
+        self.profile_file = None
+        self.streaming = False
+        self.finished = False
+        # Commands and GitLab calls may come from worker threads of the request
+        self.lock = threading.Lock()
+
+    def add_mongo(self, command, collection, shape, seconds):
+        with self.lock:
+            self.mongo_commands += 1
+            self.mongo_seconds += seconds
+            if shape is not None:
+                key = (command, collection, shape)
+                self.shapes[key] = self.shapes.get(key, 0) + 1
+
+    def add_gitlab(self, seconds):
+        with self.lock:
+            self.gitlab_seconds += seconds
+
+
+# MongoDB
+
+SKIPPED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'buildInfo', 'saslStart', 'saslContinue', 'endSessions'}
+# Continuing a cursor is not a new query
+CURSOR_COMMANDS = {'getMore', 'killCursors'}
+# The parts of a command that make up its query shape
+SHAPE_FIELDS = ('filter', 'query', 'pipeline', 'key', 'sort', 'projection', 'skip', 'limit', 'updates', 'deletes')
+
+
+def _shape(value):
+    if isinstance(value, dict):
+        return '{' + ','.join(f'{k}:{_shape(v)}' for k, v in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(sorted({_shape(v) for v in value})) + ']'
+    return '?'
+
+
+def query_shape(command):
+    """A command's query with every value replaced by `?`."""
+    return _shape({k: command[k] for k in SHAPE_FIELDS if k in command})
+
+
+def command_collection(command_name, command):
+    target = command.get(command_name)
+    if isinstance(target, str):
+        return target
+    return command.get('collection', '') if command_name == 'getMore' else ''
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name in SKIPPED_COMMANDS:
+            return
+        stats = _current.get()
+        name = event.command_name
+        shape = None
+        if stats is not None and name not in CURSOR_COMMANDS:
+            shape = query_shape(event.command)
+        self._pending[(event.connection_id, event.request_id)] = (
+            name, command_collection(name, event.command), shape, stats)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed):
+        entry = self._pending.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        name, collection, shape, stats = entry
+        seconds = event.duration_micros / 1e6
+        MONGO_SECONDS.observe((name, collection), seconds)
+        if failed:
+            MONGO_FAILURES.inc((name, collection))
+        if stats is not None:
+            stats.add_mongo(name, collection, shape, seconds)
+
+
+def observe_gitlab(method, endpoint, status, seconds):
+    """gitlab_client request hook."""
+    GITLAB_SECONDS.observe((method, endpoint, str(status) if status is not None else 'error'), seconds)
+    stats = _current.get()
+    if stats is not None:
+        stats.add_gitlab(seconds)
+
+
+# Flask hooks
+
+bp = Blueprint('metrics', __name__)
+profiler = SamplingProfiler()
+_installed = False
+_install_lock = threading.Lock()
+_warned = set()
+_profile_ids = itertools.count(1)
+
+
+@bp.record_once
+def install(state):
+    # Once per process, however many apps register the blueprint
+    global _installed
+    with _install_lock:
+        if not _installed:
+            _installed = True
+            monitoring.register(MongoCommandListener())
+            gitlab_client.request_hooks.append(observe_gitlab)
+
+
+@bp.before_app_request
+def start_request():
+    if request.endpoint == 'metrics.metrics':
+        return
+    _start_flusher()
+    rule = request.url_rule
+    stats = RequestStats(rule.rule if rule is not None else 'unmatched', request.method)
+    if PROFILE_DIR:
+        if request.headers.get('X-Profile') == '1':
+            stats.profile_file = _profile_name(stats.route)
+        if stats.profile_file or PROFILE_SLOW_MS is not None:
+            stats.profile = profiler.start()
+    _current.set(stats)
+
+
+@bp.after_app_request
+def end_request(response):
+    stats = _current.get()
+    if stats is None or stats.finished:
+        return response
+    if stats.profile_file:
+        response.headers['X-Profile-File'] = stats.profile_file
+    if response.is_streamed:
+        # Finished when the last chunk is sent
+        stats.streaming = True
+        response.response = _counted(response.response, stats, response.status_code)
+    else:
+        finish(stats, response.status_code, response.calculate_content_length() or 0)
+    return response
+
+
+@bp.teardown_app_request
+def abandon_request(exc):
+    stats = _current.get()
+    if stats is not None and not stats.finished and not stats.streaming:
+        finish(stats, 500, 0)
+
+
+def _counted(chunks, stats, status):
+    size = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            size += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        finish(stats, status, size)
+
+
+def finish(stats, status, size):
+    if stats.finished:
+        return
+    stats.finished = True
+    if _current.get() is stats:
+        _current.set(None)
+    seconds = time.perf_counter() - stats.started
+    route = stats.route
+    REQUEST_SECONDS.observe((route, stats.method, str(status)), seconds)
+    RESPONSE_BYTES.observe((route, stats.method), size)
+    REQUEST_MONGO_COMMANDS.observe((route,), stats.mongo_commands)
+    REQUEST_MONGO_SECONDS.observe((route,), stats.mongo_seconds)
+    REQUEST_GITLAB_SECONDS.observe((route,), stats.gitlab_seconds)
+
+    for (command, collection, shape), count in stats.shapes.items():
+        if count < N_PLUS_ONE_THRESHOLD:
+            continue
+        REPEATED_QUERIES.inc((route, command, collection))
+        key = (route, command, collection, shape)
+        if key not in _warned:
+            _warned.add(key)
+            logger.warning('%s %s sent the same %s on %s %d times: %s',
+                           stats.method, route, command, collection, count, shape)
+
+    if stats.profile is not None:
+        stacks = profiler.stop(stats.profile)
+        name = stats.profile_file
+        if name is None and seconds * 1000 >= PROFILE_SLOW_MS:
+            name = _profile_name(route, seconds)
+        if name is not None:
+            try:
+                write_folded(os.path.join(PROFILE_DIR, name), stacks)
+            except OSError:
+                logger.exception('could not write profile %s', name)
+
+
+def _profile_name(route, seconds=None):
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+    took = f'-{seconds * 1000:.0f}ms' if seconds is not None else ''
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_ids)}-{slug}{took}.folded"
+
+
+@bp.route('/metrics')
+def metrics():
+    snapshots = [snapshot()]
+    if METRICS_DIR:
+        flush()
+        snapshots = load_snapshots()
+    return Response(render(snapshots), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Totals shared by worker processes through METRICS_DIR
+
+BASE_FILE = 'metrics-base.json'    # Totals of the workers that have exited
+LOCK_FILE = '.metrics.lock'
+WORKER_FILE = re.compile(r'metrics-(\d+)-\d+\.json$')
+
+_snapshot_file = None
+_flusher_started = False
+
+
+def _start_flusher():
+    global _flusher_started
+    if not METRICS_DIR or _flusher_started:
+        return
+    with _install_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+    threading.Thread(target=_flush_loop, daemon=True, name='metrics-flush').start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        try:
+            flush()
+        except OSError:
+            logger.exception('could not write metrics to %s', METRICS_DIR)
+
+
+def _encode(snap):
+    return {name: [[list(labels), value] for labels, value in values.items()] for name, values in snap.items()}
+
+
+def _decode(data):
+    return {name: {tuple(labels): value for labels, value in values} for name, values in data.items()}
+
+
+def _write_json(path, data):
+    # A unique temp name per writer: the flush thread and a scrape may write at once
+    fd, tmp = tempfile.mkstemp(dir=METRICS_DIR, prefix='.metrics-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush():
+    """Write this process's totals to METRICS_DIR."""
+    global _snapshot_file
+    if _snapshot_file is None:
+        # Never reused by a later process, so the sum never goes backwards
+        _snapshot_file = os.path.join(METRICS_DIR, f'metrics-{os.getpid()}-{time.time_ns()}.json')
+    _write_json(_snapshot_file, _encode(snapshot()))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_base():
+    base = _read_json(os.path.join(METRICS_DIR, BASE_FILE))
+    return base if base is not None else {'metrics': {}, 'merged': []}
+
+
+def merge_dead_workers():
+    """
+    Fold the files of exited workers into BASE_FILE and remove them. Returns
+    the number of files merged. The caller holds the LOCK_FILE lock.
+
+    BASE_FILE lists the files it already holds, so if the process dies before
+    removing them they are neither counted twice nor merged again.
+    """
+    base = _load_base()
+    # Left by a merge that died before removing them
+    merged = [name for name in base['merged'] if os.path.exists(os.path.join(METRICS_DIR, name))]
+    dead = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        name = os.path.basename(path)
+        match = WORKER_FILE.match(name)
+        if match is None or name in merged or _alive(int(match.group(1))):
+            continue
+        data = _read_json(path)
+        if data is not None:
+            dead[name] = _decode(data)
+    if dead:
+        total = merge_snapshots([_decode(base['metrics']), *dead.values()])
+        merged += dead
+        _write_json(os.path.join(METRICS_DIR, BASE_FILE), {'metrics': _encode(total), 'merged': merged})
+    for name in merged:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except FileNotFoundError:
+            pass
+    return len(dead)
+
+
+def _read_snapshots():
+    base = _load_base()
+    snapshots = [_decode(base['metrics'])]
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        name = os.path.basename(path)
+        if name == BASE_FILE or name in base['merged']:
+            continue
+        data = _read_json(path)
+        if data is not None:
+            snapshots.append(_decode(data))
+    return snapshots
+
+
+def load_snapshots():
+    """The totals of the exited workers and one snapshot per live worker."""
+    if fcntl is None:
+        return _read_snapshots()
+    with open(os.path.join(METRICS_DIR, LOCK_FILE), 'a') as lock:
+        # One scrape merges and reads at a time; closing the file releases the lock
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merge_dead_workers()
+        return _read_snapshots()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero and writes its own METRICS_DIR file
+    global _snapshot_file, _flusher_started, _install_lock
+    for metric in REGISTRY:
+        metric.values = {}
+        metric.lock = threading.Lock()
+    _warned.clear()
+    _snapshot_file = None
+    _flusher_started = False
+    _install_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,83 @@
+"""
+Helpers for writing JSON arrays straight from a Mongo cursor.
+
+Responses built with these helpers are sent in chunks as documents arrive
+instead of being collected into one list and serialized with jsonify.
+
+dumps() encodes ObjectId (as its hex string) and datetime values directly, so
+documents can be written as they come off the cursor without converting their
+_id first. It uses orjson when it is installed and the json module otherwise.
+aiter_json_array() streams from async iterables (Motor cursors, async_app.py).
+"""
+import json
+from datetime import date, datetime
+
+from bson import ObjectId
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(doc):
+        return orjson.dumps(doc, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+else:
+    def dumps(doc):
+        return json.dumps(doc, default=_default, separators=(',', ':'))
+
+
+def iter_json_array(docs, dumps=dumps, batch_size=200):
+    """Yield a JSON array as text chunks of up to `batch_size` elements."""
+    yield '['
+    first = True
+    batch = []
+    for doc in docs:
+        batch.append(dumps(doc))
+        if len(batch) >= batch_size:
+            yield ('' if first else ',') + ','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
+
+
+async def aiter_json_array(docs, dumps=dumps, batch_size=200):
+    """iter_json_array for an async iterable such as a Motor cursor."""
+    yield '['
+    first = True
+    batch = []
+    async for doc in docs:
+        batch.append(dumps(doc))
+        if len(batch) >= batch_size:
+            yield ('' if first else ',') + ','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
+
+
+def stream_json_array(docs, headers=None, **kwargs):
+    """Return a streamed application/json response for an iterable of documents."""
+    return Response(
+        stream_with_context(iter_json_array(docs, **kwargs)),
+        mimetype='application/json',
+        headers=headers,
+    )
+
+
+def json_response(doc, status=200, headers=None):
+    """Return a single document as an application/json response encoded with dumps()."""
+    return Response(dumps(doc), status=status, mimetype='application/json', headers=headers)
@@ -0,0 +1,78 @@
+"""
+Keyset-paged listings shared by the sync apps and async_app.py: /api/markets
+(slice.py) and /api/nfs (dash_backend.py; its fields are in nf_sync.py).
+
+A page is `limit` documents in index order after the client's `after` cursor.
+page_edge() reads the last document of the page and the one after it from the
+index alone, so the sync apps can send the next cursor in the X-Next-After
+header before the body starts streaming, and async_app.py can fetch it
+concurrently with the page.
+"""
+from bson import ObjectId
+from pymongo import ASCENDING
+
+MAX_PAGE_SIZE = 1000
+
+# Response field -> market document field for /api/markets.
+MARKET_FIELDS = {
+    'id': 'marketId',
+    'name': 'marketName',
+    'vendor': 'vendor',
+    'nf': 'nf',
+    'type': 'nfType',
+    'results': 'results',
+}
+MARKET_FILTERS = ('vendor', 'nf', 'nfType')
+MARKET_SORT = [('marketId', ASCENDING), ('_id', ASCENDING)]
+MARKET_DEFAULTS = {'vendor': None, 'nf': None, 'type': None, 'results': {}}
+
+
+def filters(args, names):
+    """Exact-match filters for the request arguments in `names` that are set."""
+    return {f: args[f] for f in names if args.get(f)}
+
+
+def page_limit(args):
+    """The `limit` argument clamped to 1..MAX_PAGE_SIZE, or None without one (ValueError if not a number)."""
+    if not args.get('limit'):
+        return None
+    return max(1, min(int(args['limit']), MAX_PAGE_SIZE))
+
+
+def page_edge(collection, query, sort, limit):
+    """Cursor over the last document of a page and the one after it, for a pymongo or Motor collection."""
+    return collection.find(query, {f: 1 for f, _ in sort}).sort(sort).skip(limit - 1).limit(2)
+
+
+def next_after(edge, cursor_of):
+    """The X-Next-After value for the documents read from page_edge(), or None on the last page."""
+    return cursor_of(edge[0]) if len(edge) == 2 else None
+
+
+def parse_after(value):
+    """Parse an `after` cursor of the form `<marketId>` or `<marketId>:<_id>`."""
+    market_id, _, oid = value.partition(':')
+    market_id = int(market_id)
+    if not oid:
+        return {'marketId': {'$gt': market_id}}
+    oid = ObjectId(oid)
+    return {'$or': [
+        {'marketId': {'$gt': market_id}},
+        {'marketId': market_id, '_id': {'$gt': oid}},
+    ]}
+
+
+def market_fields(value):
+    """The response fields for a comma-separated `fields` argument (`id` always included) and their projection."""
+    fields = list(MARKET_FIELDS)
+    if value:
+        fields = ['id'] + [f for f in value.split(',') if f in MARKET_FIELDS and f != 'id']
+    return fields, {MARKET_FIELDS[f]: 1 for f in fields}
+
+
+def market_row(market, fields):
+    return {f: market.get(MARKET_FIELDS[f], MARKET_DEFAULTS.get(f)) for f in fields}
+
+
+def market_cursor(market):
+    return f"{market['marketId']}:{market['_id']}"
@@ -31,7 +31,6 @@ export default function MarketDetail() {
         { gnbDuid: '' }
       ));
     });
-    axios.get(`http://127.0.0.1:5000/api/markets/${id}/${nf}/${name}`).then(res => setMarket(res.data));
 
     const handleClickOutside = e => {
       Object.entries(dropdownRefs.current).forEach(([key, el]) => {
@@ -47,57 +46,42 @@ export default function MarketDetail() {
     setCurrentPage(1);
   };
 
-  const filteredNodes = useMemo(() => {
-  if (!market) return [];
-  return market.nodes.filter(n => {
-    const matchGnb = (n.gnbDuid || '')
-      .toString()
-      .toLowerCase()
-      .includes(filters.gnbDuid.toLowerCase());
-    const matchSlices = slices.length === 0 || slices.every(s => {
-      const fv = (filters[`${s.name}_status`] || '').toLowerCase();
-      const status = (n.Results?.[s.name]?.status || '').toLowerCase();
-      return status.includes(fv);
+  // Filtering, sorting and paging happen on the server; only the current page is loaded.
+  const nodeParams = useMemo(() => {
+    const params = new URLSearchParams();
+    if (filters.gnbDuid) params.append('name', filters.gnbDuid);
+    slices.forEach(s => {
+      const fv = filters[`${s.name}_status`];
+      if (fv) params.append('status', `${s.name}:${fv}`);
     });
-    return matchGnb && matchSlices;
-  });
-}, [market, filters, slices]);
+    if (sortConfig.key) {
+      const [prefix] = sortConfig.key.split('_');
+      params.append('sort', prefix === 'GnbDuid' ? 'gnbDuid' : prefix);
+      params.append('order', sortConfig.direction);
+    }
+    return params;
+  }, [filters, slices, sortConfig]);
 
-const sortedNodes = useMemo(() => {
-  const arr = [...filteredNodes];
-  if (sortConfig.key) {
-    const [prefix] = sortConfig.key.split('_');
-    arr.sort((a, b) => {
-      let va, vb;
-      if (prefix === 'GnbDuid') {
-        va = a.gnbDuid || '';
-        vb = b.gnbDuid || '';
-      } else {
-        va = a.Results?.[prefix]?.timestamp
-          ? new Date(a.Results[prefix].timestamp).getTime()
-          : 0;
-        vb = b.Results?.[prefix]?.timestamp
-          ? new Date(b.Results[prefix].timestamp).getTime()
-          : 0;
-      }
-      if (va < vb) return sortConfig.direction === 'asc' ? -1 : 1;
-      if (va > vb) return sortConfig.direction === 'asc' ? 1 : -1;
-      return 0;
-    });
-  }
-  return arr;
-}, [filteredNodes, sortConfig]);
+  const detailUrl = `http://127.0.0.1:5000/api/markets/${id}/${nf}/${name}`;
 
-const currentTableData = useMemo(() => {
-  const start = (currentPage - 1) * itemsPerPage;
-  return sortedNodes.slice(start, start + itemsPerPage);
-}, [currentPage, itemsPerPage, sortedNodes]);
+  useEffect(() => {
+    const params = new URLSearchParams(nodeParams);
+    params.append('offset', (currentPage - 1) * itemsPerPage);
+    params.append('limit', itemsPerPage);
+    let cancelled = false;
+    axios.get(`${detailUrl}?${params}`).then(res => { if (!cancelled) setMarket(res.data); });
+    return () => { cancelled = true; };
+  }, [detailUrl, nodeParams, currentPage, itemsPerPage]);
 
-  const totalPages = Math.ceil(sortedNodes.length / itemsPerPage);
+  const currentTableData = market ? market.nodes : [];
+  const totalNodes = market ? market.total : 0;
+  const totalPages = Math.ceil(totalNodes / itemsPerPage);
 
-  const exportCSV = () => {
+  const exportCSV = async () => {
+    // Export every node matching the current filters, not just the loaded page.
+    const res = await axios.get(`${detailUrl}?${nodeParams}`);
     const headers = ['GnbDuid', ...slices.flatMap(s => [`Status ${s.name}`, `Timestamp ${s.name}`])];
-    const rows = sortedNodes.map(n => [
+    const rows = res.data.nodes.map(n => [
       n.gnbDuid || 'NA',
       ...slices.flatMap(s => {
         const r = n.Results?.[s.name] || {};
@@ -240,6 +224,11 @@ const currentTableData = useMemo(() => {
                   }}
                 >
                   {s.name}
+                  {market.statusCounts?.[s.name] && (
+                    <div style={{ fontSize: '0.75em', fontWeight: 'normal', color: '#555' }}>
+                      {Object.entries(market.statusCounts[s.name]).map(([st, count]) => `${st}: ${count}`).join(' · ')}
+                    </div>
+                  )}
                 </th>
               ))}
             </tr>
@@ -343,9 +332,9 @@ const currentTableData = useMemo(() => {
       {totalPages > 0 && (
         <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginTop: 20, padding: 10, flexWrap: 'wrap', gap: 10 }}>
           <span style={{ fontSize: '0.9em', color: '#555' }}>
-            Showing {Math.min(sortedNodes.length, (currentPage - 1) * itemsPerPage + 1)}
-            to {Math.min(currentPage * itemsPerPage, sortedNodes.length)}
-            of {sortedNodes.length} entries
+            Showing {Math.min(totalNodes, (currentPage - 1) * itemsPerPage + 1)}
+            to {Math.min(currentPage * itemsPerPage, totalNodes)}
+            of {totalNodes} entries
           </span>
           <div style={{ display: 'flex', gap: 8 }}>
             <button
@@ -0,0 +1,220 @@
+"""
+Paged, filtered node lists for /api/markets/<id>/<nf>/<name>.
+
+Nodes look like {gnbDuid, Results: {<slice>: {status, timestamp}}}. They are
+read either from the `nodes` array embedded in the market document or, once
+split out with `python market_nodes.py --split`, from their own collection
+(one document per node, keyed by the market's natural key plus its position
+in the original array). Both are served by a single aggregation returning the
+requested page ($slice / $skip+$limit), the number of matching nodes and the
+node counts by slice and status, so the parent document is never shipped to
+the application whole.
+
+Filters (NodeQuery):
+  - name: case-insensitive substring of gnbDuid
+  - status: case-insensitive substring of a status, as `<slice>:<value>` for
+    one slice or `<value>` for any slice; repeatable, all must match
+  - sort: `gnbDuid` or `<slice>` (its timestamp), with order asc/desc
+"""
+import argparse
+import os
+import re
+
+from pymongo import InsertOne
+
+from response_cache import bump_version
+from slice_rollup import market_key
+
+NODES_COLLECTION = 'market_nodes'
+ORDERS = {'asc': 1, 'desc': -1}
+ALL_NODES = 2 ** 31 - 1   # $slice count when no limit is given
+
+
+class NodeQuery:
+    def __init__(self, name=None, status=(), sort=None, order='asc', offset=0, limit=None):
+        if order not in ORDERS:
+            raise ValueError('order must be asc or desc')
+        if sort and sort != 'gnbDuid' and ('.' in sort or sort.startswith('$')):
+            raise ValueError('invalid sort')
+        self.name = name
+        self.status = []
+        for value in status:
+            slice_name, sep, text = value.partition(':')
+            self.status.append((slice_name, text) if sep else (None, value))
+        self.sort = sort
+        self.order = ORDERS[order]
+        self.offset = offset
+        self.limit = limit
+
+    @classmethod
+    def from_args(cls, args, max_limit):
+        """Build from request args; raises ValueError on bad input."""
+        offset = max(0, int(args.get('offset') or 0))
+        limit = max(1, min(int(args['limit']), max_limit)) if args.get('limit') else None
+        return cls(args.get('name') or None, [s for s in args.getlist('status') if s],
+                   args.get('sort') or None, args.get('order') or 'asc', offset, limit)
+
+    def condition(self, node):
+        """Aggregation expression matching a node at path `node` ('$$n' or '$'), or None."""
+        prefix = node if node == '$' else node + '.'
+        results = {'$objectToArray': {'$ifNull': [prefix + 'Results', {}]}}
+        conds = []
+        if self.name:
+            conds.append(_contains({'$toString': {'$ifNull': [prefix + 'gnbDuid', '']}}, self.name))
+        for slice_name, text in self.status:
+            matches = _contains({'$toString': {'$ifNull': ['$$r.v.status', '']}}, text)
+            if slice_name is not None:
+                matches = {'$and': [{'$eq': ['$$r.k', slice_name]}, matches]}
+            conds.append({'$gt': [{'$size': {'$filter': {'input': results, 'as': 'r', 'cond': matches}}}, 0]})
+        if not conds:
+            return None
+        return conds[0] if len(conds) == 1 else {'$and': conds}
+
+    def sort_field(self, node):
+        if self.sort is None:
+            return None
+        field = 'gnbDuid' if self.sort == 'gnbDuid' else f'Results.{self.sort}.timestamp'
+        return f'{node}.{field}' if node else field
+
+
+def _contains(expr, text):
+    return {'$regexMatch': {'input': expr, 'regex': re.escape(text), 'options': 'i'}}
+
+
+def _status_counts(results_path):
+    # [{_id: {slice, status}, count}] over the nodes in the pipeline
+    return [
+        {'$project': {'_id': 0, 'r': {'$objectToArray': {'$ifNull': [results_path, {}]}}}},
+        {'$unwind': '$r'},
+        {'$group': {'_id': {'slice': '$r.k', 'status': '$r.v.status'}, 'count': {'$sum': 1}}},
+    ]
+
+
+def _page_stages(query, node):
+    # Sort, skip and limit the nodes at `node`; None sorts by position.
+    stages = []
+    sort = query.sort_field(node)
+    if sort:
+        stages.append({'$sort': {sort: query.order}})
+    if query.offset:
+        stages.append({'$skip': query.offset})
+    if query.limit is not None:
+        stages.append({'$limit': query.limit})
+    return stages
+
+
+def embedded_pipeline(key, query):
+    """Aggregation over a market document returning [{page, total, counts}] for its `nodes` array."""
+    cond = query.condition('$$n')
+    nodes = {'$ifNull': ['$nodes', []]}
+    if cond is not None:
+        nodes = {'$filter': {'input': nodes, 'as': 'n', 'cond': cond}}
+    if query.sort is None:
+        limit = query.limit if query.limit is not None else ALL_NODES
+        page = [{'$project': {'nodes': {'$slice': ['$nodes', query.offset, limit]}}}]
+    else:
+        page = [{'$unwind': '$nodes'}] + _page_stages(query, 'nodes') + [
+            {'$group': {'_id': None, 'nodes': {'$push': '$nodes'}}},
+        ]
+    return [
+        {'$match': key},
+        {'$limit': 1},
+        {'$project': {'_id': 0, 'nodes': nodes}},
+        {'$facet': {
+            'page': page,
+            'total': [{'$project': {'n': {'$size': '$nodes'}}}],
+            'counts': [{'$unwind': '$nodes'}] + _status_counts('$nodes.Results'),
+        }},
+    ]
+
+
+def collection_pipeline(key, query):
+    """Aggregation over the nodes collection returning [{page, total, counts}] for one market."""
+    match = {f'market.{k}': v for k, v in key.items()}
+    cond = query.condition('$')
+    if cond is not None:
+        match['$expr'] = cond
+    page = _page_stages(query, None)
+    if query.sort is None:
+        page.insert(0, {'$sort': {'position': 1}})
+    page.append({'$project': {'_id': 0, 'market': 0, 'position': 0}})
+    return [
+        {'$match': match},
+        {'$facet': {
+            'page': page,
+            'total': [{'$count': 'n'}],
+            'counts': _status_counts('$Results'),
+        }},
+    ]
+
+
+def node_page(markets, key, query, nodes=None):
+    """
+    Return {nodes, total, statusCounts} for the market with natural key `key`,
+    reading from the `nodes` collection when given, else from the embedded array.
+    statusCounts is {slice: {status: count}} over all nodes matching the filters.
+    """
+    if nodes is not None:
+        result = next(nodes.aggregate(collection_pipeline(key, query)), None)
+    else:
+        result = next(markets.aggregate(embedded_pipeline(key, query)), None)
+    return parse_node_page(result, nodes is not None)
+
+
+def parse_node_page(result, from_collection):
+    """Turn the result document of embedded_pipeline/collection_pipeline into the node_page shape."""
+    result = result or {}
+    if not from_collection:
+        items = (result.get('page') or [{}])[0].get('nodes', [])
+    else:
+        items = result.get('page', [])
+    total = (result.get('total') or [{}])[0].get('n', 0)
+    counts = {}
+    for c in result.get('counts', []):
+        status = c['_id'].get('status')
+        counts.setdefault(c['_id']['slice'], {})[status if status is not None else 'NA'] = c['count']
+    return {'nodes': items, 'total': total, 'statusCounts': counts}
+
+
+def split_nodes(markets, nodes, batch_size=1000):
+    """
+    Move the embedded `nodes` array of every market into the `nodes`
+    collection, replacing what was stored there for the market, and leave
+    `nodeCount` on the market. Returns the number of markets moved.
+    """
+    moved = 0
+    for market in markets.find({'nodes': {'$exists': True}}, {'marketId': 1, 'nf': 1, 'marketName': 1, 'nodes': 1}):
+        key = market_key(market)
+        nodes.delete_many({f'market.{k}': v for k, v in key.items()})
+        ops = [
+            InsertOne({**node, 'market': key, 'position': i})
+            for i, node in enumerate(market.get('nodes') or []) if isinstance(node, dict)
+        ]
+        for start in range(0, len(ops), batch_size):
+            nodes.bulk_write(ops[start:start + batch_size], ordered=False)
+        markets.update_one({'_id': market['_id']}, {'$unset': {'nodes': ''}, '$set': {'nodeCount': len(ops)}})
+        moved += 1
+    if moved:
+        bump_version(nodes)
+        bump_version(markets)
+    return moved
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from mongo_indexes import ensure_indexes
+
+    parser = argparse.ArgumentParser(description='Move embedded market nodes into their own collection.')
+    parser.add_argument('--split', action='store_true', help='move every embedded nodes array')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.environ['MONGO_URI'])[os.environ['DB_NAME']]
+    collection = db[NODES_COLLECTION]
+    ensure_indexes(collection)
+    if args.split:
+        print(f'Moved the nodes of {split_nodes(db.markets, collection)} markets to {collection.name}.')
+    else:
+        parser.print_help()
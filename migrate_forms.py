@@ -0,0 +1,64 @@
+"""
+Convert form versions from the embedded layout to shared schemas.
+
+Each document that still embeds `sections` is split into a schema document in
+`form_schemas` (stored once per distinct layout) and a version document that
+keeps only its answers map; see form_repository for the layout. The API
+response shape does not change.
+
+    python migrate_forms.py --dry-run     # report what would change
+    python migrate_forms.py               # migrate
+    python migrate_forms.py --uri mongodb://localhost:27017/ --db form_database
+
+Documents are replaced one at a time, only while they are still in the
+embedded layout, so the tool can be stopped and rerun safely.
+"""
+import argparse
+
+import bson
+from pymongo import MongoClient
+
+from form_repository import answers_of, can_share_schema, save_schema, schema_of
+
+LEGACY = {'schema_id': {'$exists': False}, 'sections': {'$exists': True}}
+
+
+def migrate(collection, dry_run=False):
+    stats = {'migrated': 0, 'skipped': 0, 'schemas': 0, 'bytes_before': 0, 'bytes_after': 0}
+    seen = set()
+    for doc in collection.find(LEGACY):
+        if not can_share_schema(doc):
+            stats['skipped'] += 1
+            continue
+        schema = schema_of(doc)
+        new_doc = {k: v for k, v in doc.items() if k != 'sections'}
+        new_doc['schema_id'] = schema['_id']
+        new_doc['answers'] = answers_of(doc)
+        if not dry_run:
+            save_schema(collection, schema)
+            result = collection.replace_one({'_id': doc['_id'], **LEGACY}, new_doc)
+            if result.matched_count == 0:
+                continue  # Changed or migrated concurrently
+        if schema['_id'] not in seen:
+            seen.add(schema['_id'])
+            stats['schemas'] += 1
+            stats['bytes_after'] += len(bson.encode(schema))
+        stats['migrated'] += 1
+        stats['bytes_before'] += len(bson.encode(doc))
+        stats['bytes_after'] += len(bson.encode(new_doc))
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move form versions to shared schema documents.')
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='form_database')
+    parser.add_argument('--collection', default='forms')
+    parser.add_argument('--dry-run', action='store_true', help='report the effect without writing')
+    args = parser.parse_args()
+
+    collection = MongoClient(args.uri)[args.db][args.collection]
+    stats = migrate(collection, dry_run=args.dry_run)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {stats['migrated']} versions "
+          f"into {stats['schemas']} schemas ({stats['skipped']} skipped: question ids unusable as keys)")
+    print(f"Stored size: {stats['bytes_before']} -> {stats['bytes_after']} bytes")
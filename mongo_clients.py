@@ -0,0 +1,155 @@
+"""
+MongoClients created per process, on first use.
+
+A MongoClient starts monitor threads and opens pooled sockets, and neither
+survives fork(): a client built at import time in a preforking server
+(gunicorn with preload_app) is inherited half-working by every worker.
+get_client() creates the client for a URI in the process that first uses it,
+and every client is forgotten in a forked child, so each worker opens its own
+pool when its first request needs one.
+
+The backends declare their collections at module level with lazy_database()
+and lazy_collection(); these hold only names until an attribute of the real
+Collection/Database is used, so importing a backend does no I/O:
+
+    forms_collection = lazy_database('mongodb://localhost:27017/', 'form_database')['forms']
+    forms_collection.find_one(...)      # connects here, in this process
+
+Pool size and timeouts (MongoClient options) come from the environment:
+
+    MONGO_MAX_POOL_SIZE (100)           connections per client and process
+    MONGO_MIN_POOL_SIZE (0)
+    MONGO_MAX_IDLE_TIME_MS              close pooled connections idle this long
+    MONGO_CONNECT_TIMEOUT_MS (5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS (5000)
+    MONGO_SOCKET_TIMEOUT_MS             per operation; unset waits forever
+    MONGO_WAIT_QUEUE_TIMEOUT_MS         wait for a free pooled connection
+"""
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# MongoClient option -> (environment variable, default or None to leave pymongo's)
+CLIENT_OPTIONS = {
+    'maxPoolSize': ('MONGO_MAX_POOL_SIZE', 100),
+    'minPoolSize': ('MONGO_MIN_POOL_SIZE', 0),
+    'maxIdleTimeMS': ('MONGO_MAX_IDLE_TIME_MS', None),
+    'connectTimeoutMS': ('MONGO_CONNECT_TIMEOUT_MS', 5000),
+    'serverSelectionTimeoutMS': ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+    'socketTimeoutMS': ('MONGO_SOCKET_TIMEOUT_MS', None),
+    'waitQueueTimeoutMS': ('MONGO_WAIT_QUEUE_TIMEOUT_MS', None),
+}
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client_options():
+    """The MongoClient keyword arguments configured in the environment."""
+    options = {}
+    for option, (variable, default) in CLIENT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = int(value)
+        elif default is not None:
+            options[option] = default
+    return options
+
+
+def get_client(uri):
+    """This process's MongoClient for `uri`, created on first call."""
+    client = _clients.get(uri)
+    if client is None:
+        with _lock:
+            client = _clients.get(uri)
+            if client is None:
+                client = _clients[uri] = MongoClient(uri, **client_options())
+    return client
+
+
+def open_clients():
+    """{uri: client} of the clients this process has created."""
+    return dict(_clients)
+
+
+def close_clients():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def _forget_clients():
+    # In a forked child: the parent's clients are unusable here, and closing
+    # them would touch sockets the parent still owns
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_clients)
+
+
+class LazyDatabase:
+    """A Database of the per-process client for `uri`, resolved on use."""
+
+    def __init__(self, uri, name):
+        self.uri = uri
+        self.name = name
+
+    def resolve(self):
+        return get_client(self.uri)[self.name]
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if hasattr(Database, attr):
+            return getattr(self.resolve(), attr)
+        return self[attr]  # db.<collection>, as on a Database
+
+    def __repr__(self):
+        return f'LazyDatabase({self.uri!r}, {self.name!r})'
+
+
+class LazyCollection:
+    """A Collection of a LazyDatabase, resolved on use; name and full_name need no client."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+
+    def resolve(self):
+        return self.database.resolve()[self.name]
+
+    def __getitem__(self, name):
+        return LazyCollection(self.database, f'{self.name}.{name}')
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if hasattr(Collection, attr):
+            return getattr(self.resolve(), attr)
+        return self[attr]  # a sub-collection, as on a Collection
+
+    def __repr__(self):
+        return f'LazyCollection({self.database!r}, {self.name!r})'
+
+
+def lazy_database(uri, name):
+    return LazyDatabase(uri, name)
+
+
+def lazy_collection(uri, db_name, name):
+    return LazyDatabase(uri, db_name)[name]
+
+
+def resolve(obj):
+    """The real Database/Collection behind a lazy one (anything else is returned as is)."""
+    return obj.resolve() if isinstance(obj, (LazyDatabase, LazyCollection)) else obj
@@ -0,0 +1,272 @@
+"""
+Index declarations for every Mongo-backed endpoint.
+
+Each backend calls ensure_indexes(<collection>) at startup; create_indexes is
+idempotent so this is cheap once the indexes exist.
+
+Running the module directly creates the indexes for all collections, and with
+--check-plans also runs explain() on the hot query of each route and exits
+non-zero if any winning plan is a COLLSCAN:
+
+    python mongo_indexes.py --check-plans
+
+A unique index cannot be built while documents share its key (forms saved
+before form_version was unique may repeat a version name). ensure_indexes then
+raises DuplicateKeys listing them; --dedupe renames every copy but the one
+fetch_form would return to `<version_name> (duplicate <_id>)` first:
+
+    python mongo_indexes.py --dedupe
+"""
+import argparse
+import os
+import sys
+
+from pymongo import IndexModel, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+
+# Collection name -> indexes it needs.
+INDEXES = {
+    # flask_back.py / new.py: every lookup is by form_name, usually with version_name.
+    # The unique key also makes concurrent clones to the same new version fail
+    # with DuplicateKeyError instead of creating two documents.
+    'forms': [
+        IndexModel([('form_name', ASCENDING), ('version_name', ASCENDING)], unique=True, name='form_version'),
+        # form_repository.fetch_form: latest version of a form first.
+        IndexModel([('form_name', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)], name='form_latest'),
+        # form_repository.list_versions: version names in creation order, answered from the index alone.
+        IndexModel([('form_name', ASCENDING), ('_id', ASCENDING), ('version_name', ASCENDING)], name='form_versions'),
+    ],
+    # slice.py: detail lookups by natural key, plus keyset paging and filters on /api/markets.
+    'markets': [
+        IndexModel([('marketId', ASCENDING), ('nf', ASCENDING), ('marketName', ASCENDING)], name='market_key'),
+        IndexModel([('marketId', ASCENDING), ('_id', ASCENDING)], name='market_page'),
+        IndexModel([('vendor', ASCENDING), ('marketId', ASCENDING), ('_id', ASCENDING)], name='market_page_vendor'),
+        IndexModel([('nf', ASCENDING), ('marketId', ASCENDING), ('_id', ASCENDING)], name='market_page_nf'),
+        IndexModel([('nfType', ASCENDING), ('marketId', ASCENDING), ('_id', ASCENDING)], name='market_page_nftype'),
+    ],
+    # slice.py with SPLIT_MARKET_NODES: the nodes of one market, in array order or by gnbDuid.
+    'market_nodes': [
+        IndexModel([('market.marketId', ASCENDING), ('market.nf', ASCENDING), ('market.marketName', ASCENDING),
+                    ('position', ASCENDING)], name='market_nodes_position'),
+        IndexModel([('market.marketId', ASCENDING), ('market.nf', ASCENDING), ('market.marketName', ASCENDING),
+                    ('gnbDuid', ASCENDING)], name='market_nodes_gnbduid'),
+    ],
+    # table_back.py: distinct("name") for /api/servers (prefix) and the
+    # serverName filter of the /api/data aggregation.
+    'mycollection': [
+        IndexModel([('name', ASCENDING), ('section_name', ASCENDING), ('version', ASCENDING)],
+                   name='server_section_version'),
+    ],
+    # dash_backend.py: filtered keyset pages of /api/nfs and detail lookups by client id.
+    'nfs': [
+        IndexModel([('type', ASCENDING), ('_id', ASCENDING)], name='nf_page_type'),
+        IndexModel([('product', ASCENDING), ('_id', ASCENDING)], name='nf_page_product'),
+        IndexModel([('vastId', ASCENDING), ('_id', ASCENDING)], name='nf_page_vastid'),
+        IndexModel([('id', ASCENDING)], name='nf_client_id'),
+    ],
+}
+
+# Collection name -> order of the documents sharing a unique key; dedupe() keeps the first one
+KEEP_FIRST = {
+    'forms': [('updated_at', DESCENDING), ('_id', DESCENDING)],   # form_repository.LATEST_FIRST
+}
+DUPLICATE_KEY = 11000
+SHOWN_DUPLICATES = 10
+
+
+class DuplicateKeys(Exception):
+    """A unique index cannot be created because documents already share its key."""
+
+    def __init__(self, collection, index, keys, duplicates):
+        shown = ', '.join(f'{dict(zip(keys, values))} x{count}' for values, count in duplicates[:SHOWN_DUPLICATES])
+        more = f' and {len(duplicates) - SHOWN_DUPLICATES} more' if len(duplicates) > SHOWN_DUPLICATES else ''
+        super().__init__(
+            f'{collection.full_name}: cannot create unique index {index}; these keys are held by more than one '
+            f'document: {shown}{more}. Run `python mongo_indexes.py --dedupe` to rename the extra copies.'
+        )
+        self.duplicates = duplicates
+
+
+def _unique_keys(model):
+    return [name for name, _ in model.document['key'].items()]
+
+
+def find_duplicates(collection, keys):
+    """[(values, count)] of the `keys` values held by more than one document, most copies first."""
+    pipeline = [
+        {'$group': {'_id': {k: f'${k}' for k in keys}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$sort': {'count': -1}},
+    ]
+    return [(tuple(d['_id'].get(k) for k in keys), d['count'])
+            for d in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+def dedupe(collection):
+    """
+    Make the unique keys declared for `collection` unique: of the documents
+    sharing one, all but the first in KEEP_FIRST order get ` (duplicate <_id>)`
+    appended to the key's last field. Returns the number of documents renamed.
+    """
+    sort = KEEP_FIRST.get(collection.name, [('_id', DESCENDING)])
+    ops = []
+    for model in INDEXES.get(collection.name, []):
+        if not model.document.get('unique'):
+            continue
+        keys = _unique_keys(model)
+        for values, _ in find_duplicates(collection, keys):
+            copies = collection.find(dict(zip(keys, values)), {keys[-1]: 1}).sort(sort)
+            for doc in list(copies)[1:]:
+                ops.append(UpdateOne({'_id': doc['_id']},
+                                     {'$set': {keys[-1]: f"{doc.get(keys[-1])} (duplicate {doc['_id']})"}}))
+    if ops:
+        collection.bulk_write(ops)
+    return len(ops)
+
+
+def ensure_indexes(collection):
+    """
+    Create the indexes declared for `collection` (by name). Returns the index
+    names. Raises DuplicateKeys if a unique one cannot be built.
+    """
+    models = INDEXES.get(collection.name, [])
+    if not models:
+        return []
+    others = [m for m in models if not m.document.get('unique')]
+    # The others first, so the lookups stay indexed while duplicates are being sorted out
+    names = collection.create_indexes(others) if others else []
+    for model in models:
+        if not model.document.get('unique'):
+            continue
+        try:
+            names += collection.create_indexes([model])
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY:
+                raise
+            keys = _unique_keys(model)
+            raise DuplicateKeys(collection, model.document['name'], keys, find_duplicates(collection, keys)) from e
+    return names
+
+
+def _explain_find(filter, sort=None):
+    def run(collection):
+        cursor = collection.find(filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        return cursor.explain()
+    return run
+
+
+def _explain_distinct(key):
+    def run(collection):
+        return collection.database.command('explain', {'distinct': collection.name, 'key': key})
+    return run
+
+
+# Collection name -> [(route, explain callable)] for the selective query each route runs.
+PLAN_CHECKS = {
+    'forms': [
+        ('GET /api/form?name=&version=', _explain_find({'form_name': 'x', 'version_name': 'x'})),
+        ('GET /api/form?name= (versions)', _explain_find({'form_name': 'x'}, [('_id', 1)])),
+        ('GET /api/forms', _explain_distinct('form_name')),
+        ('GET /api/form/metrics?names=', _explain_find({'form_name': {'$in': ['x', 'y']}})),
+        ('GET /api/form?name= (latest)', _explain_find({'form_name': 'x'}, [('updated_at', -1), ('_id', -1)])),
+    ],
+    'markets': [
+        ('GET /api/markets/<id>/<nf>/<name>', _explain_find({'marketId': 0, 'nf': 'x', 'marketName': 'x'})),
+        ('GET /api/markets?limit=', _explain_find({'marketId': {'$gt': 0}}, [('marketId', 1), ('_id', 1)])),
+        ('GET /api/markets?vendor=', _explain_find({'vendor': 'x'}, [('marketId', 1), ('_id', 1)])),
+        ('GET /api/markets?nf=', _explain_find({'nf': 'x'}, [('marketId', 1), ('_id', 1)])),
+        ('GET /api/markets?nfType=', _explain_find({'nfType': 'x'}, [('marketId', 1), ('_id', 1)])),
+    ],
+    'market_nodes': [
+        ('GET /api/markets/<id>/<nf>/<name>?limit=', _explain_find(
+            {'market.marketId': 0, 'market.nf': 'x', 'market.marketName': 'x'}, [('position', 1)])),
+    ],
+    'mycollection': [
+        ('GET /api/servers', _explain_distinct('name')),
+        ('GET /api/data?serverName=', _explain_find({'name': 'x'})),
+    ],
+    'nfs': [
+        ('GET /api/nfs?type=', _explain_find({'type': 'x'}, [('_id', 1)])),
+        ('GET /api/nfs?product=', _explain_find({'product': 'x'}, [('_id', 1)])),
+        ('GET /api/nfs?vastId=', _explain_find({'vastId': 'x'}, [('_id', 1)])),
+        ('GET /api/nfs/<id>', _explain_find({'id': 'x'})),
+    ],
+}
+
+
+def _winning_stages(explain):
+    """Yield every stage name found under a winningPlan in an explain document."""
+    def stages(node):
+        if isinstance(node, dict):
+            if 'stage' in node:
+                yield node['stage']
+            for value in node.values():
+                yield from stages(value)
+        elif isinstance(node, list):
+            for value in node:
+                yield from stages(value)
+
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == 'winningPlan':
+                yield from stages(value)
+            else:
+                yield from _winning_stages(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from _winning_stages(value)
+
+
+def check_plans(collection):
+    """Return [(route, stages)] for every route of `collection` whose plan contains a COLLSCAN."""
+    failures = []
+    for route, explain in PLAN_CHECKS.get(collection.name, []):
+        stages = list(_winning_stages(explain(collection)))
+        if 'COLLSCAN' in stages:
+            failures.append((route, stages))
+    return failures
+
+
+def backend_collections(client):
+    """The collections each backend uses, with the database names they hard-code."""
+    return [
+        client['form_database']['forms'],
+        client[os.getenv('DB_NAME', 'slices')]['markets'],
+        client[os.getenv('DB_NAME', 'slices')]['market_nodes'],
+        client['mydatabase']['mycollection'],
+        client['metricsdb']['nfs'],
+    ]
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Create backend indexes and verify query plans.')
+    parser.add_argument('--uri', help='MongoDB URI (default: $MONGO_URI or localhost)')
+    parser.add_argument('--check-plans', action='store_true', help='fail if any route query plan is a COLLSCAN')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='rename documents that repeat a unique key before creating the indexes')
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(args.uri or os.getenv('MONGO_URI', 'mongodb://localhost:27017/'))
+
+    failed = False
+    for collection in backend_collections(client):
+        if args.dedupe:
+            print(f'{collection.full_name}: renamed {dedupe(collection)} duplicate documents')
+        try:
+            names = ensure_indexes(collection)
+        except DuplicateKeys as e:
+            failed = True
+            print(e)
+            continue
+        print(f'{collection.full_name}: {", ".join(names) or "no indexes declared"}')
+        if args.check_plans:
+            for route, stages in check_plans(collection):
+                failed = True
+                print(f'  COLLSCAN in {route}: {" -> ".join(stages)}')
+    sys.exit(1 if failed else 0)
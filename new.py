@@ -1,45 +1,49 @@
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
-from bson.objectid import ObjectId
-from werkzeug.utils import secure_filename
+from pymongo.errors import DuplicateKeyError
 import os
 
+from form_repository import clone_version, fetch_form, find_version, record_save, touch
+from form_schema import AnswerUpdate, schema_cache, schema_for
+from mongo_indexes import ensure_indexes
+from upload_storage import make_storage
+
 app = Flask(__name__)
 client = MongoClient('mongodb://localhost:27017/')
 db = client['form_database']
 forms_collection = db['forms']
+ensure_indexes(forms_collection)
 
 # Directory for file uploads
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
+storage = make_storage(UPLOAD_FOLDER, db)
 
-# Function to update answers in a form document
+# Function to update answers in a form document. The form is modified in
+# place; the returned AnswerUpdate holds only the answers that changed.
 def update_answers(form, form_data, files):
-    new_sections = []
-    for section in form['sections']:
-        new_questions = []
-        for question in section['questions']:
-            qid = question['id']
-            if question['type'] == 'file':
-                existing_files = form_data.getlist(qid)
-                new_files = files.getlist(qid)
-                new_paths = []
-                for file in new_files:
-                    filename = secure_filename(file.filename)
-                    path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(path)
-                    new_paths.append(path)
-                question['answer'] = existing_files + new_paths
-            elif question['type'] == 'checkbox':
-                question['answer'] = form_data.getlist(qid)
-            else:
-                question['answer'] = form_data.get(qid, question.get('answer'))
-            new_questions.append(question)
-        section['questions'] = new_questions
-        new_sections.append(section)
-    form['sections'] = new_sections
-    return form
+    schema = schema_for(form)
+    update = AnswerUpdate(schema)
+
+    # Plain answers: only the submitted fields are touched
+    for qid in form_data:
+        question = schema.question(form, qid)
+        if question is None or question['type'] in ('file', 'checkbox'):
+            continue
+        update.set(question, form_data.get(qid))
+
+    # Checkboxes: an unchecked box is not submitted, so every one is reset
+    for question in schema.questions(form, schema.checkbox_questions):
+        update.set(question, form_data.getlist(question['id']))
+
+    for question in schema.questions(form, schema.file_questions):
+        qid = question['id']
+        existing_files = form_data.getlist(qid)
+        new_files = files.getlist(qid)
+        new_paths = [storage.save(file) for file in new_files if file.filename]
+        update.set(question, existing_files + new_paths)
+    return update
 
 # GET endpoint to retrieve form definition
 @app.route('/api/form', methods=['GET'])
@@ -49,18 +53,11 @@ def get_form():
     if not form_name:
         return jsonify({'error': 'Form name is required'}), 400
 
-    query = {'form_name': form_name}
-    if version_name:
-        query['version_name'] = version_name
-
-    form = forms_collection.find_one(query)
+    # The requested (or latest) version, then the version list: two indexed queries
+    form, versions = fetch_form(forms_collection, form_name, version_name)
     if not form:
         return jsonify({'error': 'Form not found'}), 404
 
-    # Get all versions for this form
-    all_versions = forms_collection.find({'form_name': form_name}, {'version_name': 1})
-    versions = [v['version_name'] for v in all_versions]
-
     form['_id'] = str(form['_id'])  # Convert ObjectId to string for JSON
     form['versions'] = versions
     return jsonify(form)
@@ -91,44 +88,51 @@ def post_form():
         if not source_form:
             return jsonify({'error': 'Source version not found'}), 404
         
-        new_form = source_form.copy()
-        new_form['version_name'] = new_version_name
-        new_form['_id'] = ObjectId()
-        new_form['submitted'] = False
-        
-        if action == 'new_version':
-            # Set answers to null for new version
-            for section in new_form['sections']:
-                for question in section['questions']:
-                    question['answer'] = None
-        
-        forms_collection.insert_one(new_form)
+        # The new version shares the source's schema; only the answers are
+        # copied (clone) or dropped (new_version)
+        try:
+            new_form = clone_version(forms_collection, source_form, form_name, new_version_name,
+                                     keep_answers=action == 'clone')
+        except DuplicateKeyError:
+            return jsonify({'error': 'Version name already exists'}), 409
         new_form['_id'] = str(new_form['_id'])
         return jsonify(new_form)
 
     elif action == 'rename':
         # Renaming the current version
-        form = forms_collection.find_one({'form_name': form_name, 'version_name': version_name})
+        form = find_version(forms_collection, form_name, version_name)
         if not form:
             return jsonify({'error': 'Form version not found'}), 404
-        forms_collection.update_one(
-            {'_id': form['_id']},
-            {'$set': {'version_name': new_version_name}}
-        )
+        try:
+            forms_collection.update_one(
+                {'_id': form['_id']},
+                {'$set': touch({'version_name': new_version_name})}
+            )
+        except DuplicateKeyError:
+            return jsonify({'error': 'Version name already exists'}), 409
+        schema_cache.invalidate(form_name, version_name)
         form['version_name'] = new_version_name
         form['_id'] = str(form['_id'])
         return jsonify(form)
 
     else:
         # Regular save or submit
-        form = forms_collection.find_one({'form_name': form_name, 'version_name': version_name})
+        form = find_version(forms_collection, form_name, version_name)
         if not form:
             return jsonify({'error': 'Form version not found'}), 404
-        form = update_answers(form, request.form, request.files)
-        if action == 'submit':
-            form['submitted'] = True
-        forms_collection.update_one({'_id': form['_id']}, {'$set': form})
+        update = update_answers(form, request.form, request.files)
+        record_save(update, form, submit=action == 'submit')
+        if update.changed:
+            # Write only the changed answers, guarded against a moved question
+            touch(form)
+            result = forms_collection.update_one(
+                {'_id': form['_id'], **update.guard},
+                {'$set': {**update.fields, 'updated_at': form['updated_at']}}
+            )
+            if result.matched_count == 0:
+                return jsonify({'error': 'Form was modified, reload and try again'}), 409
         form['_id'] = str(form['_id'])
+        form['changed_fields'] = update.changed
         return jsonify(form)
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+"""
+Diff-based sync of the NF list saved by the dashboard.
+
+POST /api/nfs sends the complete NF list. Instead of deleting the collection
+and inserting everything again, sync_nfs matches each incoming NF to a stored
+one and sends a single unordered bulk_write containing only
+
+  - ReplaceOne(upsert=True) for new and changed NFs, and
+  - DeleteOne for stored NFs that are no longer in the list,
+
+so unchanged documents keep their _id and readers never see an empty
+collection. NFs are matched on the _id the client got from GET /api/nfs, or,
+for NFs created on the client, on their `id` field. Each stored document
+carries a `_hash` of its content, so finding the unchanged ones only reads
+(_id, id, _hash) from the collection.
+"""
+import hashlib
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DeleteOne, ReplaceOne
+
+HASH_FIELD = '_hash'
+# Fields a client may request from /api/nfs with ?fields= (_id is always returned), and its filters
+NF_FIELDS = ('id', 'type', 'product', 'vastId', 'automations')
+NF_FILTERS = ('type', 'product', 'vastId')
+NF_SORT = [('_id', ASCENDING)]
+
+
+def content_hash(nf):
+    body = {k: v for k, v in nf.items() if k not in ('_id', HASH_FIELD)}
+    return hashlib.sha1(json.dumps(body, sort_keys=True, separators=(',', ':'), default=str).encode()).hexdigest()
+
+
+def nf_projection(fields):
+    """Projection for a comma-separated ?fields= value; the hash is never returned."""
+    projection = {f: 1 for f in fields.split(',') if f in NF_FIELDS} if fields else {}
+    # With no valid name left, {} would return every field including the hash
+    return projection or {HASH_FIELD: 0}
+
+
+def _object_id(value):
+    if isinstance(value, ObjectId):
+        return value
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def plan_sync(stored, incoming):
+    """
+    Return (operations, counts) that turn `stored` (docs with _id, id, _hash)
+    into `incoming` (NF dicts as posted).
+    """
+    by_oid = {doc['_id']: doc for doc in stored}
+    by_client_id = {doc['id']: doc for doc in stored if doc.get('id') is not None}
+
+    ops = []
+    counts = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    kept = set()
+    for nf in incoming:
+        nf = dict(nf)
+        current = by_oid.get(_object_id(nf.get('_id')))
+        if current is None and nf.get('id') is not None:
+            current = by_client_id.get(nf['id'])
+        if current is not None and current['_id'] in kept:
+            current = None  # Posted twice; keep the second copy as a new NF
+        nf.pop('_id', None)
+        nf[HASH_FIELD] = content_hash(nf)
+
+        if current is None:
+            oid = ObjectId()
+            ops.append(ReplaceOne({'_id': oid}, nf, upsert=True))
+            kept.add(oid)
+            counts['inserted'] += 1
+            continue
+        kept.add(current['_id'])
+        if current.get(HASH_FIELD) == nf[HASH_FIELD]:
+            counts['unchanged'] += 1
+        else:
+            ops.append(ReplaceOne({'_id': current['_id']}, nf, upsert=True))
+            counts['updated'] += 1
+
+    for oid in by_oid:
+        if oid not in kept:
+            ops.append(DeleteOne({'_id': oid}))
+            counts['deleted'] += 1
+    return ops, counts
+
+
+def sync_nfs(collection, incoming, transaction=False):
+    """Make `collection` hold exactly `incoming`; returns inserted/updated/deleted/unchanged counts."""
+    def run(session=None):
+        stored = list(collection.find({}, {'_id': 1, 'id': 1, HASH_FIELD: 1}, session=session))
+        ops, counts = plan_sync(stored, incoming)
+        if ops:
+            collection.bulk_write(ops, ordered=False, session=session)
+        return counts
+
+    if not transaction:
+        return run()
+    # Transactions need a replica set; the read and the write see one snapshot
+    with collection.database.client.start_session() as session:
+        return session.with_transaction(run)
@@ -0,0 +1,225 @@
+"""
+Shared response cache for read-heavy dashboard endpoints.
+
+    cache = ResponseCache()
+
+    @app.route('/api/servers')
+    @cache.cached(collection)
+    def get_server_names(): ...
+
+Responses are keyed by endpoint and normalized query arguments and stored as
+serialized bytes with an ETag, so a repeat request is answered without
+touching MongoDB, and a client that sends If-None-Match gets a 304. Streamed
+responses are still streamed; their body is captured on the way out and cached
+once complete if it fits the entry size limit. Entries are evicted
+least-recently-used once the cache exceeds its byte budget.
+
+An entry is valid while the versions of the collections it was built from are
+unchanged. Versions move when
+  - a change stream on the collection reports any event (replica sets), or
+  - polling sees the collection's counter in `cache_versions` change; writers
+    call bump_version() after modifying a collection, which also covers
+    deployments without change streams, or
+  - the entry is older than `max_age` seconds, as a last resort for writers
+    that do neither.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, Response
+from pymongo import ReturnDocument
+
+VERSIONS_COLLECTION = 'cache_versions'
+
+
+def bump_version(collection):
+    """
+    Record that `collection` changed; call after every write to a cached
+    collection. Returns the collection's new version in `cache_versions`.
+    """
+    doc = collection.database[VERSIONS_COLLECTION].find_one_and_update(
+        {'_id': collection.name}, {'$inc': {'version': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    _tracker.changed(collection)
+    return doc['version']
+
+
+def _key(collection):
+    return collection.full_name
+
+
+class VersionTracker:
+    """Per-process change counters fed by change streams or by polling cache_versions."""
+
+    def __init__(self, poll_interval=5.0):
+        self.poll_interval = poll_interval
+        self._versions = {}
+        self._remote = {}
+        self._polled = {}
+        self._watched = set()
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def changed(self, collection):
+        with self._lock:
+            key = _key(collection)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def version(self, collection):
+        return self._versions.get(_key(collection), 0)
+
+    def watch(self, collection):
+        """Start tracking external changes to `collection` (idempotent)."""
+        with self._lock:
+            if _key(collection) in self._watched:
+                return
+            self._watched.add(_key(collection))
+        threading.Thread(target=self._watch, args=(collection,), daemon=True,
+                         name=f'cache-watch-{collection.name}').start()
+
+    def _watch(self, collection):
+        try:
+            with collection.watch() as stream:
+                for _ in stream:
+                    self.changed(collection)
+        except Exception:
+            # No change streams (standalone server, mongomock) or the stream
+            # died: fall back to polling the version counter
+            self.changed(collection)
+            self._poll(collection)
+
+    def _poll(self, collection):
+        with self._lock:
+            self._polled[_key(collection)] = collection
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, daemon=True, name='cache-poll')
+                self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            with self._lock:
+                collections = list(self._polled.values())
+            for collection in collections:
+                try:
+                    doc = collection.database[VERSIONS_COLLECTION].find_one({'_id': collection.name})
+                except Exception:
+                    continue
+                remote = doc.get('version') if doc else 0
+                key = _key(collection)
+                if key in self._remote and self._remote[key] != remote:
+                    self.changed(collection)
+                self._remote[key] = remote
+            time.sleep(self.poll_interval)
+
+
+_tracker = VersionTracker()
+
+
+class _Entry:
+    __slots__ = ('versions', 'body', 'etag', 'status', 'headers', 'created')
+
+    def __init__(self, versions, body, status, headers):
+        self.versions = versions
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.status = status
+        self.headers = headers
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024, max_age=300):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def cached(self, *collections):
+        """Cache a GET view whose output depends only on `collections` and its query args."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                for collection in collections:
+                    _tracker.watch(collection)
+                key = (request.endpoint, tuple(sorted(kwargs.items())),
+                       tuple(sorted(request.args.items(multi=True))))
+                versions = tuple(_tracker.version(c) for c in collections)
+
+                entry = self._get(key, versions)
+                if entry is not None:
+                    return self._respond(entry)
+
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                headers = [(k, v) for k, v in response.headers.items()
+                           if k not in ('Content-Length', 'ETag', 'Date')]
+                if response.is_streamed:
+                    response.response = self._capture(key, versions, response.response, headers)
+                    return response
+                entry = self._put(key, versions, response.get_data(), response.status_code, headers)
+                return self._respond(entry) if entry is not None else response
+            return wrapper
+        return decorator
+
+    def _respond(self, entry):
+        if request.if_none_match.contains(entry.etag):
+            response = Response(status=304)
+        else:
+            response = Response(entry.body, status=entry.status, headers=entry.headers)
+        response.set_etag(entry.etag)
+        return response
+
+    def _capture(self, key, versions, chunks, headers):
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            if parts is not None:
+                size += len(chunk)
+                if size > self.max_entry_bytes:
+                    parts = None
+                else:
+                    parts.append(chunk)
+            yield chunk
+        if parts is not None:
+            self._put(key, versions, b''.join(parts), 200, headers)
+
+    def _get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.versions != versions or time.monotonic() - entry.created > self.max_age:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, versions, body, status, headers):
+        if len(body) > self.max_entry_bytes:
+            return None
+        entry = _Entry(versions, body, status, headers)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+        return entry
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,100 @@
+"""
+A small sampling profiler for individual requests.
+
+One daemon thread wakes every `interval` seconds and records the stack of
+each thread that is being profiled (sys._current_frames), so a profiled
+request pays nothing but the sampling itself and the rest of the process is
+not slowed down. Stacks are counted in the "folded" format
+
+    main (app.py:10);handler (views.py:42);find (cursor.py:120) 17
+
+that flamegraph.pl, speedscope and inferno render as a flame graph.
+
+    profiler = SamplingProfiler()
+    profile = profiler.start()            # in the thread to profile
+    ...
+    stacks = profiler.stop(profile)       # {folded stack: samples}
+    write_folded(path, stacks)
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005
+MAX_DEPTH = 200
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def folded_stack(frame):
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Profile:
+    __slots__ = ('thread_id', 'stacks', 'started')
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.stacks = Counter()
+        self.started = time.perf_counter()
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._reset()
+        # The sampler thread does not survive fork: children start their own
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id=None):
+        """Start sampling a thread (the calling one by default); returns the Profile to pass to stop()."""
+        profile = Profile(thread_id if thread_id is not None else threading.get_ident())
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name='sampling-profiler')
+                self._thread.start()
+            self._profiles[id(profile)] = profile
+        return profile
+
+    def stop(self, profile):
+        """Stop sampling and return {folded stack: samples}."""
+        with self._lock:
+            self._profiles.pop(id(profile), None)
+        return profile.stacks
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                profiles = list(self._profiles.values())
+            if not profiles:
+                continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None and profile.thread_id != me:
+                    profile.stacks[folded_stack(frame)] += 1
+
+
+def write_folded(path, stacks):
+    """Write {folded stack: samples} as a folded-stacks file."""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    os.replace(tmp, path)
+    return path
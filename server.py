@@ -0,0 +1,74 @@
+"""
+One WSGI entry point for the Flask backends, for gunicorn and other
+preforking servers:
+
+    flask --app server init                 # once per deployment
+    gunicorn -c gunicorn.conf.py            # serves server:create_app()
+    flask --app server run --debug          # development
+
+create_app() registers the blueprint of each backend:
+
+    metrics  instrumentation.py  /metrics, and timings of every route
+    forms    flask_back.py       /api/form, /api/forms, /api/form/metrics, uploads
+    slices   slice.py            /api/slices, /api/markets
+    table    table_back.py       /api/servers, /api/data
+    nfs      dash_backend.py     /api/nfs
+    diff     gitdff.py           /api/diff, /api/diff/tree
+    tab      tab.py              /, /<tab>, /<tab>/data, /api/graph
+
+APP_BLUEPRINTS=forms,table (or create_app(['forms', 'table'])) serves a
+subset; slices needs MONGO_URI and DB_NAME. new.py is not included: it is an
+older copy of the /api/form routes of flask_back.py.
+
+Importing the backends does no I/O. Their Mongo clients are created in each
+worker on its first request (mongo_clients.py), and the index builds and the
+BlankTemplate seed that used to run on every import are done by the `init`
+command instead.
+"""
+import importlib
+import os
+
+import click
+from flask import Flask
+
+from mongo_indexes import DuplicateKeys
+
+# Blueprint name -> module defining `bp` (and optionally `init_db`)
+BLUEPRINTS = {
+    'metrics': 'instrumentation',
+    'forms': 'flask_back',
+    'slices': 'slice',
+    'table': 'table_back',
+    'nfs': 'dash_backend',
+    'diff': 'gitdff',
+    'tab': 'tab',
+}
+
+
+def blueprint_names():
+    names = os.environ.get('APP_BLUEPRINTS')
+    return [n.strip() for n in names.split(',') if n.strip()] if names else list(BLUEPRINTS)
+
+
+def create_app(names=None):
+    app = Flask(__name__)
+    modules = []
+    for name in names or blueprint_names():
+        if name not in BLUEPRINTS:
+            raise ValueError(f"unknown blueprint {name!r}; expected one of {', '.join(BLUEPRINTS)}")
+        module = importlib.import_module(BLUEPRINTS[name])
+        app.register_blueprint(module.bp)
+        modules.append(module)
+
+    @app.cli.command('init')
+    def init():
+        """Create the indexes and seed documents of every registered backend."""
+        for module in modules:
+            if hasattr(module, 'init_db'):
+                try:
+                    module.init_db()
+                except DuplicateKeys as e:
+                    raise click.ClickException(str(e))
+                print(f'{module.__name__}: initialized')
+
+    return app
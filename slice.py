@@ -1,61 +1,124 @@
 import os
-from flask import Flask, jsonify
+from bson.errors import InvalidId
+from flask import Blueprint, Flask, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from json_stream import stream_json_array
+from listing import (MARKET_FILTERS, MARKET_SORT, MAX_PAGE_SIZE, filters, market_cursor, market_fields,
+                     market_row, next_after, page_edge, page_limit, parse_after)
+from market_nodes import NODES_COLLECTION, NodeQuery, node_page
+from mongo_clients import lazy_database
+from mongo_indexes import ensure_indexes
+from response_cache import ResponseCache
+from slice_rollup import SliceRollup
+
 load_dotenv()
-app = Flask(__name__)
-CORS(app)
+bp = Blueprint('slices', __name__)
+CORS(bp, expose_headers=['X-Next-After'])
 
 def get_db():
     uri = os.getenv('MONGO_URI')
     db_name = os.getenv('DB_NAME')
     if not uri or not db_name:
         raise RuntimeError('MONGO_URI and DB_NAME must be set')
-    client = MongoClient(uri)
-    return client[db_name]
+    # Connects per process on first use (see mongo_clients.py)
+    return lazy_database(uri, db_name)
 
 col = get_db().markets
+rollup = SliceRollup(col)
+cache = ResponseCache()
+# With SPLIT_MARKET_NODES set, market nodes are read from their own collection
+# (moved there by `python market_nodes.py --split`) instead of the market document.
+nodes_col = None
+if os.getenv('SPLIT_MARKET_NODES'):
+    nodes_col = col.database[NODES_COLLECTION]
+
+def init_db():
+    """One-time setup (`flask --app server init`): the indexes of the collections read here."""
+    ensure_indexes(col)
+    if nodes_col is not None:
+        ensure_indexes(nodes_col)
 
-@app.route('/api/slices')
+@bp.route('/api/slices')
+@cache.cached(col, rollup.rollup)
 def get_slices():
-    agg = {}
-    for doc in col.find({}, {'_id': 0, 'results': 1}):
-        for name, vals in doc.get('results', {}).items():
-            if name not in agg:
-                agg[name] = {'total': 0, 'deployed': 0}
-            agg[name]['total'] += vals.get('total', 0)
-            agg[name]['deployed'] += vals.get('deployed', 0)
-    return jsonify([{ 'name': n, **stats } for n, stats in agg.items()])
-
-@app.route('/api/markets')
+    return jsonify(rollup.slices())
+
+@bp.route('/api/markets')
+@cache.cached(col)
 def get_markets():
-    markets = []
-    for m in col.find({}, {'_id': 0, 'marketId': 1, 'marketName': 1, 'vendor': 1, 'nf': 1, 'nfType': 1, 'results': 1}):
-        markets.append({
-            'id': m['marketId'],
-            'name': m['marketName'],
-            'vendor': m.get('vendor'),
-            'nf': m.get('nf'),
-            'type': m.get('nfType'),
-            'results': m.get('results', {})
-        })
-    return jsonify(markets)
-
-@app.route('/api/markets/<int:id>/<nf>/<name>')
+    """
+    Stream markets as a JSON array, ordered by marketId.
+
+    Query parameters (all optional):
+      - vendor, nf, nfType: exact-match filters
+      - fields: comma-separated response fields to return (`id` is always included)
+      - limit: page size, at most MAX_PAGE_SIZE; without it every market is streamed
+      - after: cursor from the previous page's X-Next-After header, or a plain marketId
+
+    When more results remain after a page, X-Next-After holds the cursor for the next one.
+    """
+    query = filters(request.args, MARKET_FILTERS)
+    fields, projection = market_fields(request.args.get('fields'))
+    try:
+        if request.args.get('after'):
+            query.update(parse_after(request.args['after']))
+        limit = page_limit(request.args)
+    except (ValueError, InvalidId):
+        return jsonify({'error': 'invalid after or limit'}), 400
+
+    headers = {}
+    cursor = col.find(query, projection).sort(MARKET_SORT)
+    if limit is not None:
+        # Look up the page boundary from the index alone so the cursor can be
+        # sent in a header before the body starts streaming.
+        after = next_after(list(page_edge(col, query, MARKET_SORT, limit)), market_cursor)
+        if after:
+            headers['X-Next-After'] = after
+        cursor = cursor.limit(limit)
+
+    rows = (market_row(m, fields) for m in cursor)
+    return stream_json_array(rows, headers=headers)
+
+@bp.route('/api/markets/<int:id>/<nf>/<name>')
+@cache.cached(*[c for c in (col, nodes_col) if c is not None])
 def get_market_detail(id, nf, name):
-    m = col.find_one({'marketId': id, 'nf': nf, 'marketName': name}, {'_id': 0, 'marketId': 1, 'marketName': 1, 'vendor': 1, 'nf': 1, 'nfType': 1, 'nodes': 1})
+    """
+    A market with one page of its nodes.
+
+    Query parameters (all optional):
+      - offset, limit: the page of nodes, limit at most MAX_PAGE_SIZE; without
+        a limit every matching node is returned
+      - name: nodes whose gnbDuid contains this (case-insensitive)
+      - status: `<slice>:<text>` or `<text>` (any slice), repeatable
+      - sort: `gnbDuid` or a slice name (by its timestamp), order: asc/desc
+
+    `total` is the number of nodes matching the filters and `statusCounts`
+    their counts by slice and status ({slice: {status: count}}).
+    """
+    try:
+        query = NodeQuery.from_args(request.args, MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': f'invalid node query: {e}'}), 400
+    key = {'marketId': id, 'nf': nf, 'marketName': name}
+    m = col.find_one(key, {'_id': 0, 'marketId': 1, 'marketName': 1, 'vendor': 1, 'nf': 1, 'nfType': 1})
     if not m:
         return jsonify({'error': 'not found'}), 404
+    page = node_page(col, key, query, nodes_col)
     return jsonify({
         'id': m['marketId'],
         'name': m['marketName'],
         'vendor': m.get('vendor'),
         'nf': m.get('nf'),
         'type': m.get('nfType'),
-        'nodes': m.get('nodes', [])
+        'offset': query.offset,
+        'limit': query.limit,
+        **page,
     })
 
 if __name__ == '__main__':
+    init_db()
+    app = Flask(__name__)
+    app.register_blueprint(bp)
     app.run(debug=True, host='0.0.0.0', port=5000)
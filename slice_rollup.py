@@ -0,0 +1,273 @@
+"""
+Pre-aggregated slice totals for /api/slices.
+
+The per-slice sums are computed by MongoDB ($objectToArray + $group) and kept
+in a small rollup collection holding one document per slice. Market writes made
+through save_market/delete_market adjust that collection with $inc by the
+difference between the old and new `results`, so serving the totals costs one
+read of the rollup (O(slices)) instead of a scan of every market.
+
+The rollup's entry in `cache_versions` also records the version of `markets`
+its totals reflect. save_market/delete_market (and ingest.py) advance it
+along with their own write; any other bump of the markets version, e.g. by
+market_nodes.py or by a script that calls response_cache.bump_version()
+after changing markets, makes the next slices() rebuild the totals. Writes
+that do not bump the version at all are only picked up once the totals are
+older than ROLLUP_MAX_AGE seconds, or by `python slice_rollup.py --rebuild`.
+Every write bumps the response-cache version of both collections.
+
+Every writer registers in `slice_totals_pending` before it writes the
+markets and leaves once its delta is applied. A rebuild that overlaps a
+registered write, or sees the markets version move while it aggregates, may
+hold that write twice (the aggregation counts it and the writer's $inc adds
+it again), so it leaves the totals marked stale for the next slices() to
+rebuild. Batch writers (ingest.py) also journal each batch's delta there,
+and every slice document lists the batches already folded into it, so a
+batch replayed after a crash applies its original delta exactly once (see
+begin_batch/markets_changed).
+"""
+import argparse
+import os
+import time
+
+from pymongo import UpdateOne, ReplaceOne, DeleteOne, ReturnDocument
+
+from response_cache import VERSIONS_COLLECTION, bump_version
+
+ROLLUP_COLLECTION = 'slice_totals'
+PENDING_COLLECTION = 'slice_totals_pending'
+# Rebuild totals older than this even if the markets version did not move (0: never)
+ROLLUP_MAX_AGE = float(os.environ.get('ROLLUP_MAX_AGE', '3600'))
+# Pending writes older than this were abandoned by a writer that died
+PENDING_MAX_AGE = float(os.environ.get('ROLLUP_PENDING_MAX_AGE', '600'))
+
+# Sum results.<name>.total / results.<name>.deployed across all markets.
+# `markets` counts how many market documents contribute to a slice so that
+# slices can be dropped from the response once nothing references them.
+SLICE_PIPELINE = [
+    {'$project': {'_id': 0, 'results': {'$objectToArray': {'$ifNull': ['$results', {}]}}}},
+    {'$unwind': '$results'},
+    {'$group': {
+        '_id': '$results.k',
+        'total': {'$sum': '$results.v.total'},
+        'deployed': {'$sum': '$results.v.deployed'},
+        'markets': {'$sum': 1},
+    }},
+]
+
+
+# Rollup documents of slices still referenced by some market
+LIVE_SLICES = {'markets': {'$gt': 0}}
+
+
+def to_slice(total):
+    """A rollup (or SLICE_PIPELINE) document in the /api/slices response shape."""
+    return {'name': total['_id'], 'total': total.get('total', 0), 'deployed': total.get('deployed', 0)}
+
+
+def is_current(markets_state, rollup_state, now=None, max_age=ROLLUP_MAX_AGE):
+    """
+    Whether the rollup still matches markets, given the `cache_versions`
+    documents of both collections (None if missing).
+    """
+    if not rollup_state or 'markets_version' not in rollup_state:
+        return False
+    if rollup_state['markets_version'] != (markets_state or {}).get('version', 0):
+        return False
+    now = time.time() if now is None else now
+    return not max_age or now - rollup_state.get('rebuilt_at', 0) < max_age
+
+
+def market_key(doc):
+    """Natural key of a market document (the same fields /api/markets/<id>/<nf>/<name> uses)."""
+    return {'marketId': doc['marketId'], 'nf': doc.get('nf'), 'marketName': doc['marketName']}
+
+
+def _number(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def results_delta(old_results, new_results):
+    """
+    Return {slice: (d_total, d_deployed, d_markets)} turning the totals of
+    `old_results` into those of `new_results`. Unchanged slices are omitted.
+    """
+    old_results = old_results or {}
+    new_results = new_results or {}
+    delta = {}
+    for name in set(old_results) | set(new_results):
+        old = old_results.get(name)
+        new = new_results.get(name)
+        old_vals = old if isinstance(old, dict) else {}
+        new_vals = new if isinstance(new, dict) else {}
+        d_total = _number(new_vals.get('total', 0)) - _number(old_vals.get('total', 0))
+        d_deployed = _number(new_vals.get('deployed', 0)) - _number(old_vals.get('deployed', 0))
+        d_markets = (name in new_results) - (name in old_results)
+        if d_total or d_deployed or d_markets:
+            delta[name] = (d_total, d_deployed, d_markets)
+    return delta
+
+
+def add_delta(total, delta):
+    """Accumulate `delta` into `total` in place, e.g. to apply a batch of market changes at once."""
+    for name, (dt, dd, dm) in delta.items():
+        t, d, m = total.get(name, (0, 0, 0))
+        total[name] = (t + dt, d + dd, m + dm)
+    return total
+
+
+class SliceRollup:
+    def __init__(self, markets, rollup=None):
+        self.markets = markets
+        self.rollup = rollup if rollup is not None else markets.database[ROLLUP_COLLECTION]
+        self.versions = markets.database[VERSIONS_COLLECTION]
+        self.pending = markets.database[PENDING_COLLECTION]
+
+    def _state(self, collection):
+        return self.versions.find_one({'_id': collection.name})
+
+    def aggregate(self):
+        """Compute the slice totals from the markets collection on the server."""
+        return list(self.markets.aggregate(SLICE_PIPELINE))
+
+    def _markets_version(self):
+        return (self._state(self.markets) or {}).get('version', 0)
+
+    def rebuild(self, settled=None):
+        """
+        Recompute the rollup from scratch and replace the stored totals.
+
+        They are marked current only if no markets write was registered or
+        finished while they were computed. Pending entries matching `settled`
+        (e.g. an ingest run's own leftovers) or older than PENDING_MAX_AGE
+        belong to writers that are gone: whatever they wrote is in the new
+        totals, and a replay recomputes its delta, so they are removed.
+        """
+        markets_version = self._markets_version()
+        totals = self.aggregate()
+        ops = [ReplaceOne({'_id': t['_id']}, t, upsert=True) for t in totals]
+        current = {t['_id'] for t in totals}
+        ops += [DeleteOne({'_id': d['_id']}) for d in self.rollup.find({}, {'_id': 1}) if d['_id'] not in current]
+        if ops:
+            self.rollup.bulk_write(ops, ordered=False)
+        gone = [{'started': {'$lt': time.time() - PENDING_MAX_AGE}}, {'started': {'$exists': False}}]
+        if settled is not None:
+            gone.append(settled)
+        self.pending.delete_many({'$or': gone})
+        # Checked after the totals are written: a write registered now may have been counted twice
+        if self.pending.count_documents({}, limit=1) or self._markets_version() != markets_version:
+            update = {'$set': {'rebuilt_at': time.time()}, '$unset': {'markets_version': ''}}
+        else:
+            update = {'$set': {'markets_version': markets_version, 'rebuilt_at': time.time()}}
+        self.versions.update_one({'_id': self.rollup.name}, update, upsert=True)
+        bump_version(self.rollup)
+        return len(totals)
+
+    def apply_change(self, old_results, new_results):
+        """Fold the change of one market's `results` into the rollup."""
+        return self.apply_delta(results_delta(old_results, new_results))
+
+    def apply_delta(self, delta, batch_id=None):
+        """
+        Apply a {slice: (d_total, d_deployed, d_markets)} delta (see
+        results_delta/add_delta). With `batch_id`, each slice skips the delta
+        if that batch was already applied to it.
+        """
+        if batch_id is None:
+            ops = [
+                UpdateOne({'_id': name}, {'$inc': {'total': dt, 'deployed': dd, 'markets': dm}}, upsert=True)
+                for name, (dt, dd, dm) in delta.items()
+            ]
+        else:
+            ops = []
+            for name, (dt, dd, dm) in delta.items():
+                ops.append(UpdateOne({'_id': name}, {'$setOnInsert': {'total': 0, 'deployed': 0, 'markets': 0}},
+                                     upsert=True))
+                ops.append(UpdateOne({'_id': name, 'batches': {'$ne': batch_id}},
+                                     {'$inc': {'total': dt, 'deployed': dd, 'markets': dm},
+                                      '$push': {'batches': batch_id}}))
+        if ops:
+            self.rollup.bulk_write(ops, ordered=batch_id is not None)
+            bump_version(self.rollup)
+        return len(delta)
+
+    def begin_batch(self, batch_id, delta):
+        """
+        Journal the delta of a batch before its markets are written. Returns
+        the delta to apply: the journaled one if this batch was started before
+        (its markets may already hold the new results, so the delta cannot be
+        recomputed), otherwise `delta`.
+        """
+        entry = self.pending.find_one_and_update(
+            {'_id': batch_id},
+            {'$setOnInsert': {'delta': [[name, *d] for name, d in delta.items()], 'started': time.time()}},
+            upsert=True, return_document=ReturnDocument.BEFORE,
+        )
+        if entry is None:
+            return delta
+        return {name: (dt, dd, dm) for name, dt, dd, dm in entry['delta']}
+
+    def begin_write(self):
+        """Register a markets write without a journaled delta; returns the id to close it with."""
+        return self.pending.insert_one({'started': time.time()}).inserted_id
+
+    def markets_changed(self, delta, batch_id=None):
+        """
+        Fold `delta` into the rollup after a write to markets and bump the
+        markets version. The rollup is marked as current only if nobody else
+        moved the markets version since it last was; otherwise the next
+        slices() rebuilds it. A batch started with begin_batch is closed.
+        """
+        applied = self.apply_delta(delta, batch_id)
+        version = bump_version(self.markets)
+        self.versions.update_one(
+            {'_id': self.rollup.name, 'markets_version': version - 1}, {'$set': {'markets_version': version}}
+        )
+        if batch_id is not None:
+            self.pending.delete_one({'_id': batch_id})
+            self.rollup.update_many({'batches': batch_id}, {'$pull': {'batches': batch_id}})
+        return applied
+
+    def save_market(self, doc):
+        """Insert or replace a market by its natural key and update the rollup."""
+        write_id = self.begin_write()
+        try:
+            old = self.markets.find_one_and_replace(
+                market_key(doc), doc, projection={'_id': 0, 'results': 1}, upsert=True
+            )
+            return self.markets_changed(results_delta((old or {}).get('results'), doc.get('results')))
+        finally:
+            self.pending.delete_one({'_id': write_id})
+
+    def delete_market(self, key):
+        write_id = self.begin_write()
+        try:
+            old = self.markets.find_one_and_delete(key, projection={'_id': 0, 'results': 1})
+            if old is None:
+                return 0
+            return self.markets_changed(results_delta(old.get('results'), None))
+        finally:
+            self.pending.delete_one({'_id': write_id})
+
+    def slices(self):
+        """Return the rollup in the /api/slices response shape, rebuilding it if markets moved on."""
+        if not is_current(self._state(self.markets), self._state(self.rollup)):
+            self.rebuild()
+        return [to_slice(t) for t in self.rollup.find(LIVE_SLICES).sort('_id', 1)]
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description='Maintain the slice totals rollup.')
+    parser.add_argument('--rebuild', action='store_true', help='recompute the rollup from the markets collection')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = MongoClient(os.environ['MONGO_URI'])[os.environ['DB_NAME']]
+    rollup = SliceRollup(db.markets)
+    if args.rebuild:
+        print(f'Rebuilt {rollup.rebuild()} slices.')
+    for s in rollup.slices():
+        print(f"{s['name']}: {s['deployed']}/{s['total']}")
@@ -53,9 +53,17 @@ export default function Dashboard() {
       .then(res => setSlices(res.data.map(sanitize)))
       .catch(() => setSlices(MOCK_SLICES.map(sanitize)));
 
-    const fetchMarkets = axios.get('http://127.0.0.1:5000/api/markets')
-      .then(res => setMarkets(res.data.map(sanitize)))
-      .catch(() => setMarkets(MOCK_MARKETS.map(sanitize)));
+    // Load markets a page at a time so the table fills in progressively.
+    const fetchMarketPage = after =>
+      axios.get('http://127.0.0.1:5000/api/markets', { params: { limit: 500, after } })
+        .then(res => {
+          setMarkets(prev => (after ? [...prev, ...res.data.map(sanitize)] : res.data.map(sanitize)));
+          const next = res.headers['x-next-after'];
+          return next ? fetchMarketPage(next) : null;
+        });
+
+    const fetchMarkets = fetchMarketPage(undefined)
+      .catch(() => setMarkets(prev => (prev.length ? prev : MOCK_MARKETS.map(sanitize))));
 
     Promise.all([fetchSlices, fetchMarkets]);
 
@@ -0,0 +1,85 @@
+"""
+Step-count aggregation behind table_back's /api/data.
+
+data_pipeline sums the stepsCount/automatedStepsCount answers per version and
+section inside MongoDB; build_result reshapes the small grouped output into the
+response rows.
+"""
+from collections import defaultdict
+
+
+def init_section():
+    """Initialize a dictionary for a section with 'steps' (regular) and 'auto' (automated)."""
+    return {"steps": 0, "auto": 0}
+
+
+# Define section mapping from lowercase to camelCase
+section_mapping = {
+    "healthcheck": "healthCheck",
+    "predeploy": "preDeploy",
+    "deploy": "deploy",
+    "postdeploy": "postDeploy",
+    "precheck": "preCheck",
+    "upgrade": "upgrade",
+    "postcheck": "postCheck",
+    "configaudit": "configAudit",
+    "rollbackautomation": "rollbackAutomation",
+    "assurance": "assurance",
+    "geo": "geo",
+    "disasterrecovery": "disasterRecovery",
+}
+
+# questionId -> count type for the step counters
+count_types = {"stepsCount": "steps", "automatedStepsCount": "auto"}
+
+
+def data_pipeline(query):
+    """
+    Sum the step counters per (version, section, questionId) on the server.
+    Answers that are missing or not convertible to an integer are skipped.
+    """
+    return [
+        {"$match": query},
+        {"$project": {
+            "_id": 0,
+            "version": {"$ifNull": ["$version", "Unknown"]},
+            "section": {"$toLower": {"$ifNull": ["$section_name", ""]}},
+            "questions": 1,
+        }},
+        {"$match": {"section": {"$in": list(section_mapping)}}},
+        {"$unwind": "$questions"},
+        {"$match": {"questions.questionId": {"$in": list(count_types)}}},
+        {"$project": {
+            "version": 1,
+            "section": 1,
+            "questionId": "$questions.questionId",
+            "value": {"$convert": {"input": "$questions.answer", "to": "long", "onError": None, "onNull": None}},
+        }},
+        {"$match": {"value": {"$ne": None}}},
+        {"$group": {
+            "_id": {"version": "$version", "section": "$section", "questionId": "$questionId"},
+            "value": {"$sum": "$value"},
+        }},
+    ]
+
+
+def build_result(groups):
+    """Reshape the grouped sums into one row per version with every section."""
+    # Initialize aggregation structure for each version with all predefined sections
+    aggregated = defaultdict(lambda: {section: init_section() for section in section_mapping.values()})
+    for group in groups:
+        key = group["_id"]
+        agg_section = section_mapping[key["section"]]
+        aggregated[key["version"]][agg_section][count_types[key["questionId"]]] += group["value"]
+
+    # Compute total counts for each version and build the result
+    result = []
+    for version in sorted(aggregated, key=str):
+        sections = aggregated[version]
+        total = {"steps": 0, "auto": 0}
+        for counts in sections.values():
+            total["steps"] += counts["steps"]
+            total["auto"] += counts["auto"]
+
+        result.append({"version": version, "totalSteps": total, **sections})
+    return result
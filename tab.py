@@ -1,33 +1,56 @@
-from flask import Flask, render_template, abort
+from flask import Blueprint, Flask, render_template, abort, jsonify, request, url_for
 import os
-import json
+import threading
 
-app = Flask(__name__)
+from tab_cache import TabCache
+from traffic_graph import DEFAULT_TOP_N, MAX_TOP_N, TrafficGraph
+
+bp = Blueprint('tab', __name__)
 
 # Define the root directory where JSON folders are stored.
 DATA_ROOT = os.path.join(os.path.dirname(__file__), 'json_data')
+# Files larger than this are not parsed for the page; it shows the first
+# PAGE_SIZE items and fetches the rest from /<tab>/data as the user scrolls.
+INLINE_MAX_BYTES = int(os.environ.get('TAB_INLINE_MAX_BYTES', str(5 * 1024 * 1024)))
+# Parsed tab files and rendered pages, revalidated by mtime/size (see tab_cache.py).
+# Only files over INLINE_MAX_BYTES get an offset index.
+cache = TabCache(DATA_ROOT, max_bytes=int(os.environ.get('TAB_CACHE_BYTES', str(512 * 1024 * 1024))),
+                 index_dir=os.environ.get('TAB_INDEX_DIR'), index_min_bytes=INLINE_MAX_BYTES)
+PAGE_SIZE = 100
+MAX_WINDOW = 1000
+# Pre-aggregated producer/consumer traffic (see traffic_graph.py), opened on
+# first use so importing this module does not touch the database.
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_graph():
+    """This process's TrafficGraph, created (and its schema applied) on first call."""
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = TrafficGraph()
+    return _graph
+
+def init_db():
+    """One-time setup (`flask --app server init`): the traffic graph's tables."""
+    get_graph()
 
 def get_tabs():
     """
     Return a list of folder names under DATA_ROOT.
     Each folder is assumed to contain one or more JSON files.
     """
-    return [d for d in os.listdir(DATA_ROOT) if os.path.isdir(os.path.join(DATA_ROOT, d))]
+    return cache.tabs()
 
 def load_json_for_tab(tab_name):
     """
     Load the first JSON file found in the folder corresponding to tab_name.
     """
-    folder_path = os.path.join(DATA_ROOT, tab_name)
-    json_files = [f for f in os.listdir(folder_path) if f.endswith('.json')]
-    if not json_files:
-        return {}
-    file_path = os.path.join(folder_path, json_files[0])
-    with open(file_path, 'r') as file:
-        return json.load(file)
+    return cache.load(tab_name)
 
-@app.route('/')
-@app.route('/<tab>')
+@bp.route('/')
+@bp.route('/<tab>')
 def index(tab=None):
     tabs = get_tabs()
     if not tabs:
@@ -37,12 +60,71 @@ def index(tab=None):
         tab = tabs[0]
     if tab not in tabs:
         abort(404)
-    data = load_json_for_tab(tab)
-    
-    # An array of namespaces. (For now, these are just example values.)
-    namespaces = ["namespace1", "namespace2", "namespace3"]
 
-    return render_template('index.html', data=data, tabs=tabs, current_tab=tab, namespaces=namespaces)
+    # Namespaces found in the tab's data (see tab_index.item_namespace),
+    # else the namespaces of the traffic graph
+    index = cache.index(tab)
+    namespaces = index.namespaces if index and index.namespaces else get_graph().namespaces()
+    page = dict(tabs=tabs, current_tab=tab, namespaces=namespaces,
+                data_url=url_for('.tab_data', tab=tab), page_size=PAGE_SIZE)
+
+    if cache.size(tab) > INLINE_MAX_BYTES:
+        total, items = index.window(0, PAGE_SIZE)
+        data = {item['key']: item['value'] for item in items}
+        return render_template('index.html', data=data, total=total, loaded=len(items), **page)
+
+    # The page only depends on the tab's file and these lists, so it is
+    # rendered once per version of the file.
+    return cache.rendered(
+        tab, ('index.html', tuple(tabs), tuple(namespaces)),
+        lambda data: render_template('index.html', data=data, total=len(index) if index else 0,
+                                     loaded=len(index) if index else 0, **page),
+    )
+
+@bp.route('/<tab>/data')
+def tab_data(tab):
+    """
+    A window of the tab's top-level items as JSON:
+    {total, offset, limit, namespace, items: [{key, value}]}.
+
+    Query parameters: offset (default 0), limit (default PAGE_SIZE, at most
+    MAX_WINDOW) and namespace (only items in that namespace).
+    """
+    if tab not in get_tabs():
+        abort(404)
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', PAGE_SIZE)), MAX_WINDOW))
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    namespace = request.args.get('namespace') or None
+
+    index = cache.index(tab)
+    total, items = index.window(offset, limit, namespace) if index else (0, [])
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'namespace': namespace, 'items': items})
+
+@bp.route('/api/graph')
+def api_graph():
+    """
+    The traffic graph as {nodes, edges, total_edges, namespaces}, heaviest
+    edges first.
+
+    Query parameters: namespace, top_n (default DEFAULT_TOP_N, at most
+    MAX_TOP_N edges) and min_value (drop edges with less traffic). Nodes are
+    only those used by the returned edges.
+    """
+    try:
+        top_n = max(1, min(int(request.args.get('top_n', DEFAULT_TOP_N)), MAX_TOP_N))
+        min_value = request.args.get('min_value')
+        min_value = float(min_value) if min_value not in (None, '') else None
+    except ValueError:
+        return jsonify({'error': 'top_n must be an integer and min_value a number'}), 400
+    graph = get_graph()
+    result = graph.graph(request.args.get('namespace') or None, top_n, min_value)
+    result['namespaces'] = graph.namespaces()
+    return jsonify(result)
 
 if __name__ == '__main__':
+    app = Flask(__name__)
+    app.register_blueprint(bp)
     app.run(debug=True)
@@ -0,0 +1,201 @@
+"""
+In-memory cache of the json_data/ tabs served by tab.py.
+
+    cache = TabCache(DATA_ROOT)
+    cache.tabs()                   # tab folder names
+    cache.load('nf1')              # parsed JSON of the tab's first .json file
+    cache.rendered('nf1', key, render)
+
+The directory index (tab folders, and the JSON file of each tab) is kept in
+memory and rebuilt only when the mtime of the directory it came from changes,
+so a request costs a few stat() calls instead of listing every folder. Parsed
+files are kept in an LRU keyed by path and revalidated against the file's
+mtime and size on every access; anything derived from a file (such as the
+rendered page) is stored with it and dropped when the file changes. The memory
+budget is counted in the estimated in-memory size of the parsed objects
+(sys.getsizeof over the whole tree, a few times the JSON source) plus rendered
+output.
+
+Files larger than `index_min_bytes` are never parsed whole: index() returns
+their offset index (see tab_index.py), of which the last MAX_INDEXES are kept.
+For smaller files index() returns a DataIndex over the cached parsed data.
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from tab_index import DataIndex, load_index
+
+MAX_BYTES = 512 * 1024 * 1024
+INDEX_MIN_BYTES = 5 * 1024 * 1024
+MAX_INDEXES = 32
+
+
+def object_size(obj):
+    """Approximate bytes held by a parsed JSON value: sys.getsizeof of every object in it, each counted once."""
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, list):
+            stack.extend(obj)
+    return size
+
+
+def _index_size(index):
+    # The lists a DataIndex adds; the values themselves belong to the parsed data
+    return sum(sys.getsizeof(x) for x in (index.keys, index.values, index.item_namespaces) if x is not None)
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class _Entry:
+    __slots__ = ('stamp', 'data', 'size', 'rendered')
+
+    def __init__(self, stamp, data, size):
+        self.stamp = stamp
+        self.data = data
+        self.size = size
+        self.rendered = {}
+
+
+class TabCache:
+    def __init__(self, root, max_bytes=MAX_BYTES, index_dir=None, index_min_bytes=INDEX_MIN_BYTES,
+                 max_indexes=MAX_INDEXES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index_dir = index_dir
+        self.index_min_bytes = index_min_bytes
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()  # path -> TabIndex of a large file, least recently used first
+        self._tabs = None          # (root mtime, [tab names])
+        self._files = {}           # tab -> (folder mtime, path of its JSON file or None)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def tabs(self):
+        """Folder names under the root, each one a tab."""
+        mtime = os.stat(self.root).st_mtime_ns
+        cached = self._tabs
+        if cached is None or cached[0] != mtime:
+            names = [d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d))]
+            self._tabs = cached = (mtime, names)
+        return cached[1]
+
+    def tab_file(self, tab):
+        """Path of the first JSON file in a tab's folder, or None."""
+        folder = os.path.join(self.root, tab)
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self._files.get(tab)
+        if cached is None or cached[0] != mtime:
+            json_files = [f for f in os.listdir(folder) if f.endswith('.json')]
+            cached = (mtime, os.path.join(folder, json_files[0]) if json_files else None)
+            self._files[tab] = cached
+        return cached[1]
+
+    def _entry(self, path):
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.stamp == stamp:
+                self._entries.move_to_end(path)
+                return entry
+        with open(path, 'r') as file:
+            data = json.load(file)
+        entry = _Entry(stamp, data, object_size(data))
+        with self._lock:
+            if path in self._entries:
+                self._size -= self._entries.pop(path).size
+            self._entries[path] = entry
+            self._size += entry.size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self._size -= old.size
+
+    def load(self, tab):
+        """Parsed JSON of a tab ({} if the tab has no JSON file). Callers must not modify it."""
+        path = self.tab_file(tab)
+        if path is None:
+            return {}
+        return self._entry(path).data
+
+    def size(self, tab):
+        """Size in bytes of a tab's JSON file (0 if it has none)."""
+        path = self.tab_file(tab)
+        return _stamp(path)[1] if path else 0
+
+    def index(self, tab):
+        """
+        The index of a tab's JSON file (None if it has none): a tab_index.TabIndex,
+        rebuilt when the file changes, for files over index_min_bytes, else a
+        DataIndex over the parsed file.
+        """
+        path = self.tab_file(tab)
+        if path is None:
+            return None
+        stamp = _stamp(path)
+        if stamp[1] <= self.index_min_bytes:
+            return self._derived(path, ('index',), DataIndex, _index_size)
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is not None:
+                self._indexes.move_to_end(path)
+        if index is None or index.stamp != stamp:
+            index = load_index(path, stamp, self.index_dir)
+            with self._lock:
+                self._indexes[path] = index
+                self._indexes.move_to_end(path)
+                while len(self._indexes) > self.max_indexes:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def rendered(self, tab, key, render):
+        """
+        Return render(data) for a tab, computed once per version of its file.
+        `key` identifies everything else the output depends on.
+        """
+        path = self.tab_file(tab)
+        if path is None:
+            return render({})
+        return self._derived(path, key, render, sys.getsizeof)
+
+    def _derived(self, path, key, build, size):
+        # build(data) stored with the file's entry, counted as size(output) bytes
+        entry = self._entry(path)
+        output = entry.rendered.get(key)
+        if output is None:
+            output = build(entry.data)
+            nbytes = size(output)
+            with self._lock:
+                entry.rendered[key] = output
+                if self._entries.get(path) is entry:
+                    entry.size += nbytes
+                    self._size += nbytes
+                    self._evict()
+        return output
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        self._tabs = None
+        self._files = {}
+        self._indexes = OrderedDict()
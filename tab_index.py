@@ -0,0 +1,202 @@
+"""
+Offset index over the top-level items of a large tab JSON file.
+
+build_index() walks the file once with json.JSONDecoder.raw_decode and records
+the byte range of every element of the top-level array, or of every member
+value of the top-level object together with its key, plus the namespace of
+each item. TabIndex.window() then serves any slice by memory-mapping the file
+and decoding only the byte ranges it returns, so a 200 MB dump is never parsed
+as a whole per request.
+
+An item's namespace is its `namespace` or `metadata.namespace` field; the
+namespaces list offered by tab.py is the set found in the file. Indexes can be
+persisted next to a cache directory (TAB_INDEX_DIR) so they survive restarts.
+Files small enough to be parsed whole use DataIndex, the same interface over
+the parsed document.
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from array import array
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+def item_namespace(value):
+    if isinstance(value, dict):
+        ns = value.get('namespace')
+        if ns is None and isinstance(value.get('metadata'), dict):
+            ns = value['metadata'].get('namespace')
+        if isinstance(ns, str):
+            return ns
+    return None
+
+
+def _skip(text, pos):
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+class _ByteOffsets:
+    # Converts increasing character offsets of the decoded text to byte offsets
+    def __init__(self, text):
+        self.text = text
+        self.ascii = text.isascii()
+        self.char = 0
+        self.byte = 0
+
+    def __call__(self, pos):
+        if self.ascii:
+            return pos
+        self.byte += len(self.text[self.char:pos].encode('utf-8'))
+        self.char = pos
+        return self.byte
+
+
+class _Items:
+    """Namespace lookup and windowing shared by TabIndex and DataIndex."""
+
+    def _group(self, namespaces):
+        self.item_namespaces = namespaces
+        self.by_namespace = {}
+        for i, ns in enumerate(namespaces):
+            if ns is not None:
+                self.by_namespace.setdefault(ns, array('q')).append(i)
+
+    @property
+    def namespaces(self):
+        return sorted(self.by_namespace)
+
+    def window(self, offset=0, limit=100, namespace=None):
+        """
+        Return (total, items) for items [offset, offset + limit) of the file, or
+        of the items in `namespace`. Items are {"key", "value"}; the key of an
+        array element is its index.
+        """
+        positions = self.by_namespace.get(namespace, array('q')) if namespace else range(len(self))
+        total = len(positions)
+        selected = positions[offset:offset + limit]
+        if not len(selected):
+            return total, []
+        return total, [{'key': self.keys[i] if self.keys is not None else i, 'value': value}
+                       for i, value in zip(selected, self._values(selected))]
+
+
+class TabIndex(_Items):
+    def __init__(self, path, stamp, kind, offsets, keys, namespaces):
+        self.path = path
+        self.stamp = stamp
+        self.kind = kind                # 'array', 'object' or 'value'
+        self.offsets = offsets          # array('q') of start, end byte offsets
+        self.keys = keys                # member keys of an object, else None
+        self._group(namespaces)
+
+    def __len__(self):
+        return len(self.offsets) // 2
+
+    def _values(self, selected):
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [json.loads(mm[self.offsets[2 * i]:self.offsets[2 * i + 1]]) for i in selected]
+
+    def to_json(self):
+        return {'stamp': list(self.stamp), 'kind': self.kind, 'offsets': self.offsets.tolist(),
+                'keys': self.keys, 'namespaces': self.item_namespaces}
+
+    @classmethod
+    def from_json(cls, path, doc):
+        return cls(path, tuple(doc['stamp']), doc['kind'], array('q', doc['offsets']), doc['keys'], doc['namespaces'])
+
+
+class DataIndex(_Items):
+    """The TabIndex interface over an already parsed document, for files small enough to parse whole."""
+
+    def __init__(self, data):
+        if isinstance(data, list):
+            self.kind, self.keys, self.values = 'array', None, data
+        elif isinstance(data, dict):
+            self.kind, self.keys, self.values = 'object', list(data), list(data.values())
+        else:
+            self.kind, self.keys, self.values = 'value', None, [data]
+        self._group([item_namespace(value) for value in self.values])
+
+    def __len__(self):
+        return len(self.values)
+
+    def _values(self, selected):
+        return [self.values[i] for i in selected]
+
+
+def build_index(path, stamp):
+    with open(path, 'rb') as f:
+        text = f.read().decode('utf-8')
+    to_byte = _ByteOffsets(text)
+    offsets = array('q')
+    keys = None
+    namespaces = []
+
+    pos = _skip(text, 0)
+    if pos < len(text) and text[pos] == '[':
+        kind = 'array'
+        pos = _skip(text, pos + 1)
+        while pos < len(text) and text[pos] != ']':
+            value, end = _decoder.raw_decode(text, pos)
+            offsets.extend((to_byte(pos), to_byte(end)))
+            namespaces.append(item_namespace(value))
+            pos = _skip(text, end)
+            if pos < len(text) and text[pos] == ',':
+                pos = _skip(text, pos + 1)
+    elif pos < len(text) and text[pos] == '{':
+        kind = 'object'
+        keys = []
+        pos = _skip(text, pos + 1)
+        while pos < len(text) and text[pos] != '}':
+            key, end = _decoder.raw_decode(text, pos)
+            pos = _skip(text, end)
+            if text[pos] != ':':
+                raise ValueError(f'{path}: expected ":" at character {pos}')
+            pos = _skip(text, pos + 1)
+            value, end = _decoder.raw_decode(text, pos)
+            keys.append(key)
+            offsets.extend((to_byte(pos), to_byte(end)))
+            namespaces.append(item_namespace(value))
+            pos = _skip(text, end)
+            if pos < len(text) and text[pos] == ',':
+                pos = _skip(text, pos + 1)
+    else:
+        # A scalar document: one item holding the whole file
+        kind = 'value'
+        value, end = _decoder.raw_decode(text, pos)
+        offsets.extend((to_byte(pos), to_byte(end)))
+        namespaces.append(item_namespace(value))
+    return TabIndex(path, stamp, kind, offsets, keys, namespaces)
+
+
+def load_index(path, stamp, directory=None):
+    """Return the index of `path` at `stamp`, from `directory` when it was built before."""
+    if not directory:
+        return build_index(path, stamp)
+    name = hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.json'
+    saved = os.path.join(directory, name)
+    try:
+        with open(saved) as f:
+            doc = json.load(f)
+        if tuple(doc['stamp']) == tuple(stamp):
+            return TabIndex.from_json(path, doc)
+    except (OSError, ValueError, KeyError):
+        pass
+    index = build_index(path, stamp)
+    os.makedirs(directory, exist_ok=True)
+    # A unique temp name per writer: threads of one worker may build the same index at once
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=f'{name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index.to_json(), f)
+        os.replace(tmp, saved)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return index
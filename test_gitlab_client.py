@@ -0,0 +1,141 @@
+"""
+gitlab_client.py against a stub GitLab files API served from a thread.
+
+    python -m pytest test_gitlab_client.py
+"""
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+
+from gitlab_client import AsyncGitLabClient, BlobCache, GitLabClient
+
+FILES = {
+    ('main', 'app.yaml'): b'port: 80\nworkers: 2\n',
+    ('dev', 'app.yaml'): b'port: 8080\nworkers: 2\n',
+}
+BLOBS = {hashlib.sha1(data).hexdigest(): data for data in FILES.values()}
+
+
+def sha(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class StubGitLab(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        url = urlparse(self.path)
+        self.server.hits.append(('HEAD', url.path))
+        key = (parse_qs(url.query)['ref'][0], unquote(url.path.rsplit('/', 1)[-1]))
+        if key not in FILES:
+            return self._send(404)
+        self._send(200, headers=[('X-Gitlab-Blob-Id', sha(FILES[key]))])
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.server.hits.append(('GET', url.path))
+        parts = url.path.split('/')
+        if parts[-3] == 'blobs' and parts[-2] in BLOBS:
+            return self._send(200, BLOBS[parts[-2]])
+        self._send(404)
+
+
+@pytest.fixture
+def gitlab():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubGitLab)
+    server.hits = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def base_url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/api/v4'
+
+
+def blob_downloads(server):
+    return [path for method, path in server.hits if method == 'GET' and '/blobs/' in path]
+
+
+def test_file_pair_downloads_each_blob_once(gitlab, tmp_path):
+    client = GitLabClient(base_url(gitlab), 'token', 7, cache=BlobCache(directory=str(tmp_path)))
+
+    (sha1, lines1), (sha2, lines2) = client.file_pair('main', 'dev', 'app.yaml')
+    assert lines1 == ['port: 80', 'workers: 2'] and lines2 == ['port: 8080', 'workers: 2']
+    assert client.file_pair('main', 'dev', 'app.yaml') == ((sha1, lines1), (sha2, lines2))
+    assert len(blob_downloads(gitlab)) == 2
+
+    # A new client (another worker) reads the blobs from the shared directory
+    other = GitLabClient(base_url(gitlab), 'token', 7, cache=BlobCache(directory=str(tmp_path)))
+    assert other.file_pair('main', 'dev', 'app.yaml') == ((sha1, lines1), (sha2, lines2))
+    assert len(blob_downloads(gitlab)) == 2
+    assert client.file('main', 'missing.txt') == (None, '')
+
+
+def test_async_client_shares_the_cache(gitlab, tmp_path):
+    cache = BlobCache(directory=str(tmp_path))
+
+    async def run():
+        client = AsyncGitLabClient(base_url(gitlab), 'token', 7, cache=cache)
+        try:
+            first = await client.file_pair('main', 'dev', 'app.yaml')
+            downloads = len(blob_downloads(gitlab))
+            second = await client.file_pair('main', 'dev', 'app.yaml')
+        finally:
+            await client.close()
+        return first, second, downloads
+
+    first, second, downloads = asyncio.run(run())
+    assert first == second and first[0] == (sha(FILES['main', 'app.yaml']), ['port: 80', 'workers: 2'])
+    assert downloads == len(blob_downloads(gitlab)) == 2
+
+
+def _put_many(directory, data, count):
+    cache = BlobCache(directory=directory)
+    for _ in range(count):
+        cache.put(sha(data), data)
+
+
+def test_forked_workers_write_the_same_blob(tmp_path):
+    data = b'x' * 100000
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_put_many, args=(str(tmp_path), data, 50)) for _ in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    assert [p.exitcode for p in workers] == [0, 0, 0, 0]
+    assert os.listdir(tmp_path) == [sha(data)]
+    assert BlobCache(directory=str(tmp_path)).get(sha(data)) == data
+
+
+def test_disk_cache_scans_only_when_over_the_limit(tmp_path):
+    cache = BlobCache(directory=str(tmp_path), disk_bytes=10000)
+    scans = []
+    prune = cache._prune_disk
+    cache._prune_disk = lambda: scans.append(1) or prune()
+
+    for i in range(100):
+        cache.put(sha(str(i).encode()), b'%03d' % i * 100)  # 300 bytes each
+    total = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert total <= 10000
+    # One scan on the first put, then one each time ~10% of the limit was written
+    assert len(scans) < 30
+    assert cache.get(sha(b'99')) is not None
@@ -0,0 +1,154 @@
+"""
+ingest.py against mongomock: the slice rollup stays equal to a full
+aggregation when a markets batch is replayed after a crash.
+
+    python -m pytest test_ingest.py
+"""
+import threading
+
+import mongomock
+import pytest
+
+import ingest
+from slice_rollup import LIVE_SLICES, SliceRollup
+
+CSV = '''Name,marketId,nf,results,results,results,results
+,,,s1,s1,s2,s2
+,,,total,deployed,total,deployed
+m1,1,a,3,1,4,0
+m2,2,a,5,2,,
+m3,3,b,1,1,1,1
+m4,4,b,2,0,7,3
+'''
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def markets():
+    return mongomock.MongoClient().slices.markets
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / 'markets.csv'
+    path.write_text(CSV)
+    return str(path)
+
+
+def totals(rollup):
+    # The stored totals as they are; slices() could rebuild them and hide a lost delta
+    return {t['_id']: (t['total'], t['deployed']) for t in rollup.rollup.find(LIVE_SLICES)}
+
+
+def expected(rollup):
+    return {t['_id']: (t['total'], t['deployed']) for t in rollup.aggregate()}
+
+
+def market(market_id, total):
+    return {'marketId': market_id, 'nf': 'a', 'marketName': f'm{market_id}',
+            'results': {'s1': {'total': total, 'deployed': 1}}}
+
+
+def crash_on(obj, name, calls=1):
+    """Make obj.<name> raise Crash on its first `calls` calls, then behave normally."""
+    original = getattr(obj, name)
+    remaining = [calls]
+
+    def wrapper(*args, **kwargs):
+        if remaining[0]:
+            remaining[0] -= 1
+            raise Crash(name)
+        return original(*args, **kwargs)
+    setattr(obj, name, wrapper)
+
+
+def test_replay_after_markets_written(markets):
+    rollup = SliceRollup(markets)
+    key = ingest.TARGETS['markets']['key']
+    ingest.write_batch(markets, [market(1, 3)], key, rollup, 'run:0')
+
+    # The batch's markets are written, then the process dies before the rollup is updated
+    crash_on(rollup, 'apply_delta')
+    with pytest.raises(Crash):
+        ingest.write_batch(markets, [market(1, 10), market(2, 5)], key, rollup, 'run:1')
+    ingest.write_batch(markets, [market(1, 10), market(2, 5)], key, rollup, 'run:1')
+
+    assert totals(rollup) == expected(rollup) == {'s1': (15, 2)}
+    assert rollup.pending.count_documents({}) == 0
+
+
+def test_replay_after_rollup_updated(markets):
+    rollup = SliceRollup(markets)
+    key = ingest.TARGETS['markets']['key']
+
+    # The delta is applied but the journal entry is not closed
+    crash_on(rollup.pending, 'delete_one')
+    with pytest.raises(Crash):
+        ingest.write_batch(markets, [market(1, 3), market(2, 4)], key, rollup, 'run:0')
+    ingest.write_batch(markets, [market(1, 3), market(2, 4)], key, rollup, 'run:0')
+
+    assert totals(rollup) == expected(rollup) == {'s1': (7, 2)}
+    assert rollup.rollup.count_documents({'batches': {'$exists': True, '$ne': []}}) == 0
+
+
+def test_resume_from_checkpoint(markets, export, tmp_path):
+    checkpoint = ingest.Checkpoint(str(tmp_path / 'checkpoint'), export, 'markets')
+    rollup = SliceRollup(markets)
+    # Second batch: markets written, rollup not
+    original = SliceRollup.apply_delta
+    seen = []
+
+    def apply_delta(self, delta, batch_id=None):
+        seen.append(batch_id)
+        if len(seen) == 2:
+            raise Crash('apply_delta')
+        return original(self, delta, batch_id)
+
+    SliceRollup.apply_delta = apply_delta
+    try:
+        with pytest.raises(Crash):
+            ingest.ingest(markets, export, batch_size=2, writers=1, checkpoint=checkpoint)
+        assert checkpoint.load() == 2
+        stats = ingest.ingest(markets, export, batch_size=2, writers=1, checkpoint=checkpoint)
+    finally:
+        SliceRollup.apply_delta = original
+
+    assert stats['skipped'] == 2 and stats['rows'] == 2
+    assert totals(rollup) == expected(rollup) == {'s1': (11, 4), 's2': (12, 4)}
+
+
+def test_unreplayed_journal_rebuilds(markets, export, tmp_path):
+    rollup = SliceRollup(markets)
+    run = ingest.run_id(export, 'markets')
+    # Left behind by an earlier run with another batch size; its delta must not be applied
+    rollup.pending.insert_one({'_id': f'{run}:3', 'delta': [['s1', 100, 100, 1]]})
+
+    ingest.ingest(markets, export, batch_size=2, writers=1)
+
+    assert totals(rollup) == expected(rollup)
+    assert rollup.pending.count_documents({}) == 0
+
+
+def test_parallel_writers_rebuild(markets, tmp_path):
+    # The same market in every batch: concurrent batches may each count its old results
+    path = tmp_path / 'repeated.csv'
+    path.write_text(CSV.split('m1,')[0] + ''.join(f'm1,1,a,{n},1,,\n' for n in range(1, 9)))
+    # Every batch reads the old results before any of them writes
+    barrier = threading.Barrier(4, timeout=5)
+    bulk_write = markets.bulk_write
+
+    def wait_then_write(*args, **kwargs):
+        barrier.wait()
+        return bulk_write(*args, **kwargs)
+    markets.bulk_write = wait_then_write
+
+    ingest.ingest(markets, str(path), batch_size=1, writers=4)
+
+    rollup = SliceRollup(markets)
+    # Whichever batch wrote last holds the market; the totals must match it
+    stored = markets.find_one({'marketId': 1})['results']['s1']
+    assert totals(rollup) == expected(rollup)
+    assert totals(rollup)['s1'] == (stored['total'], 1)
@@ -0,0 +1,368 @@
+"""
+Line diffs for the /api/diff endpoints.
+
+diff_lines() trims the common prefix and suffix, replaces every line with an
+integer id and runs Myers' O((N+M)D) algorithm on what is left, so a small
+change in a large file costs time proportional to the file plus the size of the
+change, not the product of the two lengths as difflib.HtmlDiff can. The result
+is grouped into hunks with `context` unchanged lines around each change.
+
+Inputs over MAX_LINES / MAX_BYTES, and diffs that need more than MAX_EDITS
+edits or run past their deadline, raise DiffTooLarge; callers report a summary
+instead of holding a worker.
+
+render_diff() and tree_file_result() build the /api/diff and /api/diff/tree
+responses for a file pair. They, the request argument checks (diff_args,
+tree_args) and the NDJSON lines of /api/diff/tree are shared by gitdff.py and
+async_app.py.
+"""
+import difflib
+import html
+import json
+import time
+
+MAX_LINES = 200000
+MAX_BYTES = 20 * 1024 * 1024
+MAX_EDITS = 3000
+TIMEOUT = 5.0
+DEFAULT_CONTEXT = 3
+FORMATS = ('html', 'unified', 'json')
+TREE_FORMATS = ('hunks', 'stats')
+MAX_CONTEXT = 1000
+MAX_TREE_FILES = 500   # files diffed per /api/diff/tree request; the rest are listed without a diff
+# difflib.HtmlDiff has no deadline and compares every removed line with every
+# added line of a changed block (100 against 100 takes ~2 s), so it is only
+# used below these limits; other diffs get the compact table
+HTML_DIFF_MAX_LINES = 5000
+HTML_DIFF_MAX_PAIRS = 2500   # sum of removed x added lines over the changed blocks
+
+
+class DiffTooLarge(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def check_size(a, b):
+    """Raise DiffTooLarge if the inputs are over the size limits."""
+    if len(a) + len(b) > MAX_LINES:
+        raise DiffTooLarge('too_many_lines')
+    if sum(map(len, a)) + sum(map(len, b)) > MAX_BYTES:
+        raise DiffTooLarge('too_many_bytes')
+
+
+def _myers(a, b, deadline, max_edits):
+    # Shortest edit script between two sequences of ints; returns [(tag, i, j)]
+    # with tag in '=-+' from the start of both sequences.
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        if d > max_edits:
+            raise DiffTooLarge('too_many_changes')
+        if d % 64 == 0 and time.monotonic() > deadline:
+            raise DiffTooLarge('timeout')
+        trace.append(v.copy())
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+    return []
+
+
+def _backtrack(trace, x, y):
+    script = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v.get(k - 1, -1) < v.get(k + 1, -1)):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            script.append(('=', x, y))
+        if d > 0:
+            script.append(('+', prev_x, prev_y) if x == prev_x else ('-', prev_x, prev_y))
+        x, y = prev_x, prev_y
+    script.reverse()
+    return script
+
+
+def _line_ids(a, b):
+    ids = {}
+    return [ids.setdefault(line, len(ids)) for line in a], [ids.setdefault(line, len(ids)) for line in b]
+
+
+def opcodes(a, b, timeout=TIMEOUT, max_edits=None):
+    """Return difflib-style opcodes (tag, i1, i2, j1, j2) for two lists of lines."""
+    n, m = len(a), len(b)
+    start = 0
+    while start < n and start < m and a[start] == b[start]:
+        start += 1
+    end_a, end_b = n, m
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+
+    if start == end_a or start == end_b:
+        # Pure insertion or deletion: nothing left to align
+        script = [('-', x, 0) for x in range(end_a - start)] + [('+', end_a - start, y) for y in range(end_b - start)]
+    else:
+        script = _myers(*_line_ids(a[start:end_a], b[start:end_b]), time.monotonic() + timeout,
+                        MAX_EDITS if max_edits is None else max_edits)
+
+    codes = []
+    if start:
+        codes.append(('equal', 0, start, 0, start))
+    block = None  # [i1, i2, j1, j2] of the current run of changes
+    for tag, x, y in script:
+        x += start
+        y += start
+        if tag != '=':
+            if block is None:
+                block = [x, x, y, y]
+            if tag == '-':
+                block[1] = x + 1
+            else:
+                block[3] = y + 1
+            continue
+        if block:
+            codes.append((_change_tag(block), *block))
+            block = None
+        if codes and codes[-1][0] == 'equal' and codes[-1][2] == x:
+            codes[-1] = ('equal', codes[-1][1], x + 1, codes[-1][3], y + 1)
+        else:
+            codes.append(('equal', x, x + 1, y, y + 1))
+    if block:
+        codes.append((_change_tag(block), *block))
+    if end_a < n:
+        if codes and codes[-1][0] == 'equal' and codes[-1][2] == end_a:
+            codes[-1] = ('equal', codes[-1][1], n, codes[-1][3], m)
+        else:
+            codes.append(('equal', end_a, n, end_b, m))
+    return codes
+
+
+def _change_tag(block):
+    i1, i2, j1, j2 = block
+    if i1 == i2:
+        return 'insert'
+    return 'delete' if j1 == j2 else 'replace'
+
+
+def _grouped(codes, n):
+    # difflib.SequenceMatcher.get_grouped_opcodes over precomputed opcodes
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    codes = list(codes)
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > n + n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def diff_lines(a, b, context=DEFAULT_CONTEXT, timeout=TIMEOUT, codes=None):
+    """
+    Return (hunks, stats) for two lists of lines. Each hunk is
+    {old_start, old_lines, new_start, new_lines, lines: [[op, text], ...]}
+    with op ' ', '-' or '+'; stats is {added, removed}. `codes` are the
+    opcodes() of a and b if already computed.
+    """
+    if codes is None:
+        check_size(a, b)
+        codes = opcodes(a, b, timeout)
+    hunks = []
+    stats = {'added': 0, 'removed': 0}
+    for group in _grouped(codes, context):
+        i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+        lines = []
+        for tag, g1, g2, h1, h2 in group:
+            if tag == 'equal':
+                lines.extend([' ', line] for line in a[g1:g2])
+                continue
+            lines.extend(['-', line] for line in a[g1:g2])
+            lines.extend(['+', line] for line in b[h1:h2])
+            stats['removed'] += g2 - g1
+            stats['added'] += h2 - h1
+        hunks.append({
+            'old_start': i1 + 1 if i2 > i1 else i1, 'old_lines': i2 - i1,
+            'new_start': j1 + 1 if j2 > j1 else j1, 'new_lines': j2 - j1,
+            'lines': lines,
+        })
+    return hunks, stats
+
+
+def _range(start, count):
+    return str(start) if count == 1 else f'{start},{count}'
+
+
+def render_unified(hunks, fromfile, tofile):
+    """Render hunks as a unified diff (the format of `diff -u`)."""
+    if not hunks:
+        return ''
+    out = [f'--- {fromfile}\n', f'+++ {tofile}\n']
+    for hunk in hunks:
+        out.append(f"@@ -{_range(hunk['old_start'], hunk['old_lines'])} "
+                   f"+{_range(hunk['new_start'], hunk['new_lines'])} @@\n")
+        out.extend(op + text + '\n' for op, text in hunk['lines'])
+    return ''.join(out)
+
+
+def render_html(hunks, fromdesc, todesc):
+    """A compact HTML table of the hunks, for diffs too large or too slow for difflib.HtmlDiff."""
+    rows = []
+    for hunk in hunks:
+        rows.append(f"<tr class=\"hunk\"><td colspan=\"3\">@@ -{_range(hunk['old_start'], hunk['old_lines'])} "
+                    f"+{_range(hunk['new_start'], hunk['new_lines'])} @@</td></tr>")
+        old, new = hunk['old_start'] or 1, hunk['new_start'] or 1
+        for op, text in hunk['lines']:
+            cls = {' ': 'ctx', '-': 'del', '+': 'add'}[op]
+            rows.append(f'<tr class="{cls}"><td>{old if op != "+" else ""}</td>'
+                        f'<td>{new if op != "-" else ""}</td><td><pre>{op}{html.escape(text)}</pre></td></tr>')
+            old += op != '+'
+            new += op != '-'
+    return ('<table class="diff"><thead><tr><th colspan="3">'
+            f'{html.escape(fromdesc)} &rarr; {html.escape(todesc)}</th></tr></thead>'
+            f'<tbody>{"".join(rows)}</tbody></table>')
+
+
+def html_diff_pairs(codes):
+    """The line pairs difflib.HtmlDiff compares for a diff with these opcodes."""
+    return sum((i2 - i1) * (j2 - j1) for tag, i1, i2, j1, j2 in codes if tag == 'replace')
+
+
+def render_diff(fmt, lines1, lines2, fromdesc, todesc, context):
+    """
+    Return (body, mimetype, cacheable) for one file pair. Diffs over the size
+    or time limits are answered with a summary instead.
+    """
+    try:
+        check_size(lines1, lines2)
+        codes = opcodes(lines1, lines2)
+        if (fmt == 'html' and len(lines1) + len(lines2) <= HTML_DIFF_MAX_LINES
+                and html_diff_pairs(codes) <= HTML_DIFF_MAX_PAIRS):
+            # Generate an HTML diff using Python's difflib.HtmlDiff
+            body = difflib.HtmlDiff(wrapcolumn=80).make_file(
+                lines1, lines2, fromdesc=fromdesc, todesc=todesc,
+                context=context is not None, numlines=context if context is not None else 5
+            )
+            return body, 'text/html', True
+        hunks, stats = diff_lines(lines1, lines2, DEFAULT_CONTEXT if context is None else context, codes=codes)
+        summary = None
+    except DiffTooLarge as e:
+        hunks, stats, summary = [], None, e.reason
+    cacheable = summary != 'timeout'
+
+    if fmt == 'json':
+        return json.dumps({
+            'from': fromdesc, 'to': todesc,
+            'old_lines': len(lines1), 'new_lines': len(lines2),
+            'summary': summary, 'stats': stats, 'hunks': hunks,
+        }), 'application/json', cacheable
+    if summary:
+        text = f'{fromdesc} and {todesc} differ; diff not shown ({summary}: {len(lines1)} -> {len(lines2)} lines)'
+        return (html.escape(text) if fmt == 'html' else text + '\n'), \
+            ('text/html' if fmt == 'html' else 'text/plain'), cacheable
+    if fmt == 'unified':
+        return render_unified(hunks, fromdesc, todesc), 'text/plain', cacheable
+    return render_html(hunks, fromdesc, todesc), 'text/html', cacheable
+
+
+def file_status(old, new):
+    return 'added' if old is None else 'deleted' if new is None else 'modified'
+
+
+def tree_file_result(lines1, lines2, fmt, context):
+    """Return ({summary, stats[, hunks]}, cacheable) for one changed file of a directory diff."""
+    try:
+        hunks, stats = diff_lines(lines1, lines2, context)
+    except DiffTooLarge as e:
+        return {'summary': e.reason, 'stats': None}, e.reason != 'timeout'
+    result = {'summary': None, 'stats': stats}
+    if fmt == 'hunks':
+        result['hunks'] = hunks
+    return result, True
+
+
+def _branches(args):
+    branch1, branch2 = args.get('branch1'), args.get('branch2')
+    if not branch1 or not branch2:
+        raise ValueError('Please provide both branch1 and branch2 as query parameters.')
+    return branch1, branch2
+
+
+def diff_args(args, default_path):
+    """(branch1, branch2, file_path, fmt, context) of an /api/diff request; ValueError holds the 400 message."""
+    branch1, branch2 = _branches(args)
+    fmt = args.get('format', 'html')
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    try:
+        context = int(args['context']) if args.get('context') else None
+    except ValueError:
+        raise ValueError('context must be an integer')
+    if context is not None:
+        context = max(0, min(context, MAX_CONTEXT))
+    return branch1, branch2, args.get('file_path', default_path), fmt, context
+
+
+def tree_args(args):
+    """(branch1, branch2, path, fmt, context) of an /api/diff/tree request; ValueError holds the 400 message."""
+    branch1, branch2 = _branches(args)
+    fmt = args.get('format', 'hunks')
+    if fmt not in TREE_FORMATS:
+        raise ValueError('format must be hunks or stats')
+    try:
+        context = max(0, min(int(args.get('context', DEFAULT_CONTEXT)), MAX_CONTEXT))
+    except ValueError:
+        raise ValueError('context must be an integer')
+    return branch1, branch2, args.get('path', '').strip('/'), fmt, context
+
+
+def changed_paths(files1, files2):
+    """Sorted paths whose blob differs between two {path: sha} tree listings."""
+    return sorted(p for p in set(files1) | set(files2) if files1.get(p) != files2.get(p))
+
+
+def tree_file_head(path, old, new):
+    return {'path': path, 'status': file_status(old, new), 'old_blob': old, 'new_blob': new}
+
+
+def tree_file_line(head, body):
+    """One /api/diff/tree line: the file's head merged with its (cached) JSON-encoded result."""
+    return json.dumps(head)[:-1] + ', ' + body.decode()[1:] + '\n'
+
+
+def tree_error_line(head, error):
+    return json.dumps({**head, 'error': str(error)}) + '\n'
+
+
+def tree_tail_lines(changed, files1, files2):
+    """The lines after the diffed files: those over MAX_TREE_FILES, then the `done` line."""
+    for p in changed[MAX_TREE_FILES:]:
+        yield json.dumps({**tree_file_head(p, files1.get(p), files2.get(p)), 'summary': 'too_many_files'}) + '\n'
+    yield json.dumps({'done': True, 'files': len(changed)}) + '\n'
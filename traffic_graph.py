@@ -0,0 +1,162 @@
+"""
+Namespace traffic graph materialized from the q.sql queries.
+
+Raw rows (namespace, producer, consumer, traffic) are appended to `traffic`.
+refresh() folds rows added since the last refresh into two pre-aggregated
+tables, so the graph is never rebuilt from the raw rows:
+
+  - edges: SUM(traffic) per (namespace, producer, consumer), source/target ids
+    as in q.sql (namespace || '_' || name)
+  - nodes: the UNION of producers and consumers per namespace
+
+graph() serves the heaviest edges first, optionally filtered by namespace and
+minimum value and cut to `top_n`, together with the nodes those edges use.
+
+    python traffic_graph.py load traffic.csv      # namespace,producer,consumer,traffic
+    python traffic_graph.py refresh
+    python traffic_graph.py rebuild               # recompute both tables from traffic
+"""
+import argparse
+import csv
+import os
+import sqlite3
+from contextlib import closing
+
+DB_PATH = os.environ.get('TRAFFIC_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'traffic.db'))
+DEFAULT_TOP_N = 200
+MAX_TOP_N = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic (
+    namespace TEXT NOT NULL, producer TEXT NOT NULL, consumer TEXT NOT NULL, traffic REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS edges (
+    namespace TEXT NOT NULL, producer TEXT NOT NULL, consumer TEXT NOT NULL,
+    source TEXT NOT NULL, target TEXT NOT NULL, value REAL NOT NULL,
+    PRIMARY KEY (namespace, producer, consumer)
+);
+CREATE INDEX IF NOT EXISTS edges_by_value ON edges (value DESC);
+CREATE INDEX IF NOT EXISTS edges_by_namespace_value ON edges (namespace, value DESC);
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT NOT NULL, namespace TEXT NOT NULL, label TEXT NOT NULL, type TEXT NOT NULL,
+    PRIMARY KEY (id, type)
+);
+CREATE TABLE IF NOT EXISTS graph_state (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+# Aggregate the raw rows after the last refreshed rowid (?1) up to ?2.
+EDGES_UPSERT = """
+INSERT INTO edges (namespace, producer, consumer, source, target, value)
+SELECT namespace, producer, consumer,
+       namespace || '_' || producer, namespace || '_' || consumer, SUM(traffic)
+FROM traffic WHERE rowid > ?1 AND rowid <= ?2
+GROUP BY namespace, producer, consumer
+ON CONFLICT (namespace, producer, consumer) DO UPDATE SET value = value + excluded.value
+"""
+NODES_INSERT = """
+INSERT OR IGNORE INTO nodes (id, namespace, label, type)
+SELECT namespace || '_' || producer, namespace, producer, 'producer' FROM traffic WHERE rowid > ?1 AND rowid <= ?2
+UNION
+SELECT namespace || '_' || consumer, namespace, consumer, 'consumer' FROM traffic WHERE rowid > ?1 AND rowid <= ?2
+"""
+
+
+class TrafficGraph:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def add_traffic(self, rows, refresh=True):
+        """Append (namespace, producer, consumer, traffic) rows and, by default, fold them in."""
+        with closing(self._connect()) as db, db:
+            db.executemany('INSERT INTO traffic (namespace, producer, consumer, traffic) VALUES (?, ?, ?, ?)', rows)
+        return self.refresh() if refresh else 0
+
+    def refresh(self):
+        """Fold traffic rows added since the last refresh into edges and nodes. Returns the rows folded."""
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')  # One refresher at a time
+            row = db.execute("SELECT value FROM graph_state WHERE key = 'last_rowid'").fetchone()
+            last = row['value'] if row else 0
+            newest = db.execute('SELECT COALESCE(MAX(rowid), 0) FROM traffic').fetchone()[0]
+            if newest <= last:
+                return 0
+            db.execute(EDGES_UPSERT, (last, newest))
+            db.execute(NODES_INSERT, (last, newest))
+            db.execute("INSERT INTO graph_state (key, value) VALUES ('last_rowid', ?) "
+                       "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (newest,))
+            return db.execute('SELECT COUNT(*) FROM traffic WHERE rowid > ? AND rowid <= ?', (last, newest)).fetchone()[0]
+
+    def rebuild(self):
+        """Recompute edges and nodes from every traffic row."""
+        with closing(self._connect()) as db, db:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('DELETE FROM edges')
+            db.execute('DELETE FROM nodes')
+            db.execute("DELETE FROM graph_state WHERE key = 'last_rowid'")
+        return self.refresh()
+
+    def namespaces(self):
+        with closing(self._connect()) as db:
+            return [r['namespace'] for r in db.execute('SELECT DISTINCT namespace FROM nodes ORDER BY namespace')]
+
+    def graph(self, namespace=None, top_n=DEFAULT_TOP_N, min_value=None):
+        """
+        Return {nodes, edges, total_edges} with the `top_n` heaviest edges
+        matching the filters; total_edges counts all matching edges.
+        """
+        where, params = [], []
+        if namespace:
+            where.append('namespace = ?')
+            params.append(namespace)
+        if min_value is not None:
+            where.append('value >= ?')
+            params.append(min_value)
+        clause = f"WHERE {' AND '.join(where)}" if where else ''
+        with closing(self._connect()) as db:
+            total = db.execute(f'SELECT COUNT(*) FROM edges {clause}', params).fetchone()[0]
+            edges = [
+                {'source': r['source'], 'target': r['target'], 'value': r['value']}
+                for r in db.execute(f'SELECT source, target, value FROM edges {clause} '
+                                    'ORDER BY value DESC LIMIT ?', params + [top_n])
+            ]
+            sources = {e['source'] for e in edges}
+            targets = {e['target'] for e in edges}
+            nodes = []
+            ids = sorted(sources | targets)
+            for start in range(0, len(ids), 500):  # Stay under SQLite's parameter limit
+                chunk = ids[start:start + 500]
+                for r in db.execute(f"SELECT id, label, type FROM nodes WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                    if (r['type'] == 'producer' and r['id'] in sources) or (r['type'] == 'consumer' and r['id'] in targets):
+                        nodes.append({'id': r['id'], 'label': r['label'], 'type': r['type']})
+        return {'nodes': nodes, 'edges': edges, 'total_edges': total}
+
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row['namespace'], row['producer'], row['consumer'], float(row['traffic'] or 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the traffic graph tables.')
+    parser.add_argument('command', choices=('load', 'refresh', 'rebuild'))
+    parser.add_argument('csv', nargs='?', help='CSV with namespace,producer,consumer,traffic columns (load)')
+    parser.add_argument('--db', default=DB_PATH)
+    args = parser.parse_args()
+
+    graph = TrafficGraph(args.db)
+    if args.command == 'load':
+        if not args.csv:
+            parser.error('load needs a CSV file')
+        print(f'Folded {graph.add_traffic(read_rows(args.csv))} rows.')
+    elif args.command == 'refresh':
+        print(f'Folded {graph.refresh()} rows.')
+    else:
+        print(f'Rebuilt from {graph.rebuild()} rows.')
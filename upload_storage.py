@@ -0,0 +1,360 @@
+"""
+Content-addressed storage for file-question uploads.
+
+Upload bodies are copied to a temporary file in CHUNK_SIZE pieces while their
+SHA-256 is computed, then committed to a blob store under that hash. A file
+that is already stored (the same evidence attached to many form versions) is
+kept once; every answer just references it as
+
+    uploads/<sha256>/<original filename>
+
+which keeps the file name as the last path segment for the frontend.
+
+Large files use a resumable session instead of a multipart form post:
+start_session(), then append() chunks at increasing offsets (a client that
+lost its connection asks status() for the offset to resume from), then
+complete() to hash and commit the assembled file. append, complete and abort
+hold an exclusive lock on the session (flock on the part file, so it also
+holds across worker processes); a second request on a busy session fails
+with SessionBusy instead of interleaving its writes. Sessions with no
+activity for SESSION_MAX_AGE seconds are removed by expire_sessions(), which
+start_session() runs at most every SWEEP_INTERVAL seconds.
+
+Blobs live on the local filesystem by default; set UPLOAD_BACKEND=gridfs to
+keep them in a GridFS bucket of the application's database instead.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows: sessions are only locked within one process
+    fcntl = None
+
+CHUNK_SIZE = 1024 * 1024
+REF_PREFIX = 'uploads'
+SESSION_MAX_AGE = float(os.getenv('UPLOAD_SESSION_MAX_AGE', 24 * 3600))
+SWEEP_INTERVAL = 3600
+
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+_SESSION_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class UnknownUpload(UploadError):
+    pass
+
+
+class SessionBusy(UploadError):
+    """Another request is appending to, completing or aborting the same session."""
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f'expected offset {offset}')
+        self.offset = offset
+
+
+def copy_hashed(src, dst, chunk_size=CHUNK_SIZE):
+    """Copy a binary stream into `dst` in chunks. Returns (sha256 hexdigest, bytes copied)."""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class LocalBlobStore:
+    """Blobs as files under <root>/blobs/<aa>/<sha256>."""
+
+    def __init__(self, root):
+        self.root = os.path.join(root, 'blobs')
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, sha):
+        return os.path.join(self.root, sha[:2], sha)
+
+    def exists(self, sha):
+        return os.path.exists(self._path(sha))
+
+    def commit(self, tmp_path, sha):
+        """Move a fully written temp file into place, or drop it if the blob already exists."""
+        path = self._path(sha)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return True
+
+    def open(self, sha):
+        try:
+            return open(self._path(sha), 'rb')
+        except FileNotFoundError:
+            raise UnknownUpload(sha)
+
+
+class GridFSBlobStore:
+    """Blobs in a GridFS bucket, one file per hash (filename = sha256)."""
+
+    def __init__(self, db, bucket_name='uploads'):
+        # `db` may be a mongo_clients.LazyDatabase: nothing connects until the first upload
+        self.db = db
+        self.bucket_name = bucket_name
+        self.files = db[f'{bucket_name}.files']
+
+    @property
+    def bucket(self):
+        from gridfs import GridFSBucket
+        from mongo_clients import resolve
+        return GridFSBucket(resolve(self.db), bucket_name=self.bucket_name, chunk_size_bytes=CHUNK_SIZE)
+
+    def create_indexes(self):
+        self.files.create_index('filename', unique=True)
+
+    def exists(self, sha):
+        return self.files.count_documents({'filename': sha}, limit=1) > 0
+
+    def commit(self, tmp_path, sha):
+        from pymongo.errors import DuplicateKeyError
+        try:
+            if self.exists(sha):
+                return False
+            with open(tmp_path, 'rb') as f:
+                self.bucket.upload_from_stream(sha, f)
+            return True
+        except DuplicateKeyError:
+            # Stored concurrently by another request
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def open(self, sha):
+        from gridfs.errors import NoFile
+        try:
+            return self.bucket.open_download_stream_by_name(sha)
+        except NoFile:
+            raise UnknownUpload(sha)
+
+
+class UploadStorage:
+    def __init__(self, blobs, root):
+        self.blobs = blobs
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.session_dir = os.path.join(root, 'sessions')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.session_dir, exist_ok=True)
+
+    @staticmethod
+    def reference(sha, filename):
+        return f'{REF_PREFIX}/{sha}/{filename}'
+
+    @staticmethod
+    def parse_reference(ref):
+        """Return (sha256, filename) for a content-addressed reference, or None for anything else."""
+        parts = ref.split('/')
+        if len(parts) == 3 and parts[0] == REF_PREFIX and _SHA256.match(parts[1]) and parts[2]:
+            return parts[1], parts[2]
+        return None
+
+    def save_stream(self, stream, filename):
+        """Store the contents of a binary stream and return its reference."""
+        filename = secure_filename(filename) or 'file'
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                sha, _ = copy_hashed(stream, tmp)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.blobs.commit(tmp_path, sha)
+        return self.reference(sha, filename)
+
+    def save(self, file):
+        """Store a werkzeug FileStorage from a multipart request."""
+        return self.save_stream(file.stream, file.filename)
+
+    def open(self, sha):
+        if not _SHA256.match(sha):
+            raise UnknownUpload(sha)
+        return self.blobs.open(sha)
+
+    # Resumable chunked uploads
+
+    def _session_paths(self, upload_id):
+        if not _SESSION_ID.match(upload_id or ''):
+            raise UnknownUpload(upload_id)
+        base = os.path.join(self.session_dir, upload_id)
+        if not os.path.exists(base + '.json'):
+            raise UnknownUpload(upload_id)
+        return base + '.json', base + '.part'
+
+    @contextmanager
+    def _locked(self, upload_id, mode='r+b'):
+        """Open the session's part file under an exclusive lock; raises SessionBusy if it is taken."""
+        meta_path, part_path = self._session_paths(upload_id)
+        try:
+            part = open(part_path, mode)
+        except FileNotFoundError:
+            raise UnknownUpload(upload_id)
+        with part:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise SessionBusy(upload_id)
+            elif not _process_locks.acquire(part_path):
+                raise SessionBusy(upload_id)
+            try:
+                # Completed or aborted while we were opening it
+                if not os.path.exists(meta_path):
+                    raise UnknownUpload(upload_id)
+                yield meta_path, part_path, part
+            finally:
+                if fcntl is None:
+                    _process_locks.release(part_path)
+
+    def start_session(self, filename):
+        self._maybe_sweep()
+        upload_id = uuid.uuid4().hex
+        base = os.path.join(self.session_dir, upload_id)
+        open(base + '.part', 'wb').close()
+        with open(base + '.json', 'w') as f:
+            json.dump({'filename': secure_filename(filename) or 'file', 'created': time.time()}, f)
+        return upload_id
+
+    def status(self, upload_id):
+        meta_path, part_path = self._session_paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            offset = os.path.getsize(part_path)
+        except FileNotFoundError:
+            raise UnknownUpload(upload_id)
+        return {'upload_id': upload_id, 'filename': meta['filename'], 'offset': offset}
+
+    def append(self, upload_id, offset, stream):
+        """Append a chunk written at `offset`; returns the new offset."""
+        with self._locked(upload_id) as (_, _, part):
+            current = part.seek(0, os.SEEK_END)
+            if offset != current:
+                raise OffsetMismatch(current)
+            shutil.copyfileobj(stream, part, CHUNK_SIZE)
+            return part.tell()
+
+    def complete(self, upload_id):
+        """Hash and commit the assembled file; returns its reference."""
+        with self._locked(upload_id, 'rb') as (meta_path, part_path, part):
+            with open(meta_path) as f:
+                filename = json.load(f)['filename']
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+            sha = digest.hexdigest()
+            # Removing the metadata first ends the session for requests waiting on the lock
+            os.remove(meta_path)
+            self.blobs.commit(part_path, sha)
+        return self.reference(sha, filename)
+
+    def abort(self, upload_id):
+        with self._locked(upload_id, 'rb') as (meta_path, part_path, _):
+            for path in (meta_path, part_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _maybe_sweep(self):
+        global _last_sweep
+        now = time.time()
+        if now - _last_sweep < SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+        self.expire_sessions()
+
+    def expire_sessions(self, max_age=SESSION_MAX_AGE, now=None):
+        """
+        Remove sessions not appended to for `max_age` seconds, part files left
+        without a session and stale temp files of interrupted saves. Returns
+        the number of sessions removed.
+        """
+        now = time.time() if now is None else now
+        expired = 0
+        for name in os.listdir(self.session_dir):
+            upload_id, ext = os.path.splitext(name)
+            base = os.path.join(self.session_dir, upload_id)
+            if ext == '.json':
+                try:
+                    with open(base + '.json') as f:
+                        created = json.load(f).get('created', 0)
+                    active = max(created, os.path.getmtime(base + '.part'))
+                except (OSError, ValueError):
+                    active = 0
+                if now - active < max_age:
+                    continue
+                try:
+                    self.abort(upload_id)
+                    expired += 1
+                except UploadError:
+                    pass  # In use, or finished meanwhile
+            elif ext == '.part' and not os.path.exists(base + '.json'):
+                _remove_older(base + '.part', now - max_age)
+        for name in os.listdir(self.tmp_dir):
+            _remove_older(os.path.join(self.tmp_dir, name), now - max_age)
+        return expired
+
+
+def _remove_older(path, cutoff):
+    try:
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+class _ProcessLocks:
+    """Per-path non-blocking locks for platforms without flock."""
+
+    def __init__(self):
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, path):
+        with self._lock:
+            if path in self._held:
+                return False
+            self._held.add(path)
+            return True
+
+    def release(self, path):
+        with self._lock:
+            self._held.discard(path)
+
+
+_process_locks = _ProcessLocks()
+_last_sweep = 0.0
+
+
+def make_storage(root, db=None):
+    """Build the UploadStorage selected by UPLOAD_BACKEND (local or gridfs)."""
+    if os.getenv('UPLOAD_BACKEND', 'local') == 'gridfs':
+        if db is None:
+            raise RuntimeError('UPLOAD_BACKEND=gridfs needs a database')
+        return UploadStorage(GridFSBlobStore(db), root)
+    return UploadStorage(LocalBlobStore(root), root)